@@ -0,0 +1,77 @@
+"""Measure the memory used per expression node.
+
+Run with `python benchmarks/memory.py`. Each node type is instantiated many
+times while tracemalloc records the allocated bytes, and the average size of
+a node (excluding its children and shared arguments) is reported. The size of
+a large generated formula is then compared as a tree and as an `ExprGraph`.
+"""
+
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from notion_formulas import (
+    BinaryOperation,
+    Constant,
+    ExprGraph,
+    Function,
+    Number,
+    UnaryOperation,
+    if_,
+    prop,
+)
+
+COUNT = 100_000
+
+NODES: List[Callable[[], object]] = [
+    lambda: Constant("e"),
+    lambda: Function("now"),
+    lambda: Function("prop", "Status"),
+    lambda: UnaryOperation(8, "-", 1),
+    lambda: BinaryOperation(6, " + ", 1, 2),
+]
+
+
+def measure(factory: Callable[[], object]) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    nodes = [factory() for _ in range(COUNT)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    name = type(nodes[0]).__name__
+    per_node = (after - before - COUNT * 8) / COUNT  # exclude the list itself
+    print(f"{name:16} {per_node:8.1f} bytes/node")
+    return per_node
+
+
+def build_formula(terms: int) -> Number:
+    value: Number = 0
+    for index in range(terms):
+        status = prop(f"Status {index % 100}")
+        value = value + (index % 7 + 1) * if_(status == f"Option {index}", 1, 0)
+    return value
+
+
+def measure_graph(terms: int) -> Tuple[float, float]:
+    tracemalloc.start()
+    formula = build_formula(terms)
+    tree = tracemalloc.get_traced_memory()[0]
+    graph = ExprGraph.from_expr(formula)
+    total = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    nodes = len(graph)
+    print(f"{'tree':16} {tree / nodes:8.1f} bytes/node ({nodes} nodes)")
+    print(f"{'ExprGraph':16} {(total - tree) / nodes:8.1f} bytes/node")
+    return tree / nodes, (total - tree) / nodes
+
+
+def main() -> None:
+    for factory in NODES:
+        measure(factory)
+    print()
+    measure_graph(100_000)
+
+
+if __name__ == "__main__":
+    main()
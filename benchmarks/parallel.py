@@ -0,0 +1,77 @@
+"""Measure how evaluation over many rows scales with worker processes.
+
+Run with `python benchmarks/parallel.py [ROWS] [MAX_WORKERS]`. A generated
+formula is evaluated over the rows with `compile_expr` in this process, then
+with `evaluate_parallel` and a doubling number of workers from 2, up to the
+number of CPUs by default. The time taken, the throughput and the speedup
+over a single process are reported.
+"""
+
+import datetime
+import functools
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+from notion_formulas import (
+    Number,
+    compile_expr,
+    date_between,
+    evaluate_parallel,
+    if_,
+    now,
+    prop,
+)
+
+NOW = datetime.datetime(2024, 1, 31, tzinfo=datetime.timezone.utc)
+
+
+def build_formula(terms: int) -> Number:
+    value: Number = date_between(prop("Due"), now(), "days")
+    for index in range(terms):
+        status = prop(f"Status {index % 10}")
+        value = value + (index % 7 + 1) * if_(status == f"Option {index}", 1, 0)
+    return value
+
+
+def build_rows(count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "Due": NOW + datetime.timedelta(hours=index),
+            **{f"Status {column}": f"Option {index % 200}" for column in range(10)},
+        }
+        for index in range(count)
+    ]
+
+
+def measure(label: str, function: Any, count: int, baseline: float = 0.0) -> float:
+    started = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - started
+    speedup = f"{baseline / elapsed:6.2f}x" if baseline else ""
+    print(f"{label:16} {elapsed:8.3f} s {count / elapsed:10,.0f} rows/s {speedup}")
+    return elapsed
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    formula = build_formula(200)
+    rows = build_rows(count)
+    print(f"{count} rows, {os.cpu_count()} CPUs")
+
+    compiled = compile_expr(formula, now=NOW)
+    baseline = measure("compile_expr", lambda: [compiled(row) for row in rows], count)
+    # A single worker evaluates in this process, like the baseline.
+    workers = 2
+    while workers <= limit:
+        parallel = functools.partial(
+            evaluate_parallel, formula, rows, workers=workers, now=NOW
+        )
+        measure(f"{workers} workers", parallel, count, baseline)
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
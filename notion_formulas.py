@@ -1,9 +1,45 @@
 from __future__ import annotations
 
 import abc
+import argparse
+import array
+import builtins
+import calendar
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import datetime
+import decimal
+import functools
+import hashlib
+import importlib
+import inspect
 import json
+import math
+import operator
+import os
+import re
+import runpy
 import sys
-from typing import Any, TypeVar, Union, cast
+import weakref
+from typing import (
+    IO,
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 
 if sys.version_info < (3, 8):
     from typing_extensions import Literal, Protocol
@@ -11,9 +47,9 @@ else:
     from typing import Literal, Protocol
 
 if sys.version_info < (3, 10):
-    from typing_extensions import TypeAlias
+    from typing_extensions import TypeAlias, TypeGuard
 else:
-    from typing import TypeAlias
+    from typing import TypeAlias, TypeGuard
 
 
 __author__ = "Trevor Olson"
@@ -43,6 +79,8 @@ DateUnit = Union[
     "StringExpr",
 ]
 
+Dialect = Literal["legacy", "2.0"]
+
 # Precedence | Operator
 # ==================================
 #         11 | function
@@ -60,6 +98,11 @@ DateUnit = Union[
 
 
 class ExprImpl(abc.ABC):
+    __slots__ = ()
+
+    _encoded: str | None = None
+    _fingerprint: bytes | None = None
+
     @abc.abstractproperty
     def precedence(self) -> int:
         ...
@@ -301,54 +344,172 @@ class DateExpr(Protocol):
         return larger_eq(self, other)
 
 
-class Constant(ExprImpl):
+class _NodeMeta(abc.ABCMeta):
+    def __call__(cls, *args: Any, **kwargs: Any) -> Any:
+        if not _interners:
+            return super().__call__(*args, **kwargs)
+        node_type = cast("type[_Node]", cls)
+        if kwargs:
+            signature = inspect.signature(node_type.__init__)
+            args = signature.bind(None, *args, **kwargs).args[1:]
+        return _interners[-1].intern(node_type, args)
+
+
+class _Node(ExprImpl, metaclass=_NodeMeta):
+    """Base class of the built-in expression nodes.
+
+    Nodes are slotted to keep them small and are immutable once constructed,
+    which is what allows their encodings to be memoized.
+    """
+
+    __slots__ = ("__weakref__", "_encoded", "_fingerprint")
+
+    _encoded: str | None
+    _fingerprint: bytes | None
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+
+class Interner:
+    """Shares a single node between structurally identical expressions.
+
+    While the interner is active, constructing a node identical to a live node
+    previously built through the same interner returns the existing node. The
+    interner only holds weak references, so unused nodes are still freed.
+
+        interner = Interner()
+        with interner:
+            assert prop("Status") is prop("Status")
+    """
+
+    def __init__(self) -> None:
+        self._nodes: weakref.WeakValueDictionary[tuple[Any, ...], _Node] = (
+            weakref.WeakValueDictionary()
+        )
+
+    def __enter__(self) -> Interner:
+        _interners.append(self)
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        _interners.remove(self)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def intern(self, cls: type[_Node], args: tuple[Any, ...]) -> _Node:
+        """Returns the node of type `cls` constructed from `args`, reusing an
+        identical live node when there is one."""
+        # Children are keyed by identity, which is structural as long as they
+        # were interned too. Scalars are keyed with their type so that `1`,
+        # `1.0` and `True` stay distinct, and floats by their representation
+        # so that `0.0` and `-0.0` do too.
+        key = (cls, *((type(arg), _intern_key(arg)) for arg in args))
+        node = self._nodes.get(key)
+        if node is None:
+            node = type.__call__(cls, *args)
+            self._nodes[key] = node
+        return node
+
+
+def _intern_key(value: Any) -> Any:
+    if isinstance(value, ExprImpl):
+        return builtins.id(value)
+    return repr(value) if isinstance(value, float) else value
+
+
+_interners: list[Interner] = []
+
+
+class Constant(_Node):
+    __slots__ = ("name",)
+
     precedence = 12
 
+    name: str
+
     def __init__(self, name: str) -> None:
-        self.name = name
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "_encoded", None)
+        object.__setattr__(self, "_fingerprint", None)
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (Constant, (self.name,))
 
     def encode(self) -> str:
-        return self.name
+        return encode(self)
+
 
+class Function(_Node):
+    __slots__ = ("args", "name")
 
-class Function(ExprImpl):
     precedence = 11
 
+    name: str
+    args: tuple[Expr, ...]
+
     def __init__(self, name: str, *args: Expr) -> None:
-        self.name = name
-        self.args = args
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "args", args)
+        object.__setattr__(self, "_encoded", None)
+        object.__setattr__(self, "_fingerprint", None)
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (Function, (self.name, *self.args))
 
     def encode(self) -> str:
-        args = ", ".join(encode(arg) for arg in self.args)
-        return f"{self.name}({args})"
+        return encode(self)
 
 
-class UnaryOperation(ExprImpl):
-    precedence = 0
+class UnaryOperation(_Node):
+    __slots__ = ("operand", "operator", "precedence")
+
+    precedence: int
+    operator: str
+    operand: Expr
 
     def __init__(self, precedence: int, operator: str, operand: Expr) -> None:
-        self.precedence = precedence
-        self.operator = operator
-        self.operand = operand
+        object.__setattr__(self, "precedence", precedence)
+        object.__setattr__(self, "operator", operator)
+        object.__setattr__(self, "operand", operand)
+        object.__setattr__(self, "_encoded", None)
+        object.__setattr__(self, "_fingerprint", None)
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (UnaryOperation, (self.precedence, self.operator, self.operand))
 
     def encode(self) -> str:
-        operand = _encode_with_precedence_right(self.precedence, self.operand)
-        return f"{self.operator}{operand}"
+        return encode(self)
 
 
-class BinaryOperation(ExprImpl):
-    precedence = 0
+class BinaryOperation(_Node):
+    __slots__ = ("left", "operator", "precedence", "right")
+
+    precedence: int
+    operator: str
+    left: Expr
+    right: Expr
 
     def __init__(self, precedence: int, operator: str, left: Expr, right: Expr) -> None:
-        self.precedence = precedence
-        self.operator = operator
-        self.left = left
-        self.right = right
+        object.__setattr__(self, "precedence", precedence)
+        object.__setattr__(self, "operator", operator)
+        object.__setattr__(self, "left", left)
+        object.__setattr__(self, "right", right)
+        object.__setattr__(self, "_encoded", None)
+        object.__setattr__(self, "_fingerprint", None)
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (
+            BinaryOperation,
+            (self.precedence, self.operator, self.left, self.right),
+        )
 
     def encode(self) -> str:
-        left = _encode_with_precedence_left(self.precedence, self.left)
-        right = _encode_with_precedence_right(self.precedence, self.right)
-        return f"{left}{self.operator}{right}"
+        return encode(self)
 
 
 #
@@ -761,23 +922,117 @@ def select(*tests: tuple[Boolean, _T], default: _T) -> _T:
     return default
 
 
+def lookup(
+    key: String | Number,
+    mapping: Mapping[Any, _T] | Iterable[tuple[Any, _T]],
+    default: _T,
+) -> _T:
+    """Looks up a key in a mapping of literal keys to values.
+
+    The mapping may be any iterable of key-value pairs, such as a generator
+    reading a CSV file, and the first entry of each key wins. Mappings from
+    strings to string or number literals compile to a single table string and
+    one `replace` extracting the value, given a literal default; as with
+    select options, those keys must not contain commas, equals signs or line
+    breaks, nor the values and the default commas or line breaks. Mappings
+    from numbers compile to a balanced tree of comparisons. Other mappings
+    fall back to a chain of tests like `select`.
+    """
+    items = mapping.items() if isinstance(mapping, Mapping) else mapping
+    pairs: list[tuple[Any, _T]] = []
+    seen: set[tuple[bool, Any]] = set()
+    for item_key, value in items:
+        if (isinstance(item_key, str), item_key) not in seen:
+            seen.add((isinstance(item_key, str), item_key))
+            pairs.append((item_key, value))
+
+    if all(_is_number_literal(item_key) for item_key, _ in pairs):
+        pairs.sort(key=operator.itemgetter(0))
+        return _lookup_tree(key, pairs, default, 0, len(pairs))
+
+    table = _lookup_table(cast(String, key), pairs, default)
+    if table is not None:
+        return cast(_T, table)
+    return select(
+        *((equal(key, item_key), value) for item_key, value in pairs), default=default
+    )
+
+
+def _lookup_tree(
+    key: Any, pairs: list[tuple[Any, _T]], default: _T, low: int, high: int
+) -> _T:
+    if high - low <= 2:
+        result = default
+        for index in range(high - 1, low - 1, -1):
+            result = if_(equal(key, pairs[index][0]), pairs[index][1], result)
+        return result
+
+    middle = (low + high) // 2
+    return if_(
+        smaller(key, pairs[middle][0]),
+        _lookup_tree(key, pairs, default, low, middle),
+        _lookup_tree(key, pairs, default, middle, high),
+    )
+
+
+def _lookup_table(
+    key: String, pairs: list[tuple[Any, Any]], default: Any
+) -> Expr | None:
+    """Compiles a mapping from strings to literals into a table string like
+    `",a=1,b=2,"`, or returns None if the mapping can't be represented."""
+    numbers = all(_is_number_literal(value) for _, value in pairs)
+    if numbers:
+        entries = [(item_key, _format_number(value)) for item_key, value in pairs]
+    elif all(isinstance(value, str) for _, value in pairs):
+        entries = pairs
+    else:
+        return None
+
+    # The value of an expression may contain anything, so it can't be part of
+    # the table, and testing for a match separately would run the pattern and
+    # write it out twice.
+    if numbers != _is_number_literal(default) or not _is_literal(default):
+        return None
+    default = _format_number(default) if numbers else default
+    if _TABLE_VALUE.search(default):
+        return None
+
+    for item_key, value in entries:
+        if _TABLE_KEY.search(item_key) or _TABLE_VALUE.search(value):
+            return None
+
+    # A key containing a comma or an equals sign could match across entries,
+    # so those characters are escaped as `(?!)`, which never matches.
+    table = "".join(f",{item_key}={value}" for item_key, value in entries)
+    escaped = replace_all(key, r"[.*+?^${}()|[\]\\]", r"\$&")
+    escaped = replace_all(escaped, "[,=]", "(?!)")
+
+    # The default is appended as an entry without a key, matched by a second
+    # alternative when the first doesn't match.
+    subject = f"{table},={default},"
+    pattern = add(add("^(?:.*?,", escaped), "=([^,]*),.*|.*,=([^,]*),)$")
+    result = replace(subject, pattern, "$1$2")
+    return to_number(result) if numbers else result
+
+
+# Line breaks would stop the `.` of the pattern from crossing entries.
+_TABLE_KEY = re.compile("[,=\n\r\u2028\u2029]")
+_TABLE_VALUE = re.compile("[,\n\r\u2028\u2029]")
+
+
 def list_length(value: String) -> Number:
     """Returns the number of items in a multi-select list."""
-    return if_(empty(value), 0, length(replace_all(value, "[^,]", "")) + 1)
+    return Function("listLength", value)
 
 
 def lowercase(value: String) -> String:
     """Returns a string with all uppercase letters converted to lowercase."""
-    for letter in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":
-        value = replace_all(value, letter, letter.lower())
-    return value
+    return Function("lower", value)
 
 
 def uppercase(value: String) -> String:
     """Returns a string with all lowercase letters converted to uppercase."""
-    for letter in "abcdefghijklmnopqrstuvwxyz":
-        value = replace_all(value, letter, letter.upper())
-    return value
+    return Function("upper", value)
 
 
 def format_number(value: Number) -> String:
@@ -794,35 +1049,4969 @@ def progressbar(
     percent: Number, full: str = "■", empty: str = "□", size: int = 10
 ) -> String:
     """Returns a progress bar representing the percentage."""
-    num_full = floor(size * percent)
-    num_empty = size - num_full
-    return slice(size * full, 0, num_full) + slice(size * empty, 0, num_empty)
+    return Function("progressbar", percent, full, empty, size)
 
 
 #
 # Serialization
 #
-def encode(value: Expr) -> str:
-    if isinstance(value, (bool, int, float, str)):
-        return json.dumps(value)
-    return value.encode()
+def encode(value: Expr, *, cse: bool = False, dialect: Dialect = "legacy") -> str:
+    """Serialize an expression to a Notion formula.
+
+    The `dialect` selects the formula language to target: `"legacy"` for
+    Notion's original function set, or `"2.0"` for Formulas 2.0, where
+    utilities such as `lowercase` and `progressbar` compile to native functions.
+    With `cse`, repeated subexpressions are bound once with `let` (see
+    `bind_common`), which requires the 2.0 formula language.
+    """
+    return "".join(iter_encode(value, cse=cse, dialect=dialect))
+
+
+def encode_to(
+    value: Expr,
+    stream: IO[str],
+    chunk_size: int = 65536,
+    *,
+    cse: bool = False,
+    dialect: Dialect = "legacy",
+) -> None:
+    """Serialize an expression to a Notion formula, writing it to a stream.
+
+    Fragments are buffered and written in chunks of roughly `chunk_size`
+    characters, so large formulas never need to be held in memory whole.
+    """
+    buffer: list[str] = []
+    size = 0
+    for fragment in iter_encode(value, cse=cse, dialect=dialect):
+        buffer.append(fragment)
+        size += len(fragment)
+        if size >= chunk_size:
+            stream.write("".join(buffer))
+            buffer.clear()
+            size = 0
+    if buffer:
+        stream.write("".join(buffer))
+
+
+def iter_encode(
+    value: Expr, *, cse: bool = False, dialect: Dialect = "legacy"
+) -> Iterator[str]:
+    """Serialize an expression to a Notion formula, yielding it in fragments.
+
+    The tree is walked with an explicit stack rather than by recursion, so
+    expressions of any depth can be encoded in time linear in the output.
+    Subexpressions referenced more than once are encoded a single time and
+    memoized on the node.
+    """
+    if cse and dialect != "2.0":
+        raise ValueError("cse requires the 2.0 dialect, which has let()")
+    value = _lower(value, dialect)
+    if cse:
+        value = bind_common(value)
+
+    if not isinstance(value, ExprImpl):
+        yield json.dumps(value)
+        return
+
+    _cache_shared(value)
+    yield from _iter_fragments(value)
+
+
+def _iter_fragments(value: ExprImpl) -> Iterator[str]:
+    stack: list[str | ExprImpl] = [value]
+
+    while stack:
+        item = stack.pop()
+
+        if isinstance(item, str):
+            yield item
+        elif item._encoded is not None:
+            yield item._encoded
+        elif isinstance(item, Constant):
+            yield item.name
+        elif isinstance(item, Function):
+            stack.append(")")
+            for index in range(len(item.args) - 1, -1, -1):
+                _push_operand(stack, item.args[index], False)
+                if index:
+                    stack.append(", ")
+            yield f"{item.name}("
+        elif isinstance(item, UnaryOperation):
+            _push_operand(
+                stack,
+                item.operand,
+                _needs_parens_right(item.precedence, item.operand),
+            )
+            yield item.operator
+        elif isinstance(item, BinaryOperation):
+            _push_operand(
+                stack,
+                item.right,
+                _needs_parens_right(item.precedence, item.right),
+            )
+            stack.append(item.operator)
+            _push_operand(
+                stack,
+                item.left,
+                _needs_parens_left(item.precedence, item.left),
+            )
+        else:
+            yield item.encode()
+
+
+def _cache_shared(value: ExprImpl) -> None:
+    """Memoize the encoding of every node referenced more than once."""
+    counts: dict[int, int] = {}
+    order: list[ExprImpl] = []
+    stack: list[tuple[ExprImpl, bool]] = [(value, False)]
+
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+            continue
+
+        key = builtins.id(node)
+        if key in counts:
+            counts[key] += 1
+            continue
+
+        counts[key] = 1
+        if node._encoded is not None:
+            continue
+
+        stack.append((node, True))
+        for child in _children(node):
+            if isinstance(child, ExprImpl):
+                stack.append((child, False))
+
+    # Children always precede their parents in `order`, so each shared node
+    # is encoded on top of the already memoized encodings of its descendants.
+    for node in order:
+        if counts[builtins.id(node)] > 1 and isinstance(node, _Node):
+            object.__setattr__(node, "_encoded", "".join(_iter_fragments(node)))
+
+
+def _children(value: ExprImpl) -> tuple[Expr, ...]:
+    if isinstance(value, Function):
+        return value.args
+    if isinstance(value, UnaryOperation):
+        return (value.operand,)
+    if isinstance(value, BinaryOperation):
+        return (value.left, value.right)
+    return ()
+
+
+def _push_operand(stack: list[str | ExprImpl], other: Expr, parens: bool) -> None:
+    if not isinstance(other, ExprImpl):
+        stack.append(json.dumps(other))
+    elif parens:
+        stack.append(")")
+        stack.append(other)
+        stack.append("(")
+    else:
+        stack.append(other)
 
 
-def _encode_with_precedence_left(precedence: int, other: Expr) -> str:
-    if not isinstance(other, ExprImpl):
-        return encode(other)
+def _needs_parens_left(precedence: int, other: Expr) -> bool:
+    return isinstance(other, ExprImpl) and other.precedence < precedence
 
-    if other.precedence >= precedence:
-        return encode(other)
 
-    return f"({encode(other)})"
+def _needs_parens_right(precedence: int, other: Expr) -> bool:
+    return isinstance(other, ExprImpl) and other.precedence <= precedence
 
 
-def _encode_with_precedence_right(precedence: int, other: Expr) -> str:
-    if not isinstance(other, ExprImpl):
-        return encode(other)
+#
+# Dialects
+#
+def _lower(value: Expr, dialect: Dialect) -> Expr:
+    """Rewrites an expression into the functions available in `dialect`.
+
+    Utilities without a native equivalent in the target language are
+    expanded, functions renamed in Formulas 2.0 get their new names, and in
+    2.0 chains of nested `if` calls are collapsed into a single `ifs`.
+    """
+    if dialect not in _MACROS:
+        raise ValueError(f"unknown dialect: {dialect!r}")
+    if not isinstance(value, ExprImpl):
+        return value
+
+    lowering = _Lowering(value, dialect)
+    return _transform(value, lowering.rewrite, lowering.is_interior)
+
+
+class _Lowering:
+    def __init__(self, value: ExprImpl, dialect: Dialect) -> None:
+        self.macros = _MACROS[dialect]
+        self.renames = _RENAMES[dialect]
+        self.ifs = dialect == "2.0"
+        # The `if` calls in the else branch of another, which are collected
+        # into the `ifs` of the outermost call of their chain.
+        self.interior: set[int] = set()
+        if self.ifs:
+            for node in _postorder(value):
+                if _is_if(node) and _is_if(node.args[2]):
+                    self.interior.add(builtins.id(node.args[2]))
+
+    def is_interior(self, node: ExprImpl) -> bool:
+        return builtins.id(node) in self.interior
+
+    def rewrite(self, node: ExprImpl) -> Expr:
+        if not isinstance(node, Function):
+            return node
+        if node.name in self.macros:
+            return self.macros[node.name](*node.args)
+        if node.name in self.renames:
+            return Function(self.renames[node.name], *node.args)
+        if self.ifs and _is_if(node) and _is_if(node.args[2]):
+            return _ifs(node)
+        return node
+
+
+def _is_if(value: Expr) -> TypeGuard[Function]:
+    return isinstance(value, Function) and value.name == "if" and len(value.args) == 3
+
+
+def _ifs(node: Function) -> Function:
+    args: list[Expr] = []
+    value: Expr = node
+    while _is_if(value):
+        args.extend(value.args[:2])
+        value = value.args[2]
+    return Function("ifs", *args, value)
+
+
+def _legacy_list_length(value: String) -> Number:
+    return if_(empty(value), 0, length(replace_all(value, "[^,]", "")) + 1)
+
+
+def _legacy_lowercase(value: String) -> String:
+    for letter in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":
+        value = replace_all(value, letter, letter.lower())
+    return value
+
+
+def _legacy_uppercase(value: String) -> String:
+    for letter in "abcdefghijklmnopqrstuvwxyz":
+        value = replace_all(value, letter, letter.upper())
+    return value
+
+
+def _legacy_progressbar(percent: Number, full: str, empty: str, size: int) -> String:
+    # Both halves are cut from a single string with the full characters before
+    # the empty ones, with a window of `size` characters sliding over it. The
+    # window's end is clamped, so that a percent outside of 0-1 gives a full or
+    # an empty bar, and the window is then the last `size` characters before it.
+    num_full = max(0, min(size, floor(size * percent)))
+    return slice(slice(size * full + size * empty, 0, 2 * size - num_full), -size)
+
+
+def _progressbar(percent: Number, full: str, empty: str, size: int) -> String:
+    num_full = floor(size * percent)
+    bar: String = Function("repeat", full, num_full)
+    return bar + Function("repeat", empty, size - num_full)
+
+
+# Utilities without a native counterpart, by dialect, and how to expand them.
+_MACROS: dict[str, dict[str, Callable[..., Expr]]] = {
+    "legacy": {
+        "listLength": _legacy_list_length,
+        "lower": _legacy_lowercase,
+        "upper": _legacy_uppercase,
+        "progressbar": _legacy_progressbar,
+    },
+    "2.0": {
+        "listLength": lambda value: length(value),
+        "progressbar": _progressbar,
+    },
+}
+
+_RENAMES: dict[str, dict[str, str]] = {
+    "legacy": {},
+    "2.0": {"start": "dateStart", "end": "dateEnd", "slice": "substring"},
+}
+
+
+#
+# Identity
+#
+def fingerprint(value: Expr) -> str:
+    """Returns a stable digest of an expression's structure.
+
+    Structurally identical expressions have the same fingerprint, whether or
+    not they share nodes, and the digest is stable across processes and Python
+    versions. It is computed once per node and memoized.
+    """
+    return _digest(value).hex()
+
+
+def same(value: Expr, other: Expr) -> bool:
+    """Returns true if two expressions are structurally identical."""
+    return _digest(value) == _digest(other)
+
+
+class ExprKey:
+    """A hashable wrapper comparing expressions by structure, for use as a
+    dictionary key or set member."""
+
+    __slots__ = ("_digest", "value")
+
+    def __init__(self, value: Expr) -> None:
+        self.value = value
+        self._digest = _digest(value)
+
+    def __hash__(self) -> int:
+        return hash(self._digest)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ExprKey):
+            return NotImplemented
+        return self._digest == other._digest
+
+    def __repr__(self) -> str:
+        return f"ExprKey({encode(self.value)})"
+
+
+def _digest(value: Expr) -> bytes:
+    if not isinstance(value, ExprImpl):
+        return _hash(b"S", json.dumps(value).encode())
+    if value._fingerprint is not None:
+        return value._fingerprint
+
+    digests: dict[int, bytes] = {}
+    for node in _postorder(value, lambda node: node._fingerprint is not None):
+        digest = node._fingerprint
+        if digest is None:
+            children = []
+            for child in _children(node):
+                if isinstance(child, ExprImpl):
+                    children.append(digests[builtins.id(child)])
+                else:
+                    children.append(_digest(child))
+
+            digest = _node_digest(node, children)
+            if isinstance(node, _Node):
+                object.__setattr__(node, "_fingerprint", digest)
+
+        digests[builtins.id(node)] = digest
+
+    return digests[builtins.id(value)]
+
+
+def _node_digest(node: ExprImpl, children: list[bytes]) -> bytes:
+    if isinstance(node, Constant):
+        return _hash(b"C", node.name.encode())
+    if isinstance(node, Function):
+        return _hash(b"F", node.name.encode(), *children)
+    if isinstance(node, (UnaryOperation, BinaryOperation)):
+        operator = f"{node.precedence}{node.operator}".encode()
+        return _hash(b"O", operator, *children)
+    return _hash(b"X", node.encode().encode())
+
+
+def _hash(tag: bytes, *fields: bytes) -> bytes:
+    digest = hashlib.blake2b(tag, digest_size=16)
+    for field in fields:
+        digest.update(len(field).to_bytes(4, "big"))
+        digest.update(field)
+    return digest.digest()
+
+
+def _postorder(
+    value: ExprImpl, skip: Callable[[ExprImpl], bool] | None = None
+) -> list[ExprImpl]:
+    """Returns the distinct nodes of an expression, children before parents.
+
+    The descendants of nodes matching `skip` are not visited.
+    """
+    seen: set[int] = set()
+    order: list[ExprImpl] = []
+    stack: list[tuple[ExprImpl, bool]] = [(value, False)]
+
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+            continue
+
+        key = builtins.id(node)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        stack.append((node, True))
+        if skip is None or not skip(node):
+            for child in _children(node):
+                if isinstance(child, ExprImpl):
+                    stack.append((child, False))
+
+    return order
+
+
+#
+# Graphs
+#
+_LITERAL = 0
+_CONSTANT = 1
+_FUNCTION = 2
+_UNARY = 3
+_BINARY = 4
+
+
+class ExprGraph:
+    """A compact, array-backed representation of an expression.
+
+    Each distinct node is stored once, children before parents, in a set of
+    parallel `array` buffers: its kind, an index into the string pool (its
+    name or operator) or the literal pool, its precedence, and the offsets of
+    its children. Shared subexpressions stay shared, and the whole graph
+    pickles as a handful of flat buffers.
+    """
+
+    __slots__ = (
+        "children",
+        "kinds",
+        "literals",
+        "names",
+        "offsets",
+        "precedences",
+        "strings",
+    )
+
+    def __init__(self) -> None:
+        self.kinds = array.array("B")
+        self.names = array.array("I")
+        self.precedences = array.array("B")
+        self.offsets = array.array("I", [0])
+        self.children = array.array("I")
+        self.strings: list[str] = []
+        self.literals: list[Scalar] = []
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    @classmethod
+    def from_expr(cls, value: Expr) -> ExprGraph:
+        """Builds a graph from an expression tree."""
+        builder = _GraphBuilder(cls())
+        if not isinstance(value, ExprImpl):
+            builder.add_literal(cast(Scalar, value))
+        else:
+            for node in _postorder(value):
+                builder.add_node(node)
+        return builder.graph
+
+    def _append(
+        self, kind: int, name: int, precedence: int, children: Iterable[int]
+    ) -> int:
+        self.kinds.append(kind)
+        self.names.append(name)
+        self.precedences.append(precedence)
+        self.children.extend(children)
+        self.offsets.append(len(self.children))
+        return len(self.kinds) - 1
+
+    def to_expr(self) -> Expr:
+        """Rebuilds the expression tree represented by the graph."""
+        nodes: list[Expr] = []
+        for index, kind in enumerate(self.kinds):
+            name = self.names[index]
+            args = [nodes[child] for child in self._children(index)]
+            if kind == _LITERAL:
+                nodes.append(self.literals[name])
+            elif kind == _CONSTANT:
+                nodes.append(Constant(self.strings[name]))
+            elif kind == _FUNCTION:
+                nodes.append(Function(self.strings[name], *args))
+            elif kind == _UNARY:
+                nodes.append(
+                    UnaryOperation(self.precedences[index], self.strings[name], *args)
+                )
+            else:
+                nodes.append(
+                    BinaryOperation(self.precedences[index], self.strings[name], *args)
+                )
+        return nodes[-1]
+
+    def encode(self, *, dialect: Dialect = "legacy") -> str:
+        """Serialize the graph to a Notion formula."""
+        return "".join(self.iter_encode(dialect=dialect))
+
+    def iter_encode(self, *, dialect: Dialect = "legacy") -> Iterator[str]:
+        """Serialize the graph to a Notion formula, yielding it in fragments.
+
+        Nodes referenced more than once are encoded a single time. Graphs
+        using functions that need rewriting for `dialect` are encoded through
+        the expression tree.
+        """
+        if dialect not in _MACROS:
+            raise ValueError(f"unknown dialect: {dialect!r}")
+        lowered = {*_MACROS[dialect], *_RENAMES[dialect]}
+        if dialect == "2.0":
+            lowered.add("if")
+        if not lowered.isdisjoint(self.strings):
+            yield from iter_encode(self.to_expr(), dialect=dialect)
+            return
+
+        counts = array.array("I", [0]) * len(self)
+        for child in self.children:
+            counts[child] += 1
+
+        memo: dict[int, str] = {}
+        for index, count in enumerate(counts):
+            if count > 1:
+                memo[index] = "".join(self._iter_fragments(index, memo))
+
+        yield from self._iter_fragments(len(self) - 1, memo)
+
+    def _children(self, index: int) -> array.array[int]:
+        return self.children[self.offsets[index] : self.offsets[index + 1]]
+
+    def _iter_fragments(self, root: int, memo: dict[int, str]) -> Iterator[str]:
+        kinds, names, precedences = self.kinds, self.names, self.precedences
+        stack: list[str | int] = [root]
+
+        while stack:
+            item = stack.pop()
+
+            if isinstance(item, str):
+                yield item
+            elif item in memo:
+                yield memo[item]
+            elif kinds[item] == _LITERAL:
+                yield json.dumps(self.literals[names[item]])
+            elif kinds[item] == _CONSTANT:
+                yield self.strings[names[item]]
+            elif kinds[item] == _FUNCTION:
+                args = self._children(item)
+                stack.append(")")
+                for index in range(len(args) - 1, -1, -1):
+                    stack.append(args[index])
+                    if index:
+                        stack.append(", ")
+                yield f"{self.strings[names[item]]}("
+            else:
+                precedence = precedences[item]
+                args = self._children(item)
+                if kinds[item] == _BINARY:
+                    self._push_operand(stack, args[1], precedence + 1)
+                    stack.append(self.strings[names[item]])
+                    self._push_operand(stack, args[0], precedence)
+                else:
+                    self._push_operand(stack, args[0], precedence + 1)
+                    yield self.strings[names[item]]
+
+    def _push_operand(self, stack: list[str | int], index: int, minimum: int) -> None:
+        if self.precedences[index] < minimum:
+            stack.append(")")
+            stack.append(index)
+            stack.append("(")
+        else:
+            stack.append(index)
+
+
+class _GraphBuilder:
+    def __init__(self, graph: ExprGraph) -> None:
+        self.graph = graph
+        self.strings: dict[str, int] = {}
+        self.literals: dict[tuple[type, Scalar], int] = {}
+        self.nodes: dict[int, int] = {}
+
+    def add_node(self, node: ExprImpl) -> None:
+        children = []
+        for child in _children(node):
+            if isinstance(child, ExprImpl):
+                children.append(self.nodes[builtins.id(child)])
+            else:
+                children.append(self.add_literal(cast(Scalar, child)))
+
+        if isinstance(node, Constant):
+            kind, name = _CONSTANT, node.name
+        elif isinstance(node, Function):
+            kind, name = _FUNCTION, node.name
+        elif isinstance(node, UnaryOperation):
+            kind, name = _UNARY, node.operator
+        elif isinstance(node, BinaryOperation):
+            kind, name = _BINARY, node.operator
+        else:
+            raise TypeError(f"cannot convert {type(node).__name__} to a graph")
+
+        self.nodes[builtins.id(node)] = self.graph._append(
+            kind, self.add_string(name), node.precedence, children
+        )
+
+    def add_string(self, string: str) -> int:
+        if string not in self.strings:
+            self.strings[string] = len(self.graph.strings)
+            self.graph.strings.append(string)
+        return self.strings[string]
+
+    def add_literal(self, literal: Scalar) -> int:
+        key = (type(literal), literal)
+        if key not in self.literals:
+            self.graph.literals.append(literal)
+            self.literals[key] = self.graph._append(
+                _LITERAL, len(self.graph.literals) - 1, 255, ()
+            )
+        return self.literals[key]
+
+
+#
+# Analysis
+#
+class Analysis(NamedTuple):
+    """Static measures of an expression, as returned by `analyze`.
+
+    Counts are taken over the formula as written, so a subexpression that is
+    shared counts once for every place it occurs, except in `unique_nodes`.
+    """
+
+    nodes: int
+    unique_nodes: int
+    depth: int
+    length: int
+    regex_calls: int
+    prop_refs: int
+    date_calls: int
+    cost: float
+
+
+def analyze(value: Expr, *, dialect: Dialect = "legacy") -> Analysis:
+    """Measures the size and estimated evaluation cost of an expression.
+
+    The expression is measured as encoded for `dialect`. Literals are not
+    counted as nodes. The cost weighs every node by the entries of a cost
+    table, with regex-backed calls the most expensive, and counts only the
+    costliest branch of an `if`, estimating the worst-case work per row.
+    """
+    value = _lower(value, dialect)
+    if not isinstance(value, ExprImpl):
+        return Analysis(0, 0, 0, len(json.dumps(value)), 0, 0, 0, 0)
+
+    nodes = _postorder(value)
+    stats: dict[int, Analysis] = {}
+    costs: dict[int, float] = {}
+    for node in nodes:
+        costs[builtins.id(node)] = _cost(node, _child_costs(node, costs))
+        children = [
+            stats[builtins.id(child)]
+            for child in _children(node)
+            if isinstance(child, ExprImpl)
+        ]
+        name = node.name if isinstance(node, Function) else None
+        stats[builtins.id(node)] = Analysis(
+            nodes=1 + sum(child.nodes for child in children),
+            unique_nodes=0,
+            depth=1 + builtins.max((child.depth for child in children), default=0),
+            length=_node_length(node, [child.length for child in children]),
+            regex_calls=(name in _REGEX_FUNCTIONS)
+            + sum(child.regex_calls for child in children),
+            prop_refs=(name == "prop") + sum(child.prop_refs for child in children),
+            date_calls=(name in _DATE_FUNCTIONS)
+            + sum(child.date_calls for child in children),
+            cost=costs[builtins.id(node)],
+        )
+
+    return stats[builtins.id(value)]._replace(unique_nodes=len(nodes))
+
+
+def _cost(node: ExprImpl, costs: list[float]) -> float:
+    """Returns the estimated cost of a node, given the costs of its children."""
+    if not isinstance(node, Function):
+        return (not isinstance(node, Constant)) + sum(costs)
+
+    weight = _COSTS.get(node.name, 1)
+    if node.name == "if" and len(costs) == 3:
+        return weight + costs[0] + builtins.max(costs[1:])
+    if node.name == "ifs" and len(costs) % 2:
+        branches = [*costs[1::2], costs[-1]]
+        return weight + sum(costs[:-1:2]) + builtins.max(branches)
+    return weight + sum(costs)
+
+
+def _child_costs(node: ExprImpl, costs: dict[int, float]) -> list[float]:
+    return [
+        costs[builtins.id(child)] if isinstance(child, ExprImpl) else 0
+        for child in _children(node)
+    ]
+
+
+_REGEX_FUNCTIONS = frozenset(["test", "replace", "replaceAll", "contains"])
+
+_DATE_FUNCTIONS = frozenset(
+    [
+        *["now", "timestamp", "fromTimestamp", "dateAdd", "dateSubtract"],
+        *["dateBetween", "formatDate", "start", "end", "dateStart", "dateEnd"],
+        *["minute", "hour", "day", "date", "month", "year"],
+    ]
+)
+
+# The relative cost of evaluating a function once, not counting its arguments.
+_COSTS: dict[str, float] = {
+    **dict.fromkeys(["test", "replace", "replaceAll"], 10),
+    "contains": 5,
+    **dict.fromkeys(_DATE_FUNCTIONS, 4),
+    **dict.fromkeys(["format", "toNumber", "concat", "join", "slice"], 2),
+    **dict.fromkeys(["substring", "length", "lower", "upper", "repeat"], 2),
+    "prop": 2,
+}
+
+
+#
+# Optimization
+#
+_E = TypeVar("_E", bound=Expr)
+
+
+def optimize(value: _E) -> _E:
+    """Returns an equivalent expression with constant subexpressions folded.
+
+    Every operator and pure function whose arguments are all literals is
+    evaluated, `if` calls with a literal test are replaced by the branch taken,
+    and `and`/`or` with a literal operand are short-circuited.
+    """
+    return cast(_E, _transform(value, _fold))
+
+
+def specialize(value: _E, props: Mapping[str, Expr]) -> _E:
+    """Returns an expression specialized for known prop values.
+
+    Every `prop()` named in `props` is replaced by its value, and everything
+    that becomes constant is folded as by `optimize`, so tests and branches
+    depending only on those props are decided ahead of time.
+    """
+
+    def rewrite(node: ExprImpl) -> Expr:
+        if (
+            isinstance(node, Function)
+            and node.name == "prop"
+            and isinstance(node.args[0], str)
+            and node.args[0] in props
+        ):
+            return props[node.args[0]]
+        return _fold(node)
+
+    return cast(_E, _transform(value, rewrite))
+
+
+def _transform(
+    value: Expr,
+    rewrite: Callable[[ExprImpl], Expr],
+    skip: Callable[[ExprImpl], bool] | None = None,
+) -> Expr:
+    """Rebuilds an expression bottom-up, replacing every node by the result of
+    `rewrite`, which is called once per distinct node after its children have
+    been rewritten. Nodes matching `skip` are rebuilt but not rewritten."""
+    if not isinstance(value, ExprImpl):
+        return value
+
+    results: dict[int, Expr] = {}
+    for node in _postorder(value):
+        rebuilt = _rebuilt(node, results)
+        if skip is None or not skip(node):
+            results[builtins.id(node)] = rewrite(rebuilt)
+        else:
+            results[builtins.id(node)] = rebuilt
+
+    return results[builtins.id(value)]
+
+
+def _rebuilt(node: ExprImpl, results: dict[int, Expr]) -> ExprImpl:
+    """Returns `node` with its children replaced by their entries in
+    `results`, reusing the node if none of them changed."""
+    children = _children(node)
+    rewritten = tuple(
+        results[builtins.id(child)] if isinstance(child, ExprImpl) else child
+        for child in children
+    )
+    if all(new is old for new, old in zip(rewritten, children)):
+        return node
+    return _rebuild(node, rewritten)
+
+
+def _rebuild(node: ExprImpl, children: tuple[Expr, ...]) -> ExprImpl:
+    if isinstance(node, Function):
+        return Function(node.name, *children)
+    if isinstance(node, UnaryOperation):
+        return UnaryOperation(node.precedence, node.operator, *children)
+    if isinstance(node, BinaryOperation):
+        return BinaryOperation(node.precedence, node.operator, *children)
+    return node
+
+
+def _is_literal(value: Expr) -> bool:
+    return isinstance(value, (bool, int, float, str))
+
+
+def _fold(node: ExprImpl) -> Expr:
+    if isinstance(node, Function):
+        return _fold_function(node)
+    if isinstance(node, UnaryOperation):
+        if _is_literal(node.operand) and node.operator in _UNARY_FOLDS:
+            return _evaluate_literal(node, _UNARY_FOLDS[node.operator], node.operand)
+    elif isinstance(node, BinaryOperation):
+        return _fold_binary(node)
+    return node
+
+
+def _fold_function(node: Function) -> Expr:
+    if node.name == "if" and isinstance(node.args[0], bool):
+        return node.args[1] if node.args[0] else node.args[2]
+    if node.name in _FUNCTION_FOLDS and all(_is_literal(arg) for arg in node.args):
+        return _evaluate_literal(node, _FUNCTION_FOLDS[node.name], *node.args)
+    return node
+
+
+def _fold_binary(node: BinaryOperation) -> Expr:
+    left, right = node.left, node.right
+    if _is_literal(left) and _is_literal(right):
+        if node.operator in _BINARY_FOLDS:
+            return _evaluate_literal(node, _BINARY_FOLDS[node.operator], left, right)
+        return node
+
+    if node.operator in (" and ", " or "):
+        return _fold_logical(node)
+
+    # Let the builder apply its identities now that operands may be literals,
+    # e.g. `x * (2 - 1)` becomes `x`.
+    builder = _BUILDERS.get(node.operator)
+    if builder is None or not (_is_literal(left) or _is_literal(right)):
+        return node
+    try:
+        result = builder(left, right)
+    except ZeroDivisionError:
+        return node
+    # An expression absorbed by a literal, as in `0 * x` or `0 / x`, may still
+    # make the result NaN, when it's infinite, zero or NaN. Only `x ^ 0` is 1
+    # whatever `x` is.
+    if _is_literal(result) and not (node.operator == " ^ " and _is_literal(right)):
+        return node
+    if (
+        isinstance(result, BinaryOperation)
+        and result.operator == node.operator
+        and result.left is left
+        and result.right is right
+    ):
+        return node
+    return cast(Expr, result)
+
+
+def _fold_logical(node: BinaryOperation) -> Expr:
+    # For `and`, a true operand is neutral and a false one absorbs; `or` is
+    # the other way around. Operands are pure, so dropping one is safe.
+    neutral = node.operator == " and "
+    for literal, other in ((node.left, node.right), (node.right, node.left)):
+        if isinstance(literal, bool):
+            return other if literal is neutral else literal
+    return node
+
+
+def _evaluate_literal(node: ExprImpl, function: Callable[..., Any], *args: Any) -> Expr:
+    try:
+        result = _literal(function(*args))
+    except (ArithmeticError, TypeError, ValueError, IndexError, re.error):
+        return node
+    return node if result is None else result
+
+
+def _literal(value: Any) -> Scalar | None:
+    """Normalizes the result of folding into a literal with JavaScript number
+    semantics, or None if it cannot be represented."""
+    if isinstance(value, (bool, str)):
+        return value
+    if isinstance(value, int):
+        return value if -_MAX_SAFE_INTEGER <= value <= _MAX_SAFE_INTEGER else None
+    if isinstance(value, float) and math.isfinite(value):
+        # Negative zero stays a float, as it divides into `-Infinity`.
+        if value.is_integer() and builtins.abs(value) <= _MAX_SAFE_INTEGER:
+            return int(value) if value or math.copysign(1, value) > 0 else value
+        return value
+    return None
+
+
+_MAX_SAFE_INTEGER = 2**53
+
+
+def _number(value: Any) -> int | float:
+    if value is None:
+        # A missing number is empty, which Notion computes with as NaN.
+        return math.nan
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(f"expected a number, got {value!r}")
+    return value
+
+
+def _string(value: Any) -> str:
+    if not isinstance(value, str):
+        raise TypeError(f"expected a string, got {value!r}")
+    return value
+
+
+def _ascii(value: Any) -> str:
+    # Only the legacy expansions of `lower` and `upper` are limited to ASCII
+    # letters, so other text is left for Notion to convert.
+    if not _string(value).isascii():
+        raise ValueError(f"expected an ASCII string, got {value!r}")
+    return cast(str, value)
+
+
+def _boolean(value: Any) -> bool:
+    if not isinstance(value, bool):
+        raise TypeError(f"expected a boolean, got {value!r}")
+    return value
+
+
+def _date(value: Any) -> datetime.datetime:
+    """Returns a date, or the start of a `(start, end)` range, as an aware
+    datetime. Dates without a time are read as midnight, naive ones as UTC."""
+    if isinstance(value, tuple) and len(value) == 2:
+        value = value[0]
+    if isinstance(value, datetime.datetime):
+        date = value
+    elif isinstance(value, datetime.date):
+        date = datetime.datetime.combine(value, datetime.time())
+    else:
+        raise TypeError(f"expected a date, got {value!r}")
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date
+
+
+def _comparable(value: Any, other: Any) -> tuple[Any, Any]:
+    if value is None or other is None:
+        # Missing values compare like NaN, as neither equal nor ordered.
+        return math.nan, math.nan
+    if isinstance(value, str):
+        return value, _string(other)
+    if isinstance(value, (datetime.date, tuple)):
+        return _date(value), _date(other)
+    return _number(value), _number(other)
+
+
+def _equal(value: Any, other: Any) -> bool:
+    if isinstance(value, bool) or isinstance(other, bool):
+        return _boolean(value) is _boolean(other)
+    value, other = _comparable(value, other)
+    return bool(value == other)
+
+
+def _add(value: Any, other: Any) -> Any:
+    return operator.add(*_comparable(value, other))
+
+
+def _pow(base: Any, power: Any) -> float:
+    result = float(_number(base)) ** _number(power)
+    if isinstance(result, complex):
+        raise ValueError("complex result")
+    return result
+
+
+def _utf16(value: Any) -> bytes:
+    return _string(value).encode("utf-16-le")
+
+
+def _length(value: Any) -> int:
+    return len(_utf16(value)) // 2
+
+
+def _slice(value: Any, start: Any, end: Any = None) -> str:
+    # Strings are indexed by UTF-16 code unit, like JavaScript.
+    units = _utf16(value)
+    length = len(units) // 2
+    start = 2 * _index(start, length)
+    end = None if end is None else 2 * _index(end, length)
+    return units[start:end].decode("utf-16-le")
+
+
+def _index(value: Any, length: int) -> int:
+    # Like JavaScript, NaN is read as 0, and infinities as the ends.
+    number = _number(value)
+    if math.isnan(number):
+        return 0
+    return int(builtins.max(-length, builtins.min(length, number)))
+
+
+def _format(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return value
+    return _format_number(_number(value))
+
+
+def _format_number(value: int | float) -> str:
+    """Formats a number like JavaScript's `Number.prototype.toString`."""
+    if isinstance(value, int) and builtins.abs(value) < 10**21:
+        return str(value)
+
+    sign, digits, exponent = decimal.Decimal(repr(float(value))).as_tuple()
+    text = "".join(map(str, digits)).rstrip("0") or "0"
+    point = len(digits) + int(exponent)
+    prefix = "-" if sign else ""
+
+    if text == "0":
+        return "0"
+    if len(text) <= point <= 21:
+        return prefix + text + "0" * (point - len(text))
+    if 0 < point <= 21:
+        return prefix + text[:point] + "." + text[point:]
+    if -6 < point <= 0:
+        return prefix + "0." + "0" * -point + text
+    mantissa = text[0] + ("." + text[1:] if len(text) > 1 else "")
+    return f"{prefix}{mantissa}e{'+' if point > 0 else '-'}{builtins.abs(point - 1)}"
+
+
+def _to_number(value: Any) -> int | float:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        if not _NUMBER_PATTERN.match(value):
+            raise ValueError(f"not a number: {value!r}")
+        return float(value)
+    return _number(value)
+
+
+_NUMBER_PATTERN = re.compile(r"^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$")
+
+
+def _regex(pattern: Any) -> re.Pattern[str]:
+    return _compile_regex(_string(pattern))
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_regex(pattern: str) -> re.Pattern[str]:
+    """Compiles a JavaScript regular expression, as Notion runs them, into a
+    Python pattern matching the same strings.
+
+    Without flags, JavaScript's `$` only matches at the very end, `.` excludes
+    every line terminator and `\\s` includes Unicode spaces, so these are
+    translated. Syntax that Python reads differently and that has no
+    translation raises `ValueError`.
+    """
+    parts = []
+    index = 0
+    while index < len(pattern):
+        part, length = _translate_regex_token(pattern, index)
+        parts.append(part)
+        index += length
+    return re.compile("".join(parts), re.ASCII)
+
+
+def _translate_regex_token(pattern: str, index: int) -> tuple[str, int]:
+    if pattern[index] == "\\":
+        return _translate_regex_escape(pattern, pattern[index : index + 2]), 2
+    match = _REGEX_CLASS.match(pattern, index)
+    if match is not None:
+        return _translate_regex_class(pattern, match), len(match.group())
+    for prefix, translation in _REGEX_TRANSLATIONS:
+        if pattern.startswith(prefix, index):
+            return translation, len(prefix)
+    if pattern.startswith("(?", index):
+        raise ValueError(f"unsupported regular expression: {pattern!r}")
+    match = _REGEX_QUANTIFIER.match(pattern, index)
+    if match is None:
+        # Outside of a valid quantifier, JavaScript reads `{` literally.
+        char = pattern[index]
+        return ("\\{" if char == "{" else char), 1
+    if pattern.startswith("+", match.end()):
+        # Possessive quantifiers are an error in JavaScript.
+        raise ValueError(f"unsupported regular expression: {pattern!r}")
+    return match.group(), len(match.group())
+
+
+def _translate_regex_escape(pattern: str, escape: str, in_class: bool = False) -> str:
+    if escape == "\\s":
+        return _JS_WHITESPACE if in_class else f"[{_JS_WHITESPACE}]"
+    if escape == "\\S" and not in_class:
+        return f"[^{_JS_WHITESPACE}]"
+    if escape[1:] in _UNSUPPORTED_ESCAPES or escape == "\\S":
+        raise ValueError(f"unsupported regular expression: {pattern!r}")
+    return escape
+
+
+def _translate_regex_class(pattern: str, match: re.Match[str]) -> str:
+    negated, body = match.groups()
+    items = _REGEX_CLASS_ITEM.findall(body)
+    if not items or ("\\s" in items and "\\S" in items):
+        # An empty class matches nothing, and one with `\\s\\S` anything.
+        return "(?!)" if bool(negated) == bool(items) else "[\\s\\S]"
+    parts = []
+    for item in items:
+        if item.startswith("\\"):
+            parts.append(_translate_regex_escape(pattern, item, in_class=True))
+        else:
+            # Python warns that these may become set operations.
+            parts.append("\\" + item if item in "[&~|" else item)
+    return f"[{negated}{''.join(parts)}]"
+
+
+_JS_WHITESPACE = (
+    "\\t\\n\\v\\f\\r \\u00a0\\u1680\\u2000-\\u200a"
+    "\\u2028\\u2029\\u202f\\u205f\\u3000\\ufeff"
+)
+# Escapes of letters that JavaScript reads literally but Python does not.
+# Negated spaces are only translated outside of a character class.
+_UNSUPPORTED_ESCAPES = frozenset("aAZNU")
+_REGEX_TRANSLATIONS = (
+    ("$", "\\Z"),
+    (".", "[^\\n\\r\\u2028\\u2029]"),
+    ("(?:", "(?:"),
+    ("(?=", "(?="),
+    ("(?!", "(?!"),
+    ("(?<=", "(?<="),
+    ("(?<!", "(?<!"),
+    ("(?<", "(?P<"),
+)
+_REGEX_CLASS = re.compile(r"\[(\^?)((?:\\[\s\S]|[^\]\\])*)\]")
+_REGEX_CLASS_ITEM = re.compile(r"\\[\s\S]?|[\s\S]")
+_REGEX_QUANTIFIER = re.compile(r"[*+?]|\{\d+(,\d*)?\}")
+
+
+def _replacement(text: Any) -> Callable[[re.Match[str]], str]:
+    """Converts a JavaScript replacement string into a substitution function,
+    expanding `$$`, `$&` and `$n`."""
+    parts = re.split(r"(\$\$|\$&|\$\d)", _string(text))
+
+    def substitute(match: re.Match[str]) -> str:
+        result = []
+        for part in parts:
+            if part == "$$":
+                result.append("$")
+            elif part == "$&":
+                result.append(match.group(0))
+            elif len(part) == 2 and part[0] == "$" and part[1].isdigit():
+                result.append(match.group(int(part[1])) or "")
+            else:
+                result.append(part)
+        return "".join(result)
+
+    return substitute
+
+
+def _replace(value: Any, pattern: Any, text: Any, count: int = 1) -> str:
+    return _regex(pattern).sub(_replacement(text), _format(value), count=count)
+
+
+def _test(value: Any, pattern: Any) -> bool:
+    return _regex(pattern).search(_format(value)) is not None
+
+
+def _empty(value: Any) -> bool:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return True
+    return value in ("", 0) or value is False
+
+
+def _round(value: Any) -> int:
+    return math.floor(_number(value) + 0.5)
+
+
+def _sign(value: Any) -> float:
+    number = _number(value)
+    if math.isnan(number):
+        return math.nan
+    return (number > 0) - (number < 0)
+
+
+def _extreme(function: Callable[[list[float]], float]) -> Callable[..., float]:
+    # As in JavaScript, the extreme of numbers including NaN is NaN.
+    def extreme(*values: Any) -> float:
+        numbers = [_number(value) for value in values]
+        if any(math.isnan(number) for number in numbers):
+            return math.nan
+        return function(numbers)
+
+    return extreme
+
+
+def _cbrt(value: Any) -> int:
+    # Only exact roots are folded, so the result doesn't depend on libm.
+    number = _number(value)
+    root: int = builtins.round(float(builtins.abs(number)) ** (1 / 3))
+    if root**3 != builtins.abs(number):
+        raise ValueError("inexact cube root")
+    return root if number >= 0 else -root
+
+
+def _log(function: Callable[[float], float]) -> Callable[[Any], float]:
+    def log(value: Any) -> float:
+        return function(_number(value))
+
+    return log
+
+
+_UNARY_FOLDS: dict[str, Callable[..., Any]] = {
+    "-": lambda value: -_number(value),
+    "+": _to_number,
+    "not ": lambda value: not _boolean(value),
+}
+
+_BINARY_FOLDS: dict[str, Callable[..., Any]] = {
+    " + ": _add,
+    " - ": lambda value, other: _number(value) - _number(other),
+    " * ": lambda value, other: _number(value) * _number(other),
+    " / ": lambda value, other: _number(value) / _number(other),
+    " % ": lambda value, other: math.fmod(_number(value), _number(other)),
+    " ^ ": _pow,
+    " == ": _equal,
+    " != ": lambda value, other: not _equal(value, other),
+    " > ": lambda value, other: operator.gt(*_comparable(value, other)),
+    " >= ": lambda value, other: operator.ge(*_comparable(value, other)),
+    " < ": lambda value, other: operator.lt(*_comparable(value, other)),
+    " <= ": lambda value, other: operator.le(*_comparable(value, other)),
+    " and ": lambda value, other: _boolean(value) and _boolean(other),
+    " or ": lambda value, other: _boolean(value) or _boolean(other),
+}
+
+_FUNCTION_FOLDS: dict[str, Callable[..., Any]] = {
+    "concat": lambda *items: "".join(map(_string, items)),
+    "join": lambda separator, *items: _string(separator).join(map(_string, items)),
+    "slice": _slice,
+    "length": _length,
+    "lower": lambda value: _ascii(value).lower(),
+    "upper": lambda value: _ascii(value).upper(),
+    "format": _format,
+    "toNumber": _to_number,
+    "contains": lambda value, text: _string(text) in _string(value),
+    "replace": _replace,
+    "replaceAll": lambda value, pattern, text: _replace(value, pattern, text, 0),
+    "test": _test,
+    "empty": _empty,
+    "abs": lambda value: builtins.abs(_number(value)),
+    "cbrt": _cbrt,
+    "ceil": lambda value: math.ceil(_number(value)),
+    "exp": lambda value: math.exp(_number(value)),
+    "floor": lambda value: math.floor(_number(value)),
+    "log10": _log(math.log10),
+    "log2": _log(math.log2),
+    "max": _extreme(builtins.max),
+    "min": _extreme(builtins.min),
+    "round": _round,
+    "sign": _sign,
+    "sqrt": lambda value: math.sqrt(_number(value)),
+}
+
+_BUILDERS: dict[str, Callable[[Any, Any], Any]] = {
+    " + ": add,
+    " - ": subtract,
+    " * ": multiply,
+    " / ": divide,
+    " ^ ": pow,
+    " % ": mod,
+}
+
+
+def simplify(value: _E) -> _E:
+    """Returns an equivalent expression with arithmetic simplified.
+
+    Constants are folded as by `optimize`, then chains of numeric `+`, `-` and
+    `*` are flattened: literal terms and factors are combined, like terms are
+    collected (`x + x` becomes `2 * x`), and literal coefficients are
+    distributed into `if` calls with literal branches and into sums whose
+    terms they combine with. Like terms only cancel out when they are known to
+    be finite, as `x - x` is NaN for an infinite `x`. Since literals are
+    combined ahead of time, results may differ from the original formula in
+    the last bits of precision.
+    """
+    folded = _transform(value, _fold)
+    return cast(_E, _Simplifier(folded).run())
+
+
+class _Simplifier:
+    def __init__(self, value: Expr) -> None:
+        self.value = value
+        self.types = _TypeInference()
+
+        # Only the outermost node of each chain is simplified, the rest of the
+        # chain is flattened into it. Sums inside products are simplified as
+        # chains of their own.
+        self.interior: set[int] = set()
+        if isinstance(value, ExprImpl):
+            for node in _postorder(value):
+                if _is_arithmetic(node):
+                    for child in _children(node):
+                        if _is_arithmetic(child) and not (
+                            _is_sum(child) and _is_product(node)
+                        ):
+                            self.interior.add(builtins.id(child))
+
+    def run(self) -> Expr:
+        return _transform(
+            self.value,
+            self.rewrite,
+            lambda node: builtins.id(node) in self.interior,
+        )
+
+    def rewrite(self, node: ExprImpl) -> Expr:
+        if not _is_arithmetic(node) or self.types.type_of(node) != "number":
+            return _shorten_literals(node)
+        constant, terms = self.collect(node)
+        return _emit_sum(constant, terms)
+
+    def collect(self, value: Expr) -> tuple[int | float, list[list[Any]]]:
+        """Flattens a sum into a constant and a list of `[coefficient, key,
+        factors]` terms, with like terms combined."""
+        constant: int | float = 0
+        terms: list[list[Any]] = []
+        indexes: dict[bytes, int] = {}
+        sums: list[tuple[int | float, Expr]] = []
+
+        def add_term(coefficient: int | float, factors: list[Expr]) -> None:
+            nonlocal constant
+            if not factors:
+                constant += coefficient
+                return
+            key = b"".join(_digest(factor) for factor in factors)
+            if key in indexes:
+                terms[indexes[key]][0] += coefficient
+            else:
+                indexes[key] = len(terms)
+                terms.append([coefficient, key, factors])
+
+        for sign, term in _summands(value):
+            coefficient, factors = _product(term)
+            if len(factors) == 1 and _is_sum(factors[0]):
+                sums.append((sign * coefficient, factors[0]))
+            else:
+                add_term(sign * coefficient, factors)
+
+        # Distributing a coefficient over a parenthesized sum only pays off
+        # when every resulting term merges with an existing one.
+        for coefficient, factor in sums:
+            inner_constant, inner_terms = self.collect(factor)
+            if all(key in indexes for _, key, _ in inner_terms):
+                constant += coefficient * inner_constant
+                for inner, _, inner_factors in inner_terms:
+                    add_term(coefficient * inner, inner_factors)
+            else:
+                add_term(coefficient, [factor])
+
+        return constant, terms
+
+
+def _shorten_literals(node: ExprImpl) -> ExprImpl:
+    """Rewrites integral float literals like `14.0` as integers."""
+    children = _children(node)
+    shortened = tuple(
+        _number_literal(child) if isinstance(child, float) else child
+        for child in children
+    )
+    if all(new is old for new, old in zip(shortened, children)):
+        return node
+    return _rebuild(node, shortened)
+
+
+def _emit_sum(constant: int | float, terms: list[list[Any]]) -> Expr:
+    result: Any = None
+    for coefficient, _, factors in terms:
+        number = _number_literal(coefficient)
+        if number == 0:
+            if _is_finite(factors):
+                continue
+            # Like terms only cancel out for finite values: `x - x` is NaN
+            # when `x` is infinite or NaN.
+            term = cast(Number, _scale(1, factors))
+            result = subtract(term if result is None else add(result, term), term)
+            continue
+        if result is None:
+            result = _scale(number, factors)
+        elif number < 0:
+            result = subtract(result, cast(Number, _scale(-number, factors)))
+        else:
+            result = add(result, cast(Number, _scale(number, factors)))
+
+    if result is None:
+        return _number_literal(constant)
+    return cast(Expr, add(result, _number_literal(constant)))
+
+
+def _is_finite(factors: list[Expr]) -> bool:
+    """Whether a product of numeric factors is known to be finite, because
+    each is a string length or an `if` with finite literal branches, or the
+    negation of one."""
+    stack = list(factors)
+    while stack:
+        factor = stack.pop()
+        if isinstance(factor, Function) and factor.name == "if":
+            stack.extend(factor.args[1:])
+        elif isinstance(factor, UnaryOperation) and factor.operator == "-":
+            stack.append(factor.operand)
+        elif _is_number_literal(factor):
+            if not math.isfinite(cast(float, factor)):
+                return False
+        elif not (isinstance(factor, Function) and factor.name == "length"):
+            return False
+    return True
+
+
+def _number_literal(value: int | float) -> int | float:
+    literal = _literal(value)
+    return value if literal is None else cast("int | float", literal)
+
+
+def _is_arithmetic(value: Expr) -> bool:
+    if isinstance(value, BinaryOperation):
+        return value.operator in (" + ", " - ", " * ")
+    return isinstance(value, UnaryOperation) and value.operator == "-"
+
+
+def _is_sum(value: Expr) -> bool:
+    return isinstance(value, BinaryOperation) and value.operator in (" + ", " - ")
+
+
+def _is_product(value: Expr) -> bool:
+    return isinstance(value, BinaryOperation) and value.operator == " * "
+
+
+def _summands(value: Expr) -> Iterator[tuple[int, Expr]]:
+    stack: list[tuple[int, Expr]] = [(1, value)]
+    while stack:
+        sign, item = stack.pop()
+        if isinstance(item, BinaryOperation) and _is_sum(item):
+            stack.append((-sign if item.operator == " - " else sign, item.right))
+            stack.append((sign, item.left))
+        elif isinstance(item, UnaryOperation) and item.operator == "-":
+            stack.append((-sign, item.operand))
+        else:
+            yield sign, item
+
+
+def _product(value: Expr) -> tuple[int | float, list[Expr]]:
+    """Splits a product into its literal coefficient and its other factors."""
+    coefficient: int | float = 1
+    factors: list[Expr] = []
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, BinaryOperation) and _is_product(item):
+            stack.append(item.right)
+            stack.append(item.left)
+        elif isinstance(item, UnaryOperation) and item.operator == "-":
+            coefficient = -coefficient
+            stack.append(item.operand)
+        elif _is_number_literal(item):
+            coefficient *= cast(float, item)
+        else:
+            factors.append(item)
+    return coefficient, factors
+
+
+def _scale(coefficient: int | float, factors: list[Expr]) -> Expr:
+    factor = factors[0]
+    if (
+        len(factors) == 1
+        and isinstance(factor, Function)
+        and factor.name == "if"
+        and _is_number_literal(factor.args[1])
+        and _is_number_literal(factor.args[2])
+    ):
+        branches = [
+            _literal(coefficient * cast(float, branch)) for branch in factor.args[1:]
+        ]
+        if None not in branches:
+            return Function("if", factor.args[0], *cast("list[Scalar]", branches))
+
+    result: Any = coefficient
+    for factor in factors:
+        result = multiply(result, cast(Number, factor))
+    return cast(Expr, result)
+
+
+def _is_number_literal(value: Expr) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def simplify_logic(value: _E) -> _E:
+    """Returns an equivalent expression with boolean logic simplified.
+
+    Constants are folded as by `optimize`, `not` is pushed down to the
+    comparisons with De Morgan's laws, and chains of `and`/`or` are flattened:
+    duplicate operands are dropped, chains containing both an operand and its
+    negation are reduced to a literal, and equality and `contains` tests of
+    the same value against string literals are merged into a single `test`
+    with a regular expression, so `x == "A" or x == "B"` becomes
+    `test(x, "^(A|B)$")`.
+    """
+    folded = _transform(value, _fold)
+    return cast(_E, _LogicSimplifier(folded).run())
+
+
+class _LogicSimplifier:
+    def __init__(self, value: Expr) -> None:
+        self.value = value
+        self.negations: dict[int, tuple[ExprImpl, Expr]] = {}
+
+        # As with arithmetic, only the outermost node of each `and`/`or` chain
+        # is simplified, the rest of the chain is flattened into it.
+        self.interior: set[int] = set()
+        if isinstance(value, ExprImpl):
+            for node in _postorder(value):
+                if _is_logical(node):
+                    for child in _children(node):
+                        if _is_logical(child) and child.operator == node.operator:
+                            self.interior.add(builtins.id(child))
+
+    def run(self) -> Expr:
+        return _transform(
+            self.value,
+            self.rewrite,
+            lambda node: builtins.id(node) in self.interior,
+        )
+
+    def rewrite(self, node: ExprImpl) -> Expr:
+        if isinstance(node, UnaryOperation) and node.operator == "not ":
+            return self.negate(node.operand)
+        if _is_logical(node):
+            return self.chain(node)
+        return node
+
+    def negate(self, value: Expr) -> Expr:
+        """Returns the negation of a boolean expression, with `not` pushed
+        down through `and`/`or` to their operands."""
+        if not isinstance(value, ExprImpl):
+            return not_(cast(Boolean, value))
+
+        negations = self.negations
+        skip = lambda node: (  # noqa: E731
+            builtins.id(node) in negations or not _is_logical(node)
+        )
+        for node in _postorder(value, skip):
+            if builtins.id(node) not in negations:
+                negations[builtins.id(node)] = (node, self.negated(node))
+        return negations[builtins.id(value)][1]
+
+    def negated(self, node: ExprImpl) -> Expr:
+        if _is_logical(node):
+            left, right = self.negation(node.left), self.negation(node.right)
+            if node.operator == " and ":
+                return or_(left, right)
+            return and_(left, right)
+        complement = _complement(node)
+        return not_(cast(Boolean, node)) if complement is None else complement
+
+    def negation(self, value: Expr) -> Boolean:
+        if not isinstance(value, ExprImpl):
+            return not_(cast(Boolean, value))
+        return cast(Boolean, self.negations[builtins.id(value)][1])
+
+    def chain(self, node: BinaryOperation) -> Expr:
+        disjunction = node.operator == " or "
+        operands: list[Expr] = []
+        keys: set[bytes] = set()
+        for operand in _logical_operands(node):
+            if operand is disjunction:
+                return disjunction
+            key = _digest(operand)
+            if not isinstance(operand, bool) and key not in keys:
+                keys.add(key)
+                operands.append(operand)
+
+        for operand in operands:
+            complement = _complement(operand)
+            if complement is not None and _digest(complement) in keys:
+                return disjunction
+
+        operands = _merge_patterns(operands, disjunction)
+        if not operands:
+            return not disjunction
+
+        result = operands[0]
+        for operand in operands[1:]:
+            result = BinaryOperation(node.precedence, node.operator, result, operand)
+        return result
+
+
+def _is_logical(value: Expr) -> TypeGuard[BinaryOperation]:
+    return isinstance(value, BinaryOperation) and value.operator in (" and ", " or ")
+
+
+def _logical_operands(node: BinaryOperation) -> Iterator[Expr]:
+    """Yields the operands of a chain of the same logical operator in order."""
+    stack: list[Expr] = [node]
+    while stack:
+        item = stack.pop()
+        if _is_logical(item) and item.operator == node.operator:
+            stack.append(item.right)
+            stack.append(item.left)
+        else:
+            yield item
+
+
+def _complement(value: Expr) -> Expr | None:
+    """Returns the negation of a `not` or an (in)equality without wrapping it
+    in another `not`, or None for other expressions."""
+    if isinstance(value, UnaryOperation) and value.operator == "not ":
+        return value.operand
+    if isinstance(value, BinaryOperation) and value.operator in _COMPLEMENTS:
+        operator = _COMPLEMENTS[value.operator]
+        return BinaryOperation(value.precedence, operator, value.left, value.right)
+    return None
+
+
+_COMPLEMENTS = {" == ": " != ", " != ": " == "}
+
+
+def _merge_patterns(operands: list[Expr], disjunction: bool) -> list[Expr]:
+    """Merges the string tests of the same subject in a chain into one `test`.
+
+    In a disjunction, `x == "A"` and `contains(x, "A")` are merged; in a
+    conjunction their negations, `x != "A"` and `not contains(x, "A")`, are
+    merged into a negated `test`.
+    """
+    groups: dict[bytes, list[tuple[int, Expr, str, bool]]] = {}
+    for index, operand in enumerate(operands):
+        term = _pattern_term(operand if disjunction else _complement(operand))
+        if term is not None:
+            subject, text, exact = term
+            groups.setdefault(_digest(subject), []).append(
+                (index, subject, text, exact)
+            )
+
+    merged: dict[int, Expr | None] = {}
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        index, subject = group[0][:2]
+        pattern = Function("test", subject, _pattern(group))
+        merged[index] = pattern if disjunction else not_(pattern)
+        for other, *_ in group[1:]:
+            merged[other] = None
+
+    result: list[Expr] = []
+    for index, operand in enumerate(operands):
+        replacement = merged.get(index, operand)
+        if replacement is not None:
+            result.append(replacement)
+    return result
+
+
+def _pattern_term(value: Expr | None) -> tuple[Expr, str, bool] | None:
+    """Returns the subject and the literal of `x == "A"` or `contains(x, "A")`,
+    and whether the match is exact."""
+    if isinstance(value, BinaryOperation) and value.operator == " == ":
+        if isinstance(value.right, str) and isinstance(value.left, ExprImpl):
+            return value.left, value.right, True
+        if isinstance(value.left, str) and isinstance(value.right, ExprImpl):
+            return value.right, value.left, True
+    if (
+        isinstance(value, Function)
+        and value.name == "contains"
+        and len(value.args) == 2
+        and isinstance(value.args[0], ExprImpl)
+        and isinstance(value.args[1], str)
+    ):
+        return value.args[0], value.args[1], False
+    return None
+
+
+def _pattern(group: list[tuple[int, Expr, str, bool]]) -> str:
+    exact = [_escape_regex(text) for _, _, text, is_exact in group if is_exact]
+    partial = [_escape_regex(text) for _, _, text, is_exact in group if not is_exact]
+    if exact:
+        partial.insert(0, f"^({'|'.join(exact)})$")
+    return "|".join(partial)
+
+
+def _escape_regex(text: str) -> str:
+    """Escapes the characters with a special meaning in JavaScript regular
+    expressions."""
+    return re.sub(r"[\\^$.*+?()[\]{}|]", r"\\\g<0>", text)
+
+
+def reorder(value: _E, profile: Profile | None = None) -> _E:
+    """Returns an equivalent expression with its cheapest checks run first.
+
+    The operands of `and`/`or` chains are sorted by their estimated cost, as
+    in `analyze`, and so are the arms of `if` chains (as built by `select`)
+    whose tests are mutually exclusive, because each compares the same value
+    with a different literal. Operands and arms of equal cost keep their order.
+
+    With a `profile` of sample rows (see `profile`), mutually exclusive arms
+    are instead sorted by how often their test was true, most frequent first.
+    """
+    costs = _CostModel()
+    if profile is None:
+        return cast(_E, _Reorderer(value, costs.cost_of, costs.cost_of).run())
+
+    def frequency(test: Expr) -> tuple[int, float]:
+        return -profile.hits_of(test), costs.cost_of(test)
+
+    # Arms are reordered first, while their tests still match the profile.
+    value = cast(_E, _Reorderer(value, None, frequency).run())
+    return cast(_E, _Reorderer(value, costs.cost_of, None).run())
+
+
+class _CostModel:
+    def __init__(self) -> None:
+        self.costs: dict[int, float] = {}
+        self.nodes: list[ExprImpl] = []
+
+    def cost_of(self, value: Expr) -> float:
+        if not isinstance(value, ExprImpl):
+            return 0
+        if builtins.id(value) not in self.costs:
+            skip = lambda node: builtins.id(node) in self.costs  # noqa: E731
+            for node in _postorder(value, skip):
+                if builtins.id(node) not in self.costs:
+                    cost = _cost(node, _child_costs(node, self.costs))
+                    self.costs[builtins.id(node)] = cost
+                    self.nodes.append(node)
+        return self.costs[builtins.id(value)]
+
+
+class _Reorderer:
+    """Sorts the operands of `and`/`or` chains by `operand_key` and the tests
+    of the mutually exclusive arms of `if` chains by `arm_key`, in a stable
+    order. Either sort is skipped if its key is None."""
+
+    def __init__(
+        self,
+        value: Expr,
+        operand_key: Callable[[Expr], Any] | None,
+        arm_key: Callable[[Expr], Any] | None,
+    ) -> None:
+        self.value = value
+        self.operand_key = operand_key
+        self.arm_key = arm_key
+
+        # Only the outermost node of each chain is rewritten.
+        self.interior: set[int] = set()
+        if isinstance(value, ExprImpl):
+            for node in _postorder(value):
+                if _is_logical(node):
+                    for child in _children(node):
+                        if _is_logical(child) and child.operator == node.operator:
+                            self.interior.add(builtins.id(child))
+                elif _is_if(node) and _is_if(node.args[2]):
+                    self.interior.add(builtins.id(node.args[2]))
+
+    def run(self) -> Expr:
+        return _transform(
+            self.value,
+            self.rewrite,
+            lambda node: builtins.id(node) in self.interior,
+        )
+
+    def rewrite(self, node: ExprImpl) -> Expr:
+        if _is_logical(node) and self.operand_key is not None:
+            operands = list(_logical_operands(node))
+            ordered = sorted(operands, key=self.operand_key)
+            if all(new is old for new, old in zip(ordered, operands)):
+                return node
+            result = ordered[0]
+            for operand in ordered[1:]:
+                result = BinaryOperation(
+                    node.precedence, node.operator, result, operand
+                )
+            return result
+        if _is_if(node) and _is_if(node.args[2]) and self.arm_key is not None:
+            return self.arms(node, self.arm_key)
+        return node
+
+    def arms(self, node: Function, key: Callable[[Expr], Any]) -> Expr:
+        arms: list[tuple[Expr, Expr]] = []
+        default: Expr = node
+        while _is_if(default):
+            arms.append((default.args[0], default.args[1]))
+            default = default.args[2]
+
+        ordered: list[tuple[Expr, Expr]] = []
+        for start, end in _exclusive_runs([test for test, _ in arms]):
+            ordered.extend(sorted(arms[start:end], key=lambda arm: key(arm[0])))
+        if all(new[0] is old[0] for new, old in zip(ordered, arms)):
+            return node
+
+        result = default
+        for test, value in reversed(ordered):
+            result = Function("if", test, value, result)
+        return result
+
+
+def _exclusive_runs(tests: list[Expr]) -> Iterator[tuple[int, int]]:
+    """Splits a list of tests into runs of consecutive tests of which at most
+    one can be true, since each compares the same value with a different
+    literal, and yields the bounds of each run."""
+    start = 0
+    subjects: dict[bytes, set[Any]] = {}
+    for index, test in enumerate(tests):
+        comparisons = _equalities(test)
+        shared = [
+            subject
+            for subject, literals in subjects.items()
+            if subject in comparisons and comparisons[subject] not in literals
+        ]
+        if shared:
+            subjects = {subject: subjects[subject] for subject in shared}
+            for subject in shared:
+                subjects[subject].add(comparisons[subject])
+        else:
+            if index:
+                yield start, index
+            start = index
+            subjects = {subject: {literal} for subject, literal in comparisons.items()}
+    if tests:
+        yield start, len(tests)
+
+
+def _equalities(test: Expr) -> dict[bytes, tuple[str, Scalar]]:
+    """Returns the literals a test requires values to equal, by the digest of
+    the value, from the test itself or the operands of its `and` chain."""
+    operands: Iterable[Expr] = [test]
+    if _is_logical(test):
+        if test.operator != " and ":
+            return {}
+        operands = _logical_operands(test)
+
+    comparisons: dict[bytes, tuple[str, Scalar]] = {}
+    for operand in operands:
+        if isinstance(operand, BinaryOperation) and operand.operator == " == ":
+            for subject, literal in (
+                (operand.left, operand.right),
+                (operand.right, operand.left),
+            ):
+                if isinstance(subject, ExprImpl) and _is_literal(literal):
+                    key = _literal_type(literal) or ""
+                    comparisons.setdefault(
+                        _digest(subject), (key, cast(Scalar, literal))
+                    )
+    return comparisons
+
+
+def simplify_ranges(value: _E) -> _E:
+    """Returns an equivalent expression with checks that cannot fail removed.
+
+    The range of every numeric subexpression is inferred from its literals,
+    operators and functions, from the known ranges of functions like `hour`
+    and `sign`, and from the tests of the `if` calls it is nested in, so that
+    in `if(x >= 7, a, b)` the range of `x` in `b` ends below 7. Comparisons
+    decided by these ranges are replaced by their result, pruning the branches
+    they guard, and `min`, `max` and `abs` calls are dropped where they cannot
+    affect the result. Comparisons of values that may be NaN, like `sqrt(x)`,
+    are left alone, since all but `!=` are false for NaN. Props may be empty,
+    infinite or NaN, and so may the parts of a date prop that may be missing.
+    """
+    return cast(_E, _RangeSimplifier().run(value))
+
+
+class _Interval(NamedTuple):
+    """A range of numbers, either end of which may be excluded, and which may
+    also hold NaN."""
+
+    low: float = -math.inf
+    high: float = math.inf
+    low_open: bool = False
+    high_open: bool = False
+    nan: bool = False
+
+
+# The ranges established for subexpressions by the tests of enclosing `if`
+# calls, by digest.
+_Facts = Dict[bytes, _Interval]
+
+
+class _RangeSimplifier:
+    """Rewrites an expression top-down, tracking the facts established in the
+    branches of `if` calls.
+
+    Nodes are processed with an explicit stack of steps, and memoized by node
+    and by the facts they are processed under, which are shared by all the
+    nodes of a branch.
+    """
+
+    def __init__(self) -> None:
+        self.results: dict[tuple[int, int], tuple[Expr, _Interval | None]] = {}
+        self.facts: list[_Facts] = []
+        # The ranges of the nodes results are made of, by their ids and the
+        # ids of the facts they were found under.
+        self.ranges: dict[tuple[int, int], _Interval | None] = {}
+
+    def run(self, value: Expr) -> Expr:
+        root = self.keep({})
+        stack: list[tuple[str, Expr, _Facts, Any]] = [("visit", value, root, None)]
+        while stack:
+            step, node, facts, extra = stack.pop()
+            if step == "visit":
+                self.visit(node, facts, stack)
+            elif step == "branch":
+                self.branch(cast(Function, node), facts, stack)
+            elif step == "join":
+                self.join(cast(Function, node), facts, *extra)
+            elif step == "choose":
+                key = (builtins.id(node), builtins.id(facts))
+                self.results[key] = self.result(extra, facts)
+            else:
+                self.combine(cast(ExprImpl, node), facts)
+        return self.result(value, root)[0]
+
+    def keep(self, facts: _Facts) -> _Facts:
+        # The ids of the facts are part of the memo keys, so they are kept
+        # alive until the end of the run.
+        self.facts.append(facts)
+        return facts
+
+    def result(self, value: Expr, facts: _Facts) -> tuple[Expr, _Interval | None]:
+        if isinstance(value, ExprImpl):
+            return self.results[builtins.id(value), builtins.id(facts)]
+        if _is_number_literal(value):
+            number = cast(float, value)
+            return value, _Interval(number, number, nan=math.isnan(number))
+        return value, None
+
+    def may_be_nan(self, value: Expr, facts: _Facts) -> bool:
+        if not isinstance(value, ExprImpl):
+            return _is_number_literal(value) and math.isnan(cast(float, value))
+        # Nodes not known to be numbers, like props, may be empty, infinite or
+        # NaN, and so may nodes rebuilt when folding the test.
+        interval = self.ranges.get((builtins.id(value), builtins.id(facts)))
+        return interval is None or interval.nan
+
+    def visit(
+        self, value: Expr, facts: _Facts, stack: list[tuple[str, Expr, _Facts, Any]]
+    ) -> None:
+        if not isinstance(value, ExprImpl):
+            return
+        if (builtins.id(value), builtins.id(facts)) in self.results:
+            return
+        if _is_if(value):
+            stack.append(("branch", value, facts, None))
+            stack.append(("visit", value.args[0], facts, None))
+        else:
+            stack.append(("combine", value, facts, None))
+            for child in _children(value):
+                stack.append(("visit", child, facts, None))
+
+    def branch(
+        self, node: Function, facts: _Facts, stack: list[tuple[str, Expr, _Facts, Any]]
+    ) -> None:
+        """Continues an `if` once its test is simplified, with only the branch
+        taken if the test is decided, or with both branches under the facts
+        the test establishes for each."""
+        test = self.result(node.args[0], facts)[0]
+        if isinstance(test, bool):
+            taken = node.args[1] if test else node.args[2]
+            stack.append(("choose", node, facts, taken))
+            stack.append(("visit", taken, facts, None))
+            return
+
+        true, false = _test_facts(test, lambda value: self.may_be_nan(value, facts))
+        true_facts = self.keep(_refine(facts, true)) if true else facts
+        false_facts = self.keep(_refine(facts, false)) if false else facts
+        stack.append(("join", node, facts, (true_facts, false_facts)))
+        stack.append(("visit", node.args[2], false_facts, None))
+        stack.append(("visit", node.args[1], true_facts, None))
+
+    def join(
+        self, node: Function, facts: _Facts, true_facts: _Facts, false_facts: _Facts
+    ) -> None:
+        test = self.result(node.args[0], facts)[0]
+        true, true_range = self.result(node.args[1], true_facts)
+        false, false_range = self.result(node.args[2], false_facts)
+        rebuilt = _rebuild_changed(node, (test, true, false))
+
+        interval = None
+        if true_range is not None and false_range is not None:
+            interval = _union(true_range, false_range)
+        self.results[builtins.id(node), builtins.id(facts)] = (rebuilt, interval)
+        self.ranges[builtins.id(rebuilt), builtins.id(facts)] = interval
+
+    def combine(self, node: ExprImpl, facts: _Facts) -> None:
+        results = [self.result(child, facts) for child in _children(node)]
+        rebuilt = _rebuild_changed(node, tuple(result for result, _ in results))
+        intervals = [interval for _, interval in results]
+
+        interval = _interval_of(rebuilt, intervals)
+        fact = facts.get(_digest(rebuilt)) if facts else None
+        if fact is not None:
+            interval = fact if interval is None else _intersect(interval, fact)
+
+        value: Expr = rebuilt
+        if interval is not None and interval.low == interval.high:
+            if math.isfinite(interval.low) and not interval.nan:
+                value = _number_literal(interval.low)
+        else:
+            value = _prune(rebuilt, intervals)
+            if isinstance(value, ExprImpl):
+                value = _fold(value)
+        self.results[builtins.id(node), builtins.id(facts)] = (value, interval)
+        self.ranges[builtins.id(value), builtins.id(facts)] = interval
+
+
+def _rebuild_changed(node: ExprImpl, children: tuple[Expr, ...]) -> ExprImpl:
+    if all(new is old for new, old in zip(children, _children(node))):
+        return node
+    return _rebuild(node, children)
+
+
+def _interval_of(node: ExprImpl, intervals: list[_Interval | None]) -> _Interval | None:
+    """Returns the range of a numeric node given the ranges of its children,
+    or None if the node is not known to be a number."""
+    if isinstance(node, Constant):
+        number = _CONSTANT_VALUES.get(node.name)
+        return None if number is None else _Interval(number, number)
+    if isinstance(node, Function):
+        interval = _function_interval(node, intervals)
+        if interval is not None and _may_be_nan(node, intervals):
+            interval = interval._replace(nan=True)
+        return interval
+    if None in intervals:
+        # Props may be infinite or NaN, so arithmetic on them may give NaN.
+        if isinstance(node, BinaryOperation) and node.operator in _ARITHMETIC:
+            return _Interval(nan=True)
+        return None
+    known = cast("list[_Interval]", intervals)
+    if isinstance(node, UnaryOperation) and node.operator == "-":
+        (operand,) = known
+        return _Interval(
+            -operand.high,
+            -operand.low,
+            operand.high_open,
+            operand.low_open,
+            operand.nan,
+        )
+    if isinstance(node, BinaryOperation) and node.operator in _ARITHMETIC:
+        return _arithmetic_interval(node.operator, *known)
+    return None
+
+
+def _may_be_nan(node: Function, intervals: list[_Interval | None]) -> bool:
+    """Whether a numeric function may give NaN, or be empty, because of an
+    argument that may be NaN, or that is a prop or date that may be missing."""
+    if node.name in ("length", "listLength"):
+        return False
+    return any(
+        interval.nan if interval is not None else not _is_present(arg)
+        for arg, interval in zip(node.args, intervals)
+    )
+
+
+def _is_present(value: Expr) -> bool:
+    """Whether a value that isn't a number is known not to be missing: a
+    literal, `now()`, or a date computed from it with literal offsets."""
+    while isinstance(value, Function):
+        if value.name in ("dateAdd", "dateSubtract") and _is_number_literal(
+            value.args[1]
+        ):
+            value = value.args[0]
+        elif value.name in ("start", "end"):
+            value = value.args[0]
+        else:
+            return value.name == "now"
+    return not isinstance(value, ExprImpl)
+
+
+def _arithmetic_interval(operator: str, left: _Interval, right: _Interval) -> _Interval:
+    # Infinite bounds are taken to be reachable, so NaN may come of adding
+    # opposite infinities, or of multiplying zero by one.
+    nan = left.nan or right.nan
+    if operator == " + ":
+        nan = nan or _opposite_infinities(left, right)
+        return _Interval(left.low + right.low, left.high + right.high, nan=nan)
+    if operator == " - ":
+        nan = nan or _opposite_infinities(left, _Interval(-right.high, -right.low))
+        return _Interval(left.low - right.high, left.high - right.low, nan=nan)
+    factors: tuple[float, ...]
+    if operator == " * ":
+        factors = right[:2]
+        nan = nan or (_has_zero(left) and _unbounded(right))
+        nan = nan or (_has_zero(right) and _unbounded(left))
+    elif operator == " / " and right.low == right.high != 0:
+        factors = (1 / right.low,)
+    else:
+        return _Interval(nan=True)
+
+    bounds = [bound * factor for bound in left[:2] for factor in factors]
+    if any(math.isnan(bound) for bound in bounds):
+        return _Interval(nan=True)
+    return _Interval(builtins.min(bounds), builtins.max(bounds), nan=nan)
+
+
+def _opposite_infinities(interval: _Interval, other: _Interval) -> bool:
+    return (interval.high == math.inf and other.low == -math.inf) or (
+        interval.low == -math.inf and other.high == math.inf
+    )
+
+
+def _has_zero(interval: _Interval) -> bool:
+    return interval.low <= 0 <= interval.high
+
+
+def _unbounded(interval: _Interval) -> bool:
+    return math.isinf(interval.low) or math.isinf(interval.high)
+
+
+_ARITHMETIC = (" + ", " - ", " * ", " / ", " % ", " ^ ")
+_NAN_OPERATORS = (" / ", " % ", " ^ ")
+
+
+def _function_interval(
+    node: Function, intervals: list[_Interval | None]
+) -> _Interval | None:
+    if node.name in _FUNCTION_RANGES:
+        return _FUNCTION_RANGES[node.name]
+    if node.name in ("min", "max") and None not in intervals:
+        known = cast("list[_Interval]", intervals)
+        pick = builtins.min if node.name == "min" else builtins.max
+        return _Interval(pick(i.low for i in known), pick(i.high for i in known))
+    if node.name in ("floor", "ceil", "round") and intervals[0] is not None:
+        function = _ROUNDINGS[node.name]
+        low, high = intervals[0].low, intervals[0].high
+        return _Interval(
+            low if math.isinf(low) else function(low),
+            high if math.isinf(high) else function(high),
+        )
+    if node.name == "abs":
+        operand = intervals[0] or _Interval(nan=True)
+        if operand.low >= 0:
+            return operand
+        if operand.high <= 0:
+            return _Interval(-operand.high, -operand.low)
+        return _Interval(0, builtins.max(-operand.low, operand.high))
+    if node.name == "sign":
+        return _sign_interval(intervals[0] or _Interval(nan=True))
+    if node.name in _FUNCTION_TYPES and _FUNCTION_TYPES[node.name] == "number":
+        return _Interval(nan=node.name in _NAN_FUNCTIONS)
+    return None
+
+
+def _sign_interval(operand: _Interval) -> _Interval:
+    positive = _compare(" > ", operand, _Interval(0, 0))
+    negative = _compare(" < ", operand, _Interval(0, 0))
+    if positive or negative:
+        return _Interval(1, 1) if positive else _Interval(-1, -1)
+    return _Interval(-(operand.low < 0), int(operand.high > 0), nan=operand.nan)
+
+
+_ROUNDINGS: dict[str, Callable[[float], float]] = {
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "round": _round,
+}
+
+# The ranges of functions regardless of their arguments, NaN arguments and
+# missing dates aside.
+_FUNCTION_RANGES = {
+    "length": _Interval(0),
+    "listLength": _Interval(0),
+    "sqrt": _Interval(0, nan=True),
+    "exp": _Interval(0),
+    "minute": _Interval(0, 59),
+    "hour": _Interval(0, 23),
+    "day": _Interval(0, 6),
+    "date": _Interval(1, 31),
+    "month": _Interval(0, 11),
+}
+
+# The functions giving NaN for some numbers, like `log10(-1)`, or strings.
+_NAN_FUNCTIONS = frozenset(["log10", "log2", "toNumber"])
+
+
+def _prune(node: ExprImpl, intervals: list[_Interval | None]) -> Expr:
+    """Replaces a comparison decided by the ranges of its operands by its
+    result, and drops `min`, `max` and `abs` calls or arguments that cannot
+    affect the result."""
+    if isinstance(node, BinaryOperation) and node.operator in _COMPARISONS:
+        left, right = intervals
+        if left is not None and right is not None:
+            result = _compare(node.operator, left, right)
+            return node if result is None else result
+    elif isinstance(node, Function) and None not in intervals:
+        known = cast("list[_Interval]", intervals)
+        if node.name in ("min", "max") and not any(i.nan for i in known):
+            return _prune_extremum(node, known)
+        if node.name == "abs" and known[0].low >= 0:
+            return node.args[0]
+    return node
+
+
+def _prune_extremum(node: Function, intervals: list[_Interval]) -> Expr:
+    """Drops the arguments of `min` or `max` that never hold the result."""
+    upper = node.name == "max"
+    kept: list[Expr] = []
+    for index, arg in enumerate(node.args):
+        dominated = False
+        for other, interval in enumerate(intervals):
+            if other == index:
+                continue
+            if upper:
+                beats = interval.low >= intervals[index].high
+                tie = intervals[index].low >= interval.high
+            else:
+                beats = interval.high <= intervals[index].low
+                tie = intervals[index].high <= interval.low
+            # Of two arguments that always tie, the first is kept.
+            if beats and (not tie or other < index):
+                dominated = True
+                break
+        if not dominated:
+            kept.append(arg)
+
+    if len(kept) == 1:
+        return kept[0]
+    if len(kept) == len(node.args):
+        return node
+    return Function(node.name, *kept)
+
+
+_COMPARISONS = (" == ", " != ", " > ", " >= ", " < ", " <= ")
+
+
+def _compare(operator: str, left: _Interval, right: _Interval) -> bool | None:
+    """Decides `left <operator> right` for all numbers in the two ranges, or
+    returns None if it depends on their values."""
+    result = _compare_numbers(operator, left, right)
+    if left.nan or right.nan:
+        # Comparisons with NaN are false, but for `!=`.
+        return result if result is (operator == " != ") else None
+    return result
+
+
+def _compare_numbers(operator: str, left: _Interval, right: _Interval) -> bool | None:
+    if operator == " > ":
+        return _compare_numbers(" < ", right, left)
+    if operator == " >= ":
+        return _compare_numbers(" <= ", right, left)
+    if operator == " < ":
+        if left.high < right.low or (
+            left.high == right.low and (left.high_open or right.low_open)
+        ):
+            return True
+        return False if left.low >= right.high else None
+    if operator == " <= ":
+        if left.high <= right.low:
+            return True
+        if left.low > right.high or (
+            left.low == right.high and (left.low_open or right.high_open)
+        ):
+            return False
+        return None
+
+    less = _compare_numbers(" < ", left, right)
+    greater = _compare_numbers(" < ", right, left)
+    if less or greater:
+        return operator == " != "
+    if left.low == left.high == right.low == right.high:
+        return operator == " == "
+    return None
+
+
+def _test_facts(
+    test: Expr, may_be_nan: Callable[[Expr], bool]
+) -> tuple[list[tuple[bytes, _Interval]], list[tuple[bytes, _Interval]]]:
+    """Returns the ranges a test establishes for subexpressions when it is
+    true and when it is false.
+
+    Any comparison with NaN but `!=` is false, so a subexpression that may be
+    NaN still may be when an ordering is false.
+    """
+    if isinstance(test, UnaryOperation) and test.operator == "not ":
+        true, false = _test_facts(test.operand, may_be_nan)
+        return false, true
+    if _is_logical(test):
+        # An `and` that is true makes all of its operands true, an `or` that
+        # is false makes all of its operands false.
+        conjunction = test.operator == " and "
+        facts = []
+        for operand in _logical_operands(test):
+            true, false = _test_facts(operand, may_be_nan)
+            facts.extend(true if conjunction else false)
+        return (facts, []) if conjunction else ([], facts)
+    if not isinstance(test, BinaryOperation) or test.operator not in _COMPARISONS:
+        return [], []
+
+    operator, subject, bound = test.operator, test.left, test.right
+    if _is_number_literal(subject):
+        operator = _MIRRORED[operator]
+        subject, bound = bound, subject
+    if not isinstance(subject, ExprImpl) or not _is_number_literal(bound):
+        return [], []
+
+    key = _digest(subject)
+    number = cast(float, bound)
+    if math.isnan(number):
+        return [], []
+    below = _Interval(high=number, high_open=True)
+    at_most = _Interval(high=number)
+    above = _Interval(low=number, low_open=True)
+    at_least = _Interval(low=number)
+    ranges = {
+        " < ": (below, at_least),
+        " <= ": (at_most, above),
+        " > ": (above, at_most),
+        " >= ": (at_least, below),
+        " == ": (_Interval(number, number), None),
+        " != ": (None, _Interval(number, number)),
+    }
+    true_range, false_range = ranges[operator]
+    if false_range is not None and operator != " != " and may_be_nan(subject):
+        false_range = false_range._replace(nan=True)
+    return (
+        [] if true_range is None else [(key, true_range)],
+        [] if false_range is None else [(key, false_range)],
+    )
+
+
+_MIRRORED = {
+    " == ": " == ",
+    " != ": " != ",
+    " < ": " > ",
+    " <= ": " >= ",
+    " > ": " < ",
+    " >= ": " <= ",
+}
+
+
+def _refine(facts: _Facts, ranges: list[tuple[bytes, _Interval]]) -> _Facts:
+    refined = dict(facts)
+    for key, interval in ranges:
+        refined[key] = _intersect(refined.get(key, _Interval(nan=True)), interval)
+    return refined
+
+
+def _intersect(interval: _Interval, other: _Interval) -> _Interval:
+    low, low_open = builtins.max(
+        (interval.low, interval.low_open), (other.low, other.low_open)
+    )
+    high, high_open = builtins.min(
+        (interval.high, not interval.high_open), (other.high, not other.high_open)
+    )
+    return _Interval(low, high, low_open, not high_open, interval.nan and other.nan)
+
+
+def _union(interval: _Interval, other: _Interval) -> _Interval:
+    low, low_open = builtins.min(
+        (interval.low, interval.low_open), (other.low, other.low_open)
+    )
+    high, high_open = builtins.max(
+        (interval.high, not interval.high_open), (other.high, not other.high_open)
+    )
+    return _Interval(low, high, low_open, not high_open, interval.nan or other.nan)
+
+
+def simplify_dates(value: _E) -> _E:
+    """Returns an equivalent expression with date arithmetic normalized.
+
+    Nested `dateAdd` and `dateSubtract` calls are merged into one where their
+    offsets add up exactly, which holds for whole literal days and weeks, and
+    for hours and smaller units, but not for months, quarters or years whose
+    length varies.
+    Literal offsets are expressed in the largest unit that divides them, so
+    7 days become 1 week, and offsets that cancel out are removed, those of
+    an expression only when it is known to be finite. Inverse pairs like
+    `fromTimestamp(timestamp(x))` are replaced by their result, `start(x)`
+    when `x` may be a range, and so is `dateBetween(x, x, unit)` when `x`
+    cannot be missing.
+    """
+    return cast(_E, _transform(value, _simplify_date))
+
+
+def _simplify_date(node: ExprImpl) -> Expr:
+    if not isinstance(node, Function) or not node.args:
+        return node
+    arg = node.args[0]
+    if node.name in ("dateAdd", "dateSubtract"):
+        return _merge_offsets(node)
+    if node.name == "dateBetween" and _digest(arg) == _digest(node.args[1]):
+        # Between a missing date and itself is empty rather than 0.
+        return 0 if _is_present(arg) else node
+    if node.name == "fromTimestamp" and _is_call(arg, "timestamp"):
+        # A timestamp is that of the start of a range.
+        date = arg.args[0]
+        return date if _is_call(date, *_POINT_DATES) else Function("start", date)
+    if node.name in ("start", "end") and _is_call(arg, *_POINT_DATES):
+        return arg
+    return node
+
+
+def _is_call(value: Expr, *names: str) -> TypeGuard[Function]:
+    return isinstance(value, Function) and value.name in names
+
+
+# Functions returning a single date rather than a range.
+_POINT_DATES = ("start", "end", "now", "fromTimestamp")
+
+
+def _merge_offsets(node: Function) -> Expr:
+    offset = _date_offset(node)
+    if offset is None:
+        return node
+
+    base, amount, unit = offset
+    inner = _date_offset(base)
+    # Days are rounded on each call, so only whole amounts add up exactly.
+    whole = unit not in _DAY_UNITS or (
+        inner is not None
+        and _is_number_literal(amount)
+        and _is_number_literal(inner[1])
+    )
+    if inner is not None and inner[2] == unit and whole:
+        if _is_inverse(inner[1], amount):
+            # `n - n` is only 0 for a finite `n`, so otherwise the pair stays.
+            return inner[0] if _is_finite([amount]) else node
+        base = inner[0]
+        amount = _sum_amounts(inner[1], amount)
+    elif (
+        inner is not None
+        and _is_number_literal(amount)
+        and _is_number_literal(inner[1])
+        and _unit_group(inner[2]) is _unit_group(unit) is not None
+    ):
+        group = cast("dict[str, int]", _unit_group(unit))
+        base = inner[0]
+        amount = cast(int, inner[1]) * group[inner[2]] + cast(int, amount) * group[unit]
+        unit = builtins.min(group, key=group.__getitem__)
+    elif not _is_number_literal(amount):
+        return node
+
+    return _emit_offset(base, amount, unit)
+
+
+def _date_offset(value: Expr) -> tuple[Expr, Expr, str] | None:
+    """Splits a `dateAdd` or `dateSubtract` call with a literal unit into its
+    date, its signed amount and its unit."""
+    if not _is_call(value, "dateAdd", "dateSubtract") or len(value.args) != 3:
+        return None
+    base, amount, unit = value.args
+    if not isinstance(unit, str) or _unit_group(unit) is None:
+        return None
+    if _is_number_literal(amount) and not float(cast(float, amount)).is_integer():
+        return None
+    if value.name == "dateSubtract":
+        amount = _negate_amount(amount)
+    return base, amount, unit
+
+
+def _unit_group(unit: str) -> dict[str, int] | None:
+    """Returns the units an amount in `unit` can be converted to exactly, with
+    their size in the smallest of them."""
+    for group in _UNIT_GROUPS:
+        if unit in group:
+            return group
+    return None
+
+
+# Units of calendar time, and of elapsed time in milliseconds. Months vary in
+# length, so only units within one of these groups convert exactly.
+_DAY_UNITS = {"days": 1, "weeks": 7}
+_TIME_UNITS = {
+    "milliseconds": 1,
+    "seconds": 1000,
+    "minutes": 60_000,
+    "hours": 3_600_000,
+}
+_UNIT_GROUPS = (_DAY_UNITS, _TIME_UNITS)
+
+
+def _negate_amount(amount: Expr) -> Expr:
+    if _is_number_literal(amount):
+        return -cast(float, amount)
+    if isinstance(amount, UnaryOperation) and amount.operator == "-":
+        return amount.operand
+    return unary_minus(cast(Number, amount))
+
+
+def _is_inverse(amount: Expr, other: Expr) -> bool:
+    if _is_number_literal(amount) or _is_number_literal(other):
+        return False
+    return _digest(amount) == _digest(_negate_amount(other))
+
+
+def _sum_amounts(amount: Expr, other: Expr) -> Expr:
+    if _is_number_literal(amount) and _is_number_literal(other):
+        return _number_literal(cast(float, amount) + cast(float, other))
+    if isinstance(other, UnaryOperation) and other.operator == "-":
+        return subtract(cast(Number, amount), cast(Number, other.operand))
+    return add(cast(Number, amount), cast(Number, other))
+
+
+def _emit_offset(base: Expr, amount: Expr, unit: str) -> Expr:
+    """Builds a `dateAdd` or `dateSubtract` call for a signed amount, with a
+    literal amount in the largest unit that divides it."""
+    if _is_number_literal(amount):
+        number = int(cast(float, amount))
+        if number == 0:
+            return base
+        group = _unit_group(unit)
+        if group is not None:
+            size = number * group[unit]
+            unit = builtins.max(
+                (name for name in group if size % group[name] == 0),
+                key=group.__getitem__,
+            )
+            number = size // group[unit]
+        if number < 0:
+            return Function("dateSubtract", base, -number, unit)
+        return Function("dateAdd", base, number, unit)
+
+    if isinstance(amount, UnaryOperation) and amount.operator == "-":
+        return Function("dateSubtract", base, amount.operand, unit)
+    return Function("dateAdd", base, amount, unit)
+
+
+def simplify_strings(value: _E) -> _E:
+    """Returns an equivalent expression with string concatenations flattened.
+
+    Constants are folded as by `optimize`, which turns `join` and `concat` calls
+    of literals into a single literal. Chains of string `+` and `concat` are
+    then flattened, adjacent literals are merged and empty ones are dropped,
+    and each chain is written as either `a + b + c` or `concat(a, b, c)`,
+    whichever encodes shorter.
+    """
+    folded = _transform(value, _fold)
+    return cast(_E, _StringSimplifier(folded).run())
+
+
+class _StringSimplifier:
+    def __init__(self, value: Expr) -> None:
+        self.value = value
+        self.types = _TypeInference()
+
+        # Only the outermost node of each chain is simplified, the rest of the
+        # chain is flattened into it.
+        self.interior: set[int] = set()
+        if isinstance(value, ExprImpl):
+            for node in _postorder(value):
+                if self.is_concatenation(node):
+                    for child in _children(node):
+                        if _is_concatenation(child):
+                            self.interior.add(builtins.id(child))
+
+    def run(self) -> Expr:
+        return _transform(
+            self.value,
+            self.rewrite,
+            lambda node: builtins.id(node) in self.interior,
+        )
+
+    def rewrite(self, node: ExprImpl) -> Expr:
+        if not self.is_concatenation(node):
+            return node
+
+        parts: list[Expr] = []
+        for part in _concatenated(node):
+            if isinstance(part, str):
+                if not part:
+                    continue
+                if parts and isinstance(parts[-1], str):
+                    parts[-1] += part
+                    continue
+            parts.append(part)
+
+        if not parts:
+            return ""
+        if len(parts) == 1:
+            return parts[0]
+        # Each `, ` saves a character over ` + `, which pays for `concat()`
+        # from ten parts on.
+        if 2 * (len(parts) - 1) + len("concat()") < 3 * (len(parts) - 1):
+            return Function("concat", *parts)
+        result = parts[0]
+        for part in parts[1:]:
+            result = BinaryOperation(6, " + ", result, part)
+        return result
+
+    def is_concatenation(self, node: Expr) -> bool:
+        if isinstance(node, BinaryOperation) and node.operator == " + ":
+            return self.types.type_of(node) == "string"
+        return isinstance(node, Function) and node.name == "concat"
+
+
+def _is_concatenation(value: Expr) -> bool:
+    """Returns whether a part of a string concatenation is itself one."""
+    if isinstance(value, BinaryOperation):
+        return value.operator == " + "
+    return isinstance(value, Function) and value.name == "concat"
+
+
+def _concatenated(value: Expr) -> Iterator[Expr]:
+    """Yields the parts of a string concatenation in order, flattening nested
+    `+` and `concat`."""
+    stack = [value]
+    while stack:
+        part = stack.pop()
+        if _is_concatenation(part):
+            stack.extend(reversed(_children(cast(ExprImpl, part))))
+        else:
+            yield part
+
+
+class _TypeInference:
+    """Infers the type of expressions from their literals, operators and
+    functions. Props have an unknown type unless it can be inferred from the
+    other operand of a `+`."""
+
+    def __init__(self) -> None:
+        self.types: dict[int, tuple[ExprImpl, str | None]] = {}
+
+    def type_of(self, value: Expr) -> str | None:
+        if not isinstance(value, ExprImpl):
+            return _literal_type(value)
+        if builtins.id(value) not in self.types:
+            skip = lambda node: builtins.id(node) in self.types  # noqa: E731
+            for node in _postorder(value, skip):
+                if builtins.id(node) not in self.types:
+                    self.types[builtins.id(node)] = (node, self.infer(node))
+        return self.types[builtins.id(value)][1]
+
+    def infer(self, node: ExprImpl) -> str | None:
+        if isinstance(node, Constant):
+            return "number"
+        if isinstance(node, UnaryOperation):
+            return "boolean" if node.operator == "not " else "number"
+        if isinstance(node, BinaryOperation):
+            if node.operator == " + ":
+                return self.known(node.left) or self.known(node.right)
+            return _OPERATOR_TYPES.get(node.operator)
+        if isinstance(node, Function):
+            if node.name == "if":
+                return self.known(node.args[1]) or self.known(node.args[2])
+            return _FUNCTION_TYPES.get(node.name)
+        return None
+
+    def known(self, value: Expr) -> str | None:
+        if not isinstance(value, ExprImpl):
+            return _literal_type(value)
+        return self.types[builtins.id(value)][1]
+
+
+def _literal_type(value: Expr) -> str | None:
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    return None
+
+
+_OPERATOR_TYPES = {
+    " - ": "number",
+    " * ": "number",
+    " / ": "number",
+    " % ": "number",
+    " ^ ": "number",
+    " == ": "boolean",
+    " != ": "boolean",
+    " > ": "boolean",
+    " >= ": "boolean",
+    " < ": "boolean",
+    " <= ": "boolean",
+    " and ": "boolean",
+    " or ": "boolean",
+}
+
+_FUNCTION_TYPES = {
+    **dict.fromkeys(
+        ["concat", "join", "slice", "format", "replace", "replaceAll"], "string"
+    ),
+    **dict.fromkeys(["formatDate", "id", "lower", "upper", "progressbar"], "string"),
+    **dict.fromkeys(["contains", "test", "empty"], "boolean"),
+    **dict.fromkeys(
+        ["length", "toNumber", "abs", "cbrt", "ceil", "exp", "floor"], "number"
+    ),
+    **dict.fromkeys(["log10", "log2", "max", "min", "round", "sign"], "number"),
+    **dict.fromkeys(["sqrt", "timestamp", "dateBetween", "listLength"], "number"),
+    **dict.fromkeys(["minute", "hour", "day", "date", "month", "year"], "number"),
+    **dict.fromkeys(
+        ["start", "end", "now", "fromTimestamp", "dateAdd", "dateSubtract"], "date"
+    ),
+}
+
+
+#
+# Common subexpressions
+#
+def bind_common(value: _E, min_length: int = 16, prefix: str = "v") -> _E:
+    """Binds repeated subexpressions to variables with `let`.
+
+    Subexpressions that occur more than once (by structure) and encode to at
+    least `min_length` characters are evaluated once in a `let` or `lets` at
+    the top of the formula, when doing so shortens it. Larger subexpressions
+    are considered first, so a repeated expression is not also bound inside
+    an already bound one. Variables are named `prefix` followed by a number.
+    Subexpressions that only run in some branches of an `if` or on one side of
+    a short-circuiting `and`/`or` are left in place, as binding them would
+    evaluate them eagerly.
+
+    `let` is part of Notion's 2.0 formula language.
+    """
+    if not isinstance(value, ExprImpl):
+        return value
+
+    nodes = _postorder(value)
+    classes: dict[bytes, int] = {}
+    lengths: list[int] = []
+    edges: list[list[int]] = []
+    # Bit masks of the long enough subexpressions evaluated whenever each one
+    # is, so that nothing is bound that only runs in some branches.
+    evaluated: list[int] = []
+    for node in nodes:
+        digest = _digest(node)
+        if digest not in classes:
+            classes[digest] = len(lengths)
+            children = [
+                classes[_digest(child)]
+                for child in _children(node)
+                if isinstance(child, ExprImpl)
+            ]
+            edges.append(children)
+            lengths.append(_node_length(node, [lengths[i] for i in children]))
+            masks = [
+                evaluated[classes[_digest(child)]] if isinstance(child, ExprImpl) else 0
+                for child in _children(node)
+            ]
+            mask = _evaluated_mask(node, masks)
+            if lengths[-1] >= min_length:
+                mask |= 1 << classes[digest]
+            evaluated.append(mask)
+
+    bound = _choose_bindings(lengths, edges, min_length, len(prefix), evaluated[-1])
+    if not bound:
+        return value
+
+    names = {index: f"{prefix}{number}" for number, index in enumerate(bound, 1)}
+    bindings: dict[int, Expr] = {}
+    results: dict[int, Expr] = {}
+    for node in nodes:
+        rebuilt = _rebuilt(node, results)
+        index = classes[_digest(node)]
+        if index in names:
+            bindings.setdefault(index, rebuilt)
+            rebuilt = Constant(names[index])
+        results[builtins.id(node)] = rebuilt
+
+    args: list[Expr] = []
+    for index in bound:
+        args.extend((Constant(names[index]), bindings[index]))
+    args.append(results[builtins.id(value)])
+    return cast(_E, Function("let" if len(bound) == 1 else "lets", *args))
+
+
+def _evaluated_mask(node: ExprImpl, masks: list[int]) -> int:
+    """Returns the mask of subexpressions evaluated whenever `node` is, given
+    those evaluated whenever each of its children is."""
+    if isinstance(node, Function) and node.name in ("if", "ifs") and len(masks) % 2:
+        # A branch only runs after its test, and another branch may be taken.
+        mask = masks[-1]
+        for index in range(len(masks) - 3, -1, -2):
+            mask = masks[index] | (masks[index + 1] & mask)
+        return mask
+    if _is_logical(node):
+        return masks[0]
+    mask = 0
+    for child in masks:
+        mask |= child
+    return mask
+
+
+def _choose_bindings(
+    lengths: list[int],
+    edges: list[list[int]],
+    min_length: int,
+    prefix_length: int,
+    eligible: int,
+) -> list[int]:
+    """Returns the subexpressions worth binding, children before parents.
+
+    Subexpressions are listed children first, with the root last. They are
+    visited parents first, so the number of times each one is written out
+    accounts for the larger expressions already bound around it. Only those
+    in the `eligible` bit mask, which are always evaluated, are bound.
+    """
+    occurrences = [0] * len(lengths)
+    occurrences[-1] = 1
+    bound: list[int] = []
+    for index in range(len(lengths) - 1, -1, -1):
+        count = occurrences[index]
+        name_length = prefix_length + len(str(len(bound) + 1))
+        saving = (count - 1) * lengths[index] - (count + 1) * name_length - 4
+        if (
+            count > 1
+            and lengths[index] >= min_length
+            and eligible >> index & 1
+            and saving > 0
+        ):
+            bound.append(index)
+            count = 1
+        for child in edges[index]:
+            occurrences[child] += count
+    return sorted(bound)
+
+
+def _node_length(node: ExprImpl, lengths: list[int]) -> int:
+    """Returns the encoded length of a node given the encoded lengths of its
+    child nodes."""
+    children = iter(lengths)
+    length = 0
+    for child in _children(node):
+        if isinstance(child, ExprImpl):
+            length += next(children)
+        else:
+            length += len(json.dumps(child))
+
+    if isinstance(node, Function):
+        return length + len(node.name) + 2 + 2 * builtins.max(len(node.args) - 1, 0)
+    if isinstance(node, (UnaryOperation, BinaryOperation)):
+        parens = 0
+        if isinstance(node, BinaryOperation):
+            parens += 2 * _needs_parens_left(node.precedence, node.left)
+            parens += 2 * _needs_parens_right(node.precedence, node.right)
+        else:
+            parens += 2 * _needs_parens_right(node.precedence, node.operand)
+        return length + len(node.operator) + parens
+    if isinstance(node, Constant):
+        return len(node.name)
+    return len(node.encode())
+
+
+#
+# Evaluation
+#
+def evaluate(
+    value: Expr,
+    row: Mapping[str, Any],
+    *,
+    now: datetime.datetime | None = None,
+    page_id: str | None = None,
+) -> Any:
+    """Evaluates an expression against a row of prop values, as Notion would.
+
+    Props are looked up by name in `row`: numbers, strings and booleans as
+    they are, and dates as `datetime` values, or `(start, end)` tuples for date
+    ranges. Dates without a time zone are read as UTC. `now()` returns `now`,
+    which defaults to the current local time, and `id()` returns `page_id`.
+
+    Numbers follow JavaScript semantics, so dividing by zero gives an infinity
+    and `sqrt(-1)` gives NaN rather than raising. Dates are returned as aware
+    datetimes. Empty dates and numbers are None, which is `empty`, computes
+    and compares like NaN, and makes date functions return None, NaN or "".
+    """
+    if now is None:
+        now = datetime.datetime.now().astimezone()
+    return _Evaluator(row, now=_date(now), page_id=page_id).run(value)
+
+
+def compile_expr(
+    value: Expr,
+    *,
+    now: datetime.datetime | None = None,
+    page_id: str | None = None,
+) -> Callable[[Mapping[str, Any]], Any]:
+    """Compiles an expression into a function of a row of prop values.
+
+    The function returns the same results as `evaluate`, many times faster: the
+    expression is translated once into Python source, where operators on values
+    of known types are inlined and subexpressions occurring more than once,
+    props included, are computed at most once per row into local variables.
+    Compiled code is cached by the structure of the expression. `now()` is
+    pinned when compiling, to the current local time by default.
+    """
+    key = _digest(value)
+    factory = _COMPILED.get(key)
+    if factory is None:
+        factory = _Compiler(value).run()
+        if len(_COMPILED) >= _COMPILED_SIZE:
+            del _COMPILED[next(iter(_COMPILED))]
+        _COMPILED[key] = factory
+    if now is None:
+        now = datetime.datetime.now().astimezone()
+    return factory(_date(now), page_id)
+
+
+def evaluate_columns(
+    value: Expr,
+    columns: Mapping[str, Any],
+    *,
+    now: datetime.datetime | None = None,
+    page_id: str | None = None,
+) -> Any:
+    """Evaluates an expression over columns of prop values with NumPy.
+
+    `columns` maps prop names to sequences of equal length, preferably NumPy
+    arrays: floats for numbers, booleans, strings, and `datetime64` for dates
+    in UTC. The result is an array of the value for each row, with dates as
+    `datetime64[ms]`. Empty numbers and dates are None, or NaN and NaT in
+    arrays, and empty dates are NaT in results. Operators, math functions and
+    date arithmetic are computed for all rows at once; only text functions,
+    which NumPy has no faster kernels for, are computed row by row with the
+    code of `evaluate`.
+
+    Unlike `evaluate`, both branches of an `if` are computed for all rows, and
+    time zones are taken to be fixed UTC offsets. NumPy must be installed.
+    """
+    if now is None:
+        now = datetime.datetime.now().astimezone()
+    return _Vectorizer(columns, now=_date(now), page_id=page_id).run(value)
+
+
+def evaluate_csv(
+    value: Expr | Mapping[str, Expr],
+    src: _File,
+    dst: _File,
+    *,
+    types: Mapping[str, str] | None = None,
+    chunk_size: int = 10_000,
+    now: datetime.datetime | None = None,
+    page_id: str | None = None,
+) -> int:
+    """Evaluates formulas over the rows of a CSV file, such as a Notion
+    database export, and writes the rows with their results to another.
+
+    `value` is an expression for a column named "Formula", or a mapping of
+    column names to expressions. Columns that already exist are replaced.
+    Files are given as paths or text streams, and are read and written
+    `chunk_size` rows at a time, so memory use doesn't grow with their size.
+
+    Props are read from the columns of the same name as the type they're used
+    as in the formulas, or as declared in `types` ("boolean", "date",
+    "number" or "string"): numbers as formatted by Notion, checkboxes as
+    "Yes" or "No", and dates like "January 15, 2024 9:05 AM" or in ISO
+    format, in the time zone of `now`, with ranges joined by " → ". Results
+    are written the same way. Empty cells are read as missing values, as
+    described for `evaluate`. Rows where a formula computes a date out of the
+    range of `datetime` get an empty cell. Returns the number of rows.
+    """
+    formulas = dict(value) if isinstance(value, Mapping) else {"Formula": value}
+    if now is None:
+        now = datetime.datetime.now().astimezone()
+    now = _date(now)
+    props = _prop_types(formulas.values())
+    for name, kind in (types or {}).items():
+        if kind not in _CELL_READERS:
+            raise ValueError(f"unknown type for {name!r}: {kind!r}")
+        props[name] = kind
+    functions = [
+        compile_expr(formula, now=now, page_id=page_id) for formula in formulas.values()
+    ]
+
+    with _open_csv(src, "r") as source, _open_csv(dst, "w") as target:
+        reader = csv.reader(source)
+        writer = csv.writer(target)
+        header = next(reader, [])
+        if header:
+            header[0] = header[0].lstrip("\ufeff")
+        columns = _prop_columns(header, props)
+        header += [name for name in formulas if name not in header]
+        outputs = [header.index(name) for name in formulas]
+        writer.writerow(header)
+
+        count = 0
+        for chunk in _chunks(reader, chunk_size):
+            for row in chunk:
+                count += 1
+                row += [""] * (len(header) - len(row))
+                values = _read_row(row, columns, now.tzinfo, count)
+                for index, function in zip(outputs, functions):
+                    row[index] = _evaluate_cell(function, values)
+            writer.writerows(chunk)
+    return count
+
+
+def evaluate_parallel(
+    value: Expr,
+    rows: Iterable[Mapping[str, Any]],
+    *,
+    workers: int | None = None,
+    chunk_size: int = 1_000,
+    now: datetime.datetime | None = None,
+    page_id: str | None = None,
+) -> list[Any]:
+    """Evaluates an expression over rows of prop values in worker processes,
+    returning the result for each row in order.
+
+    The expression is sent to each of `workers` processes once, as an
+    `ExprGraph`, and compiled there with `compile_expr`; rows are then sent
+    `chunk_size` at a time, with a few chunks per worker in flight, so rows
+    are consumed lazily. `workers` defaults to the number of CPUs, and with a
+    single one rows are evaluated in this process instead, saving the cost of
+    the pool. Rows and results must be picklable, and errors are raised as by
+    `evaluate`. Where processes are spawned, the calling script needs a
+    `__main__` guard.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError(f"workers must be positive: {workers}")
+    if now is None:
+        now = datetime.datetime.now().astimezone()
+    if workers == 1:
+        formula = compile_expr(value, now=now, page_id=page_id)
+        return [formula(row) for chunk in _chunks(rows, chunk_size) for row in chunk]
+    graph = ExprGraph.from_expr(value)
+    results: list[Any] = []
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_start_worker, initargs=(graph, _date(now), page_id)
+    ) as executor:
+        pending: collections.deque[concurrent.futures.Future[list[Any]]]
+        pending = collections.deque()
+        for chunk in _chunks(rows, chunk_size):
+            if len(pending) == 2 * workers:
+                results += pending.popleft().result()
+            pending.append(executor.submit(_evaluate_chunk, chunk))
+        for future in pending:
+            results += future.result()
+    return results
+
+
+class Profile:
+    """How often the test of each `if` call was true over a sample of rows,
+    as recorded by `profile`."""
+
+    __slots__ = ("hits", "rows")
+
+    def __init__(self) -> None:
+        self.hits: dict[bytes, int] = {}
+        self.rows = 0
+
+    def __repr__(self) -> str:
+        return f"Profile(rows={self.rows}, tests={len(self.hits)})"
+
+    def hits_of(self, test: Expr) -> int:
+        """Returns the number of times `test` was true as the test of an `if`."""
+        return self.hits.get(_digest(test), 0)
+
+
+def profile(
+    value: Expr, rows: Iterable[Mapping[str, Any]], into: Profile | None = None
+) -> Profile:
+    """Evaluates an expression over sample rows of prop values, recording how
+    often the test of each `if` call is true.
+
+    Pass the result to `reorder` to test the most frequent cases first. Rows
+    are consumed lazily, and with `into` an existing profile is extended.
+    """
+    result = Profile() if into is None else into
+    now = datetime.datetime.now().astimezone()
+
+    def record(test: Expr, outcome: bool) -> None:
+        if outcome:
+            key = _digest(test)
+            result.hits[key] = result.hits.get(key, 0) + 1
+
+    for row in rows:
+        _Evaluator(row, record, now=now).run(value)
+        result.rows += 1
+    return result
+
+
+class _Evaluator:
+    """Evaluates an expression against a row of prop values.
+
+    The tree is walked with an explicit stack of steps rather than by
+    recursion. Only the branch taken by an `if` is evaluated, `and`/`or`
+    short-circuit, and shared subexpressions are evaluated once per row.
+    """
+
+    def __init__(
+        self,
+        row: Mapping[str, Any],
+        on_test: Callable[[Expr, bool], None] | None = None,
+        *,
+        now: datetime.datetime,
+        page_id: str | None = None,
+    ) -> None:
+        self.row = row
+        self.on_test = on_test
+        self.now = now
+        self.page_id = page_id
+        self.memo: dict[int, Any] = {}
+
+    def run(self, value: Expr) -> Any:
+        values: list[Any] = []
+        stack: list[tuple[str, Expr]] = [("eval", value)]
+        while stack:
+            step, item = stack.pop()
+            if step == "eval":
+                self.visit(item, stack, values)
+            elif step == "store":
+                self.memo[builtins.id(item)] = values[-1]
+            elif step == "branch":
+                self.branch(cast(Function, item), stack, values)
+            elif step == "logic":
+                self.logic(cast(BinaryOperation, item), stack, values)
+            else:
+                node = cast(ExprImpl, item)
+                start = len(values) - len(_children(node))
+                result = self.apply(node, values[start:])
+                del values[start:]
+                values.append(result)
+                self.memo[builtins.id(node)] = result
+        return values[-1]
+
+    def visit(
+        self, value: Expr, stack: list[tuple[str, Expr]], values: list[Any]
+    ) -> None:
+        if not isinstance(value, ExprImpl):
+            values.append(value)
+        elif builtins.id(value) in self.memo:
+            values.append(self.memo[builtins.id(value)])
+        elif _is_if(value):
+            stack.append(("branch", value))
+            stack.append(("eval", value.args[0]))
+        elif _is_logical(value):
+            stack.append(("logic", value))
+            stack.append(("eval", value.left))
+        else:
+            stack.append(("apply", value))
+            stack.extend(("eval", child) for child in reversed(_children(value)))
+
+    def branch(
+        self, node: Function, stack: list[tuple[str, Expr]], values: list[Any]
+    ) -> None:
+        test = _boolean(values.pop())
+        if self.on_test is not None:
+            self.on_test(node.args[0], test)
+        stack.append(("store", node))
+        stack.append(("eval", node.args[1] if test else node.args[2]))
+
+    def logic(
+        self, node: BinaryOperation, stack: list[tuple[str, Expr]], values: list[Any]
+    ) -> None:
+        left = _boolean(values[-1])
+        if left is (node.operator == " or "):
+            self.memo[builtins.id(node)] = left
+        else:
+            values.pop()
+            stack.append(("store", node))
+            stack.append(("eval", node.right))
+
+    def apply(self, node: ExprImpl, args: list[Any]) -> Any:
+        if isinstance(node, Constant):
+            return _CONSTANT_VALUES[node.name]
+        if isinstance(node, Function):
+            return self.call(node.name, args)
+        if isinstance(node, UnaryOperation):
+            return _UNARY_FOLDS[node.operator](*args)
+        if isinstance(node, BinaryOperation):
+            return _OPERATOR_EVALUATIONS[node.operator](*args)
+        raise TypeError(f"cannot evaluate {type(node).__name__}")
+
+    def call(self, name: str, args: list[Any]) -> Any:
+        if name == "prop":
+            return self.row[_string(args[0])]
+        if name == "now":
+            return self.now
+        if name == "fromTimestamp":
+            return _from_timestamp(args[0], self.now.tzinfo)
+        if name == "id":
+            return _page_id(self.page_id)
+        if name not in _EVALUATIONS:
+            raise ValueError(f"cannot evaluate {name}()")
+        return _EVALUATIONS[name](*args)
+
+
+def _ascii_case(source: str, target: str) -> Callable[[Any], str]:
+    table = str.maketrans(source, target)
+
+    def convert(value: Any) -> str:
+        return _string(value).translate(table)
+
+    return convert
+
+
+def _list_length(value: Any) -> int:
+    return 0 if _empty(value) else _string(value).count(",") + 1
+
+
+def _evaluate_progressbar(percent: Any, full: Any, empty: Any, size: Any) -> str:
+    # As encoded, the number of full characters is clamped to the size, and a
+    # NaN percent gives an empty string.
+    length = _number(size)
+    scaled = length * _number(percent)
+    if math.isnan(scaled):
+        return ""
+    count = math.floor(builtins.min(builtins.max(scaled, 0), length))
+    return _string(full) * count + _string(empty) * int(length - count)
+
+
+def _divide(value: Any, other: Any) -> float:
+    dividend, divisor = _number(value), _number(other)
+    if divisor != 0:
+        return dividend / divisor
+    if dividend == 0 or math.isnan(dividend):
+        return math.nan
+    return math.copysign(math.inf, dividend) * math.copysign(1, divisor)
+
+
+def _remainder(value: Any, other: Any) -> float:
+    dividend, divisor = _number(value), _number(other)
+    if divisor == 0 or math.isinf(dividend):
+        return math.nan
+    return math.fmod(dividend, divisor)
+
+
+def _power(base: Any, power: Any) -> float:
+    try:
+        return _pow(base, power)
+    except ZeroDivisionError:
+        return math.inf
+    except OverflowError:
+        negative = _number(base) < 0 and _number(power) % 2 == 1
+        return -math.inf if negative else math.inf
+    except ValueError:
+        return math.nan
+
+
+def _integral(function: Callable[[Any], int]) -> Callable[[Any], float]:
+    """Wraps a rounding function to pass infinities and NaN through."""
+
+    def rounded(value: Any) -> float:
+        number = _number(value)
+        return function(number) if math.isfinite(number) else number
+
+    return rounded
+
+
+def _evaluate_cbrt(value: Any) -> float:
+    try:
+        return _cbrt(value)
+    except ValueError:
+        number = _number(value)
+        return math.copysign(builtins.abs(number) ** (1 / 3), number)
+
+
+def _evaluate_exp(value: Any) -> float:
+    try:
+        return math.exp(_number(value))
+    except OverflowError:
+        return math.inf
+
+
+def _evaluate_log(function: Callable[[float], float]) -> Callable[[Any], float]:
+    def log(value: Any) -> float:
+        number = _number(value)
+        if number > 0:
+            return function(number)
+        return -math.inf if number == 0 else math.nan
+
+    return log
+
+
+def _evaluate_sqrt(value: Any) -> float:
+    number = _number(value)
+    return math.sqrt(number) if number >= 0 else math.nan
+
+
+def _evaluate_to_number(value: Any) -> float:
+    if isinstance(value, (datetime.date, tuple)):
+        return _timestamp(value)
+    try:
+        return _to_number(value)
+    except ValueError:
+        return math.nan
+
+
+def _evaluate_format(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, tuple):
+        return " → ".join(_format_date(date, _DATE_FORMAT) for date in value)
+    if isinstance(value, datetime.date):
+        return _format_date(value, _DATE_FORMAT)
+    if isinstance(value, float) and not math.isfinite(value):
+        # Like JavaScript, and unlike `repr`.
+        return "NaN" if math.isnan(value) else f"{'-' * (value < 0)}Infinity"
+    return _format(value)
+
+
+_DATE_FORMAT = "MMMM D, YYYY h:mm A"
+
+_DATE_PARTS: dict[str, Callable[[Any], int]] = {
+    "minute": lambda value: _date(value).minute,
+    "hour": lambda value: _date(value).hour,
+    "day": lambda value: _date(value).isoweekday() % 7,
+    "date": lambda value: _date(value).day,
+    "month": lambda value: _date(value).month - 1,
+    "year": lambda value: _date(value).year,
+}
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _timestamp(value: Any) -> int:
+    return (_date(value) - _EPOCH) // datetime.timedelta(milliseconds=1)
+
+
+def _from_timestamp(
+    value: Any, zone: datetime.tzinfo | None
+) -> datetime.datetime | None:
+    number = _number(value)
+    if not math.isfinite(number):
+        # Like an invalid date in Moment.js, which Notion shows as empty.
+        return None
+    date = _EPOCH + datetime.timedelta(milliseconds=number)
+    return date.astimezone(zone)
+
+
+def _page_id(page_id: str | None) -> str:
+    if page_id is None:
+        raise ValueError("cannot evaluate id() without a page_id")
+    return page_id
+
+
+def _end(value: Any) -> datetime.datetime:
+    if isinstance(value, tuple) and len(value) == 2:
+        return _date(value[1])
+    return _date(value)
+
+
+def _on_missing(function: Callable[..., Any], missing: Any) -> Callable[..., Any]:
+    """Wraps a function of dates to return `missing` when one of its arguments
+    is missing, as Notion does for an empty date."""
+
+    def evaluate(*args: Any) -> Any:
+        if builtins.any(arg is None for arg in args):
+            return missing
+        return function(*args)
+
+    return evaluate
+
+
+def _date_add(value: Any, amount: Any, unit: Any) -> datetime.datetime | None:
+    # Like Moment.js, months and days are added in local time and rounded
+    # half away from zero, smaller units are added as elapsed time.
+    date, number, unit = _date(value), _number(amount), _string(unit)
+    if not math.isfinite(number):
+        # An invalid date, which Notion shows as empty.
+        return None
+    if unit in _MONTH_UNITS:
+        return _add_months(date, _round_half_away(number * _MONTH_UNITS[unit]))
+    if unit in _DAY_UNITS:
+        days = _round_half_away(number * _DAY_UNITS[unit])
+        return date + datetime.timedelta(days=days)
+    if unit in _TIME_UNITS:
+        elapsed = datetime.timedelta(milliseconds=number * _TIME_UNITS[unit])
+        utc = date.astimezone(datetime.timezone.utc)
+        return (utc + elapsed).astimezone(date.tzinfo)
+    raise ValueError(f"unknown date unit: {unit!r}")
+
+
+def _date_subtract(value: Any, amount: Any, unit: Any) -> datetime.datetime | None:
+    return _date_add(value, -_number(amount), unit)
+
+
+def _round_half_away(value: float) -> int:
+    rounded = math.floor(builtins.abs(value) + 0.5)
+    return rounded if value >= 0 else -rounded
+
+
+def _add_months(date: datetime.datetime, months: int) -> datetime.datetime:
+    """Adds months to a date, clamping the day to the length of the month."""
+    year, month = divmod(date.year * 12 + date.month - 1 + months, 12)
+    if not datetime.MINYEAR <= year <= datetime.MAXYEAR:
+        # Like adding a duration out of range.
+        raise OverflowError("date value out of range")
+    day = builtins.min(date.day, calendar.monthrange(year, month + 1)[1])
+    return date.replace(year=year, month=month + 1, day=day)
+
+
+def _date_between(value: Any, other: Any, unit: Any) -> int:
+    # Like Moment.js, differences are truncated toward zero, days are counted
+    # in local time and months by their calendar dates.
+    date, unit = _date(value), _string(unit)
+    other = _date(other).astimezone(date.tzinfo)
+    if unit in _MONTH_UNITS:
+        difference = _month_difference(date, other) / _MONTH_UNITS[unit]
+    elif unit in _DURATIONS:
+        elapsed = date - other
+        if unit in _DAY_UNITS:
+            offset = cast(datetime.timedelta, date.utcoffset())
+            elapsed += offset - cast(datetime.timedelta, other.utcoffset())
+        difference = elapsed / _DURATIONS[unit]
+    else:
+        raise ValueError(f"unknown date unit: {unit!r}")
+    return math.trunc(difference)
+
+
+_DURATIONS = {
+    **{unit: datetime.timedelta(days=days) for unit, days in _DAY_UNITS.items()},
+    **{
+        unit: datetime.timedelta(milliseconds=size)
+        for unit, size in _TIME_UNITS.items()
+    },
+}
+
+
+def _month_difference(date: datetime.datetime, other: datetime.datetime) -> float:
+    """Returns the number of months from `other` to `date`, with the fraction
+    of a month measured like Moment.js does."""
+    if date.day < other.day:
+        return -_month_difference(other, date)
+    months = (other.year - date.year) * 12 + other.month - date.month
+    anchor = _add_months(date, months)
+    if other < anchor:
+        fraction = (other - anchor) / (anchor - _add_months(date, months - 1))
+    else:
+        fraction = (other - anchor) / (_add_months(date, months + 1) - anchor)
+    return -(months + fraction)
+
+
+_MONTH_UNITS = {"months": 1, "quarters": 3, "years": 12}
+
+
+def _format_date(value: Any, pattern: Any) -> str:
+    """Formats a date with a Moment.js format string, in which text between
+    square brackets is kept as is."""
+    date = _date(value)
+
+    def token(match: re.Match[str]) -> str:
+        if match.group(1) is not None:
+            return match.group(1)
+        return _DATE_TOKENS[match.group(0)](date)
+
+    return _DATE_TOKEN_PATTERN.sub(token, _string(pattern))
+
+
+def _ordinal(number: int) -> str:
+    if number % 100 in (11, 12, 13) or number % 10 not in (1, 2, 3):
+        return f"{number}th"
+    return str(number) + ("st", "nd", "rd")[number % 10 - 1]
+
+
+def _utc_offset(date: datetime.datetime, separator: str) -> str:
+    offset = cast(datetime.timedelta, date.utcoffset())
+    minutes = int(offset / datetime.timedelta(minutes=1))
+    hours, minutes = divmod(builtins.abs(minutes), 60)
+    sign = "-" if offset < datetime.timedelta() else "+"
+    return f"{sign}{hours:02d}{separator}{minutes:02d}"
+
+
+_MONTH_NAMES = (
+    "January",
+    "February",
+    "March",
+    "April",
+    "May",
+    "June",
+    "July",
+    "August",
+    "September",
+    "October",
+    "November",
+    "December",
+)
+
+_WEEKDAY_NAMES = (
+    "Sunday",
+    "Monday",
+    "Tuesday",
+    "Wednesday",
+    "Thursday",
+    "Friday",
+    "Saturday",
+)
+
+_DATE_TOKENS: dict[str, Callable[[datetime.datetime], str]] = {
+    "YYYY": lambda date: f"{date.year:04d}",
+    "YY": lambda date: f"{date.year % 100:02d}",
+    "Q": lambda date: str((date.month + 2) // 3),
+    "MMMM": lambda date: _MONTH_NAMES[date.month - 1],
+    "MMM": lambda date: _MONTH_NAMES[date.month - 1][:3],
+    "MM": lambda date: f"{date.month:02d}",
+    "M": lambda date: str(date.month),
+    "Do": lambda date: _ordinal(date.day),
+    "DD": lambda date: f"{date.day:02d}",
+    "D": lambda date: str(date.day),
+    "dddd": lambda date: _WEEKDAY_NAMES[date.isoweekday() % 7],
+    "ddd": lambda date: _WEEKDAY_NAMES[date.isoweekday() % 7][:3],
+    "dd": lambda date: _WEEKDAY_NAMES[date.isoweekday() % 7][:2],
+    "d": lambda date: str(date.isoweekday() % 7),
+    "HH": lambda date: f"{date.hour:02d}",
+    "H": lambda date: str(date.hour),
+    "hh": lambda date: f"{date.hour % 12 or 12:02d}",
+    "h": lambda date: str(date.hour % 12 or 12),
+    "mm": lambda date: f"{date.minute:02d}",
+    "m": lambda date: str(date.minute),
+    "ss": lambda date: f"{date.second:02d}",
+    "s": lambda date: str(date.second),
+    "SSS": lambda date: f"{date.microsecond // 1000:03d}",
+    "A": lambda date: "AM" if date.hour < 12 else "PM",
+    "a": lambda date: "am" if date.hour < 12 else "pm",
+    "X": lambda date: str(_timestamp(date) // 1000),
+    "x": lambda date: str(_timestamp(date)),
+    "Z": lambda date: _utc_offset(date, ":"),
+    "ZZ": lambda date: _utc_offset(date, ""),
+}
+
+# Longer tokens are tried first, so `MMMM` isn't read as four `M`.
+_DATE_TOKEN_PATTERN = re.compile(
+    r"\[([^\]]*)\]|" + "|".join(sorted(_DATE_TOKENS, key=len, reverse=True))
+)
+
+_CONSTANT_VALUES = {"e": math.e, "pi": math.pi}
+
+_OPERATOR_EVALUATIONS: dict[str, Callable[..., Any]] = {
+    **_BINARY_FOLDS,
+    " / ": _divide,
+    " % ": _remainder,
+    " ^ ": _power,
+}
+
+_EVALUATIONS: dict[str, Callable[..., Any]] = {
+    **_FUNCTION_FOLDS,
+    "lower": _ascii_case("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz"),
+    "upper": _ascii_case("abcdefghijklmnopqrstuvwxyz", "ABCDEFGHIJKLMNOPQRSTUVWXYZ"),
+    "listLength": _list_length,
+    "progressbar": _evaluate_progressbar,
+    "format": _evaluate_format,
+    "toNumber": _evaluate_to_number,
+    "cbrt": _evaluate_cbrt,
+    "ceil": _integral(math.ceil),
+    "exp": _evaluate_exp,
+    "floor": _integral(math.floor),
+    "log10": _evaluate_log(math.log10),
+    "log2": _evaluate_log(math.log2),
+    "round": _integral(_round),
+    "sqrt": _evaluate_sqrt,
+    "start": _on_missing(_date, None),
+    "end": _on_missing(_end, None),
+    "timestamp": _on_missing(_timestamp, math.nan),
+    "dateAdd": _on_missing(_date_add, None),
+    "dateSubtract": _on_missing(_date_subtract, None),
+    "dateBetween": _on_missing(_date_between, math.nan),
+    "formatDate": _on_missing(_format_date, ""),
+    **{name: _on_missing(part, math.nan) for name, part in _DATE_PARTS.items()},
+}
+
+
+#
+# Compilation
+#
+_Formula = Callable[[Mapping[str, Any]], Any]
+
+# Compiled formulas by the digest of their expression, oldest first.
+_COMPILED: dict[bytes, Callable[[datetime.datetime, Union[str, None]], _Formula]] = {}
+_COMPILED_SIZE = 256
+
+# Deeper expressions are split into statements and deeper blocks are
+# interpreted, to stay within the limits of the Python parser. Expressions
+# whose shared subexpressions nest deeper are interpreted altogether, to stay
+# within the recursion limit.
+_MAX_DEPTH = 32
+_MAX_BLOCKS = 64
+_MAX_CALLS = 256
+
+# Marks values of a row that have not been computed yet.
+_UNSET = object()
+
+_Values = List[Tuple[str, int]]
+_Steps = List[Tuple[str, Any]]
+
+
+class _Compiler:
+    """Translates an expression into the source of a Python function.
+
+    Like `_Evaluator`, the tree is walked with an explicit stack of steps, and
+    the code for the branches of `if` and the operands of `and`/`or` is only
+    run when needed. Chains of these are flattened into `elif` clauses and
+    sequential blocks rather than nested. Subexpressions occurring more than
+    once are stored in locals the first time they are computed. Where it
+    depends on the branches taken whether they have been, they're instead
+    computed by a function of their own, which keeps their value for the row.
+    """
+
+    def __init__(self, value: Expr) -> None:
+        self.value = value
+        self.types = _CertainTypes()
+        self.types.type_of(value)
+        self.shared = _shared_names(value)
+        self.branching = self.branching_keys()
+        self.written: set[bytes] = set()
+        self.namespace: dict[str, Any] = {"_UNSET": _UNSET}
+        self.bound: dict[int, str] = {}
+        self.locals = 0
+
+        # The shared subexpressions computed by functions of their own, in
+        # the order they were needed, with the ones each of those needs, and
+        # the lines of the formula storing their value when it computes them.
+        self.getters: dict[bytes, int] = {}
+        self.order: list[bytes] = []
+        self.calls: dict[bytes, set[bytes]] = {}
+        self.stores: list[tuple[int, bytes]] = []
+        self.unit: bytes | None = None
+        self.reset()
+
+    def reset(self) -> None:
+        self.lines: list[str] = []
+
+        # Keys of the shared subexpressions computed in each open block, and
+        # on any path to the current line, in the order they were added.
+        self.scopes: list[list[bytes]] = [[]]
+        self.defined: set[bytes] = set()
+        self.maybe: set[bytes] = set()
+        self.added: list[bytes] = []
+
+    def run(self) -> Callable[[datetime.datetime, str | None], _Formula]:
+        lines = ["def factory(now, page_id):", "    zone = now.tzinfo"]
+        formula, code = self.body(self.value)
+        nodes = {_digest(node): node for node in self.shared_nodes()}
+        # Functions are compiled as they're needed, by the formula or by each
+        # other, in the order of their index.
+        for key in self.order:
+            body, result = self.body(nodes[key], key)
+            index = self.getters[key]
+            lines += [
+                "",
+                f"    def {self.getter(key)}(row, m):",
+                f"        if m[{index}] is not _UNSET:",
+                f"            return m[{index}]",
+                *body,
+                f"        value = m[{index}] = {result}",
+                "        return value",
+            ]
+        if self.nesting() > _MAX_CALLS:
+            return _interpreter(self.value)
+
+        for line, key in self.stores:
+            if key in self.getters:
+                name = self.shared[key]
+                formula[line] = formula[line].replace(
+                    f"{name} = ", f"{name} = m[{self.getters[key]}] = ", 1
+                )
+        lines += [
+            "",
+            "    def formula(row):",
+            *([f"        m = [_UNSET] * {len(self.getters)}"] if self.getters else []),
+            *formula,
+            f"        return {code}",
+            "",
+            "    return formula",
+        ]
+        source = "\n".join(line for line in lines if not line.isspace())
+        namespace = dict(self.namespace)
+        exec(compile(source, "<formula>", "exec"), namespace)
+        return cast(
+            Callable[[datetime.datetime, Union[str, None]], _Formula],
+            namespace["factory"],
+        )
+
+    def body(self, value: Expr, key: bytes | None = None) -> tuple[list[str], str]:
+        """Returns the statements computing `value`, and the code of its value,
+        for the formula or the function of the shared subexpression `key`."""
+        self.unit = key
+        self.reset()
+        steps: dict[str, Callable[[Any, _Steps, _Values], None]] = {
+            "eval": self.visit,
+            "node": lambda node, stack, values: self.schedule(node, stack),
+            "apply": self.apply,
+            "assign": self.assign,
+            "test": self.test,
+            "header": self.header,
+            "arm": self.arm,
+            "default": self.default,
+            "finish": self.finish,
+            "operand": self.operand,
+        }
+        values: _Values = []
+        stack: _Steps = [("eval" if key is None else "node", value)]
+        while stack:
+            step, item = stack.pop()
+            steps[step](item, stack, values)
+        return self.lines, values[-1][0]
+
+    def branching_keys(self) -> set[bytes]:
+        """Returns the keys of the shared subexpressions containing blocks.
+
+        These are written out once at most, so that the code for nested ones
+        doesn't grow with the number of paths through them.
+        """
+        branching: set[bytes] = set()
+        if isinstance(self.value, ExprImpl):
+            for node in _postorder(self.value):
+                if (
+                    _is_if(node)
+                    or _is_logical(node)
+                    or builtins.any(
+                        isinstance(child, ExprImpl) and _digest(child) in branching
+                        for child in _children(node)
+                    )
+                ):
+                    branching.add(_digest(node))
+        return branching & self.shared.keys()
+
+    def shared_nodes(self) -> Iterator[ExprImpl]:
+        if isinstance(self.value, ExprImpl):
+            yield from (
+                node for node in _postorder(self.value) if _digest(node) in self.shared
+            )
+
+    def nesting(self) -> int:
+        """Returns the length of the longest chain of calls between the
+        functions of shared subexpressions."""
+        depths: dict[bytes, int] = {}
+        for root in self.getters:
+            stack = [root]
+            while stack:
+                key = stack[-1]
+                calls = self.calls.get(key, set())
+                pending = [call for call in calls if call not in depths]
+                if pending:
+                    stack.extend(pending)
+                else:
+                    stack.pop()
+                    depths[key] = (
+                        builtins.max((depths[call] for call in calls), default=0) + 1
+                    )
+        return builtins.max(depths.values(), default=0)
+
+    def visit(self, value: Expr, stack: _Steps, values: _Values) -> None:
+        if not isinstance(value, ExprImpl):
+            values.append((self.literal(value), 0))
+        elif isinstance(value, Constant):
+            values.append((self.literal(_CONSTANT_VALUES[value.name]), 0))
+        elif len(self.scopes) > _MAX_BLOCKS:
+            node = self.bind(value)
+            values.append((f"{self.bind(_interpret)}(row, now, page_id, {node})", 1))
+        elif not self.reuse(value, stack, values):
+            self.schedule(value, stack)
+
+    def reuse(self, node: ExprImpl, stack: _Steps, values: _Values) -> bool:
+        """Returns whether a shared subexpression is already computed, and
+        otherwise schedules storing it once it is."""
+        key = _digest(node)
+        name = self.shared.get(key)
+        if name is None:
+            return False
+        if key in self.defined:
+            values.append((name, 0))
+            return True
+        if self.unit is None and key not in self.maybe and key not in self.written:
+            stack.append(("assign", key))
+            return False
+
+        if self.unit is not None:
+            self.calls.setdefault(self.unit, set()).add(key)
+        if key not in self.getters:
+            self.getters[key] = len(self.order)
+            self.order.append(key)
+        self.emit(f"{name} = {self.getter(key)}(row, m)")
+        self.define(key)
+        values.append((name, 0))
+        return True
+
+    def getter(self, key: bytes) -> str:
+        return "g" + self.shared[key][1:]
+
+    def schedule(self, node: ExprImpl, stack: _Steps) -> None:
+        if _is_if(node):
+            chain = _Chain(self.local(), *self.arms(node))
+            chain.start = len(self.lines)
+            self.emit("")
+            stack.append(("test", (chain, 0)))
+        elif _is_logical(node):
+            chain = _Chain(
+                self.local(),
+                [(operand, None) for operand in self.operands(node)],
+                node.operator,
+            )
+            stack.append(("operand", (chain, 0)))
+            stack.append(("eval", chain.arms[0][0]))
+        else:
+            stack.append(("apply", node))
+            stack.extend(("eval", child) for child in reversed(_children(node)))
+
+    def arms(self, node: Function) -> tuple[list[tuple[Expr, Expr]], Expr]:
+        arms = [(node.args[0], node.args[1])]
+        default = node.args[2]
+        while _is_if(default) and _digest(default) not in self.shared:
+            arms.append((default.args[0], default.args[1]))
+            default = default.args[2]
+        return arms, default
+
+    def operands(self, node: BinaryOperation) -> Iterator[Expr]:
+        stack: list[Expr] = [node]
+        while stack:
+            item = stack.pop()
+            if (
+                _is_logical(item)
+                and item.operator == node.operator
+                and (item is node or _digest(item) not in self.shared)
+            ):
+                stack.append(item.right)
+                stack.append(item.left)
+            else:
+                yield item
+
+    def assign(self, key: bytes, stack: _Steps, values: _Values) -> None:
+        name = self.shared[key]
+        self.emit(f"{name} = {values.pop()[0]}")
+        self.stores.append((len(self.lines) - 1, key))
+        if key in self.branching:
+            self.written.add(key)
+        self.define(key)
+        values.append((name, 0))
+
+    def apply(self, node: ExprImpl, stack: _Steps, values: _Values) -> None:
+        count = len(_children(node))
+        args = values[len(values) - count :]
+        del values[len(values) - count :]
+        codes = [code for code, _ in args]
+        depth = builtins.max((depth for _, depth in args), default=0) + 1
+
+        if isinstance(node, Function):
+            code = self.function(node.name, node.args, codes)
+        elif isinstance(node, UnaryOperation):
+            code = self.unary(node, codes[0])
+        elif isinstance(node, BinaryOperation):
+            code = self.binary(node, codes[0], codes[1])
+        else:
+            raise TypeError(f"cannot evaluate {type(node).__name__}")
+        self.push(values, code, depth)
+
+    def function(self, name: str, args: tuple[Expr, ...], codes: list[str]) -> str:
+        if name == "prop":
+            if isinstance(args[0], str):
+                return f"row[{codes[0]}]"
+            return f"row[{self.bind(_string)}({codes[0]})]"
+        if name == "now":
+            return "now"
+        if name == "fromTimestamp":
+            return f"{self.bind(_from_timestamp)}({codes[0]}, zone)"
+        if name == "id":
+            return f"{self.bind(_page_id)}(page_id)"
+        if name not in _EVALUATIONS:
+            raise ValueError(f"cannot evaluate {name}()")
+        return f"{self.bind(_EVALUATIONS[name])}({', '.join(codes)})"
+
+    def unary(self, node: UnaryOperation, code: str) -> str:
+        if node.operator == "-":
+            return f"(-{self.number(node.operand, code)})"
+        if node.operator == "not ":
+            return f"(not {self.boolean(node.operand, code)})"
+        return f"{self.bind(_UNARY_FOLDS[node.operator])}({code})"
+
+    def binary(self, node: BinaryOperation, left: str, right: str) -> str:
+        operator = node.operator
+        if operator in (" - ", " * ") or (
+            operator == " / " and _is_number_literal(node.right) and node.right != 0
+        ):
+            left = self.number(node.left, left)
+            return f"({left}{operator}{self.number(node.right, right)})"
+
+        kind = self.types.type_of(node.left)
+        if kind == self.types.type_of(node.right) and kind in _INLINE_TYPES.get(
+            operator, ()
+        ):
+            return f"({left}{operator}{right})"
+        return f"{self.bind(_OPERATOR_EVALUATIONS[operator])}({left}, {right})"
+
+    def test(self, item: tuple[_Chain, int], stack: _Steps, values: _Values) -> None:
+        # Arms are written as runs of `if` and `elif` clauses. Each test after
+        # the first is evaluated in a block run only while no arm has been
+        # taken, unless it turns out to need none and continues the run.
+        chain, index = item
+        if index > 0:
+            if chain.guarded:
+                self.close()
+            self.emit(f"if {chain.result} is _UNSET:")
+            chain.guard = len(self.lines) - 1
+            self.open()
+        stack.append(("header", item))
+        stack.append(("eval", chain.arms[index][0]))
+
+    def header(self, item: tuple[_Chain, int], stack: _Steps, values: _Values) -> None:
+        chain, index = item
+        code, depth = values.pop()
+        code = self.boolean(chain.arms[index][0], code)
+        chain.depth = builtins.max(chain.depth, depth)
+        chain.tests.append(code)
+        if index == 0:
+            chain.plain = len(self.lines) == chain.start + 1
+            self.emit(f"if {code}:")
+        # Long runs are split, as `elif` clauses nest in the parser.
+        elif len(self.lines) == chain.guard + 1 and 0 < chain.series < _MAX_DEPTH:
+            del self.lines[chain.guard]
+            self.close()
+            if chain.guarded:
+                self.open()
+            self.emit(f"elif {code}:")
+        else:
+            chain.plain = False
+            chain.unset = chain.guarded = True
+            chain.series = 0
+            self.emit(f"if {code}:")
+
+        chain.block = len(self.lines)
+        chain.mark = len(self.added)
+        self.open()
+        stack.append(("arm", item))
+        stack.append(("eval", chain.arms[index][1]))
+
+    def arm(self, item: tuple[_Chain, int], stack: _Steps, values: _Values) -> None:
+        chain, index = item
+        self.settle(chain, values)
+        chain.series += 1
+        if index + 1 < len(chain.arms):
+            stack.append(("test", (chain, index + 1)))
+        else:
+            stack.append(("default", chain))
+
+    def default(self, chain: _Chain, stack: _Steps, values: _Values) -> None:
+        self.emit("else:")
+        chain.block = len(self.lines)
+        chain.mark = len(self.added)
+        self.open()
+        stack.append(("finish", chain))
+        stack.append(("eval", chain.default))
+
+    def finish(self, chain: _Chain, stack: _Steps, values: _Values) -> None:
+        self.settle(chain, values)
+        if chain.guarded:
+            self.close()
+        if chain.unset:
+            self.lines[chain.start] += f"{chain.result} = _UNSET"
+        for key in chain.hidden:
+            self.define(key, definitely=False)
+        for key in chain.common or ():
+            self.define(key)
+
+        # Chains whose blocks hold nothing but their results are written as
+        # a conditional expression instead.
+        depth = chain.depth + len(chain.tests)
+        if chain.plain and depth <= _MAX_DEPTH:
+            del self.lines[chain.start :]
+            code = chain.values[-1]
+            for test, value in zip(reversed(chain.tests), reversed(chain.values[:-1])):
+                code = f"({value} if {test} else {code})"
+            values.append((code, depth))
+        else:
+            values.append((chain.result, 0))
+
+    def settle(self, chain: _Chain, values: _Values) -> None:
+        """Stores the value of an arm of a chain, and closes its block."""
+        code, depth = values.pop()
+        chain.values.append(code)
+        chain.depth = builtins.max(chain.depth, depth)
+        if len(self.lines) > chain.block:
+            chain.plain = False
+        self.emit(f"{chain.result} = {code}")
+
+        # Subexpressions computed in one arm are not computed on the way to
+        # the others, but are after the chain if they are in every arm.
+        keys = set(self.scopes[-1])
+        chain.common = keys if chain.common is None else chain.common & keys
+        hidden = self.added[chain.mark :]
+        del self.added[chain.mark :]
+        self.maybe.difference_update(hidden)
+        chain.hidden.extend(hidden)
+        self.close()
+
+    def operand(self, item: tuple[_Chain, int], stack: _Steps, values: _Values) -> None:
+        # Operands after the first are evaluated in a block of their own
+        # unless they turn out to need none, in which case they're joined
+        # to the last assignment of the result.
+        chain, index = item
+        code, depth = values.pop()
+        code = self.boolean(chain.arms[index][0], code)
+        chain.depth = builtins.max(chain.depth, depth)
+        if index == 0:
+            self.emit("")
+            chain.start = chain.block = len(self.lines) - 1
+            chain.tests.append(code)
+        elif len(self.lines) == chain.guard + 1:
+            del self.lines[chain.guard]
+            self.close()
+            chain.tests.append(code)
+        else:
+            chain.plain = False
+            self.join(chain)
+            self.emit("")
+            chain.block = len(self.lines) - 1
+            chain.tests = [code]
+            self.close()
+
+        if index + 1 < len(chain.arms):
+            negation = "not " if chain.default == " or " else ""
+            self.emit(f"if {negation}{chain.result}:")
+            chain.guard = len(self.lines) - 1
+            self.open()
+            stack.append(("operand", (chain, index + 1)))
+            stack.append(("eval", chain.arms[index + 1][0]))
+            return
+
+        self.join(chain)
+        if chain.plain and chain.start == len(self.lines) - 1:
+            del self.lines[chain.start]
+            self.push(values, self.joined(chain), chain.depth + 1)
+        else:
+            values.append((chain.result, 0))
+
+    def join(self, chain: _Chain) -> None:
+        """Writes the operands joined since the last statement into the
+        assignment of the result."""
+        self.lines[chain.block] += f"{chain.result} = {self.joined(chain)}"
+
+    def joined(self, chain: _Chain) -> str:
+        if len(chain.tests) == 1:
+            return chain.tests[0]
+        return "(" + cast(str, chain.default).join(chain.tests) + ")"
+
+    def number(self, value: Expr, code: str) -> str:
+        if self.types.type_of(value) == "number":
+            return code
+        return f"{self.bind(_number)}({code})"
+
+    def boolean(self, value: Expr, code: str) -> str:
+        if self.types.type_of(value) == "boolean":
+            return code
+        return f"{self.bind(_boolean)}({code})"
+
+    def literal(self, value: Expr) -> str:
+        if isinstance(value, float) and not math.isfinite(value):
+            return self.bind(value)
+        return repr(value)
+
+    def bind(self, value: Any) -> str:
+        """Returns the name of a global of the compiled code bound to `value`."""
+        name = self.bound.get(builtins.id(value))
+        if name is None:
+            name = getattr(value, "__name__", "")
+            if not (name.startswith("_") and name.isidentifier()) or (
+                name in self.namespace
+            ):
+                name = f"_g{len(self.bound)}"
+            self.bound[builtins.id(value)] = name
+            self.namespace[name] = value
+        return name
+
+    def local(self) -> str:
+        self.locals += 1
+        return f"t{self.locals}"
+
+    def push(self, values: _Values, code: str, depth: int) -> None:
+        if depth > _MAX_DEPTH:
+            name = self.local()
+            self.emit(f"{name} = {code}")
+            code, depth = name, 0
+        values.append((code, depth))
+
+    def emit(self, line: str) -> None:
+        self.lines.append("    " * (len(self.scopes) + 1) + line)
+
+    def define(self, key: bytes, definitely: bool = True) -> None:
+        if definitely and key not in self.defined:
+            self.defined.add(key)
+            self.scopes[-1].append(key)
+        if key not in self.maybe:
+            self.maybe.add(key)
+            self.added.append(key)
+
+    def open(self) -> None:
+        self.scopes.append([])
+
+    def close(self) -> None:
+        self.defined.difference_update(self.scopes.pop())
+
+
+class _Chain:
+    """The state of a chain of `if` calls, or of `and`/`or` operands, being
+    compiled. For the latter, the `default` is the operator."""
+
+    __slots__ = (
+        "arms",
+        "block",
+        "common",
+        "default",
+        "depth",
+        "guard",
+        "guarded",
+        "hidden",
+        "mark",
+        "plain",
+        "result",
+        "series",
+        "start",
+        "tests",
+        "unset",
+        "values",
+    )
+
+    def __init__(self, result: str, arms: list[tuple[Expr, Any]], default: Any) -> None:
+        self.result = result
+        self.arms = arms
+        self.default = default
+        self.tests: list[str] = []
+        self.values: list[str] = []
+        self.common: set[bytes] | None = None
+        self.hidden: list[bytes] = []
+        self.start = self.block = self.guard = self.depth = self.mark = 0
+        self.plain = True
+        self.series = 0
+        self.guarded = self.unset = False
+
+
+class _CertainTypes(_TypeInference):
+    """Infers only the types an expression is certain to have if it evaluates
+    without error, so that operators on them can be inlined."""
+
+    def infer(self, node: ExprImpl) -> str | None:
+        if _is_if(node):
+            kind = self.known(node.args[1])
+            return kind if kind == self.known(node.args[2]) else None
+        return super().infer(node)
+
+
+_INLINE_TYPES = {
+    " + ": ("number", "string"),
+    " == ": ("boolean", "number", "string"),
+    " != ": ("boolean", "number", "string"),
+    " > ": ("number", "string"),
+    " >= ": ("number", "string"),
+    " < ": ("number", "string"),
+    " <= ": ("number", "string"),
+}
+
+
+def _shared_names(value: Expr) -> dict[bytes, str]:
+    """Names the subexpressions occurring more than once in an expression by
+    their digest, counting each distinct parent once."""
+    children: dict[bytes, list[bytes]] = {}
+    if isinstance(value, ExprImpl):
+        for node in _postorder(value):
+            key = _digest(node)
+            if key not in children:
+                children[key] = [
+                    _digest(child)
+                    for child in _children(node)
+                    if isinstance(child, ExprImpl) and not isinstance(child, Constant)
+                ]
+
+    uses: dict[bytes, int] = {}
+    for keys in children.values():
+        for key in keys:
+            uses[key] = uses.get(key, 0) + 1
+    shared = (key for key, count in uses.items() if count > 1)
+    return {key: f"v{index}" for index, key in enumerate(shared)}
+
+
+def _interpret(
+    row: Mapping[str, Any], now: datetime.datetime, page_id: str | None, value: Expr
+) -> Any:
+    return _Evaluator(row, now=now, page_id=page_id).run(value)
+
+
+def _interpreter(value: Expr) -> Callable[[datetime.datetime, str | None], _Formula]:
+    def factory(now: datetime.datetime, page_id: str | None) -> _Formula:
+        def formula(row: Mapping[str, Any]) -> Any:
+            return _interpret(row, now, page_id, value)
+
+        return formula
+
+    return factory
+
+
+#
+# Vectorization
+#
+_MILLISECOND = datetime.timedelta(milliseconds=1)
+_DAY = 86_400_000
+
+# NumPy's counterparts of the functions of a number.
+_UFUNCS = {
+    "abs": "absolute",
+    "cbrt": "cbrt",
+    "ceil": "ceil",
+    "exp": "exp",
+    "floor": "floor",
+    "log10": "log10",
+    "log2": "log2",
+    "sign": "sign",
+    "sqrt": "sqrt",
+}
+_UFUNC_OPERATORS = {
+    " - ": "subtract",
+    " * ": "multiply",
+    " / ": "true_divide",
+    " % ": "fmod",
+    " ^ ": "power",
+    " == ": "equal",
+    " != ": "not_equal",
+    " > ": "greater",
+    " >= ": "greater_equal",
+    " < ": "less",
+    " <= ": "less_equal",
+    " and ": "logical_and",
+    " or ": "logical_or",
+}
+_DTYPE_KINDS = {"b": "boolean", "O": "string", "U": "string"}
+
+
+def _numpy() -> Any:
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("evaluating columns requires numpy") from None
+    return numpy
+
+
+class _Dates:
+    """Dates of all rows, as milliseconds since the epoch and the UTC offset of
+    their time zone in milliseconds, each either an array or a number."""
+
+    __slots__ = ("offset", "time")
+
+    def __init__(self, time: Any, offset: Any) -> None:
+        self.time = time
+        self.offset = offset
+
+    def local(self) -> Any:
+        return self.time + self.offset
+
+
+class _Vectorizer:
+    """Evaluates an expression over columns of prop values with NumPy.
+
+    Each distinct node is computed once for all rows, children first, into an
+    array, or a plain value where it is the same for every row. Numbers are
+    float arrays, strings object arrays, and dates `_Dates`.
+    """
+
+    def __init__(
+        self,
+        columns: Mapping[str, Any],
+        *,
+        now: datetime.datetime,
+        page_id: str | None = None,
+    ) -> None:
+        self.np = _numpy()
+        self.columns = columns
+        self.now = now
+        self.page_id = page_id
+        self.props: dict[str, Any] = {}
+        lengths = {len(column) for column in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("columns must have the same length")
+        self.length = lengths.pop() if lengths else 0
+        self.functions: dict[str, Callable[[Function, list[Any]], Any]] = {
+            "prop": lambda node, args: self.prop(_string(args[0])),
+            "now": lambda node, args: _Dates(*_instant(self.now)),
+            "id": lambda node, args: _page_id(self.page_id),
+            "if": self.where,
+            "empty": self.empty,
+            "toNumber": self.to_number,
+            "round": lambda node, args: self.np.floor(self.number(args[0]) + 0.5),
+            "max": self.extreme,
+            "min": self.extreme,
+            "fromTimestamp": self.from_timestamp,
+            "timestamp": lambda node, args: self.np.floor(self.date(args[0]).time),
+            "start": lambda node, args: self.date(args[0]),
+            "end": self.end,
+            "dateAdd": self.date_add,
+            "dateSubtract": self.date_add,
+            "dateBetween": self.date_between,
+            **dict.fromkeys(
+                ("minute", "hour", "day", "date", "month", "year"), self.part
+            ),
+        }
+
+    def run(self, value: Expr) -> Any:
+        if not isinstance(value, ExprImpl):
+            return self.array(value)
+        results: dict[int, Any] = {}
+        with self.np.errstate(all="ignore"):
+            for node in _postorder(value):
+                args = [
+                    (
+                        results[builtins.id(child)]
+                        if isinstance(child, ExprImpl)
+                        else child
+                    )
+                    for child in _children(node)
+                ]
+                results[builtins.id(node)] = self.apply(node, args)
+        return self.array(results[builtins.id(value)])
+
+    def apply(self, node: ExprImpl, args: list[Any]) -> Any:
+        if isinstance(node, Constant):
+            return _CONSTANT_VALUES[node.name]
+        if isinstance(node, Function):
+            return self.call(node, args)
+        if isinstance(node, UnaryOperation):
+            return self.unary(node.operator, args[0])
+        if isinstance(node, BinaryOperation):
+            return self.binary(node.operator, args[0], args[1])
+        raise TypeError(f"cannot evaluate {type(node).__name__}")
+
+    def call(self, node: Function, args: list[Any]) -> Any:
+        function = self.functions.get(node.name)
+        if function is not None:
+            return function(node, args)
+        if node.name in _UFUNCS:
+            return getattr(self.np, _UFUNCS[node.name])(self.number(args[0]))
+        if node.name not in _EVALUATIONS:
+            raise ValueError(f"cannot evaluate {node.name}()")
+        return self.rows(
+            _EVALUATIONS[node.name],
+            *(self.objects(child, arg) for child, arg in zip(node.args, args)),
+        )
+
+    def unary(self, operator: str, value: Any) -> Any:
+        if operator == "-":
+            return self.np.negative(self.number(value))
+        if operator == "not ":
+            return self.np.logical_not(self.expect(value, "boolean"))
+        if self.kind(value) == "string":
+            return self.rows(_to_number, value)
+        if self.kind(value) == "boolean":
+            return self.np.multiply(value, 1.0)
+        return self.number(value)
+
+    def binary(self, operator: str, left: Any, right: Any) -> Any:
+        if operator in (" and ", " or "):
+            left = self.expect(left, "boolean")
+            right = self.expect(right, "boolean")
+        elif operator in (" - ", " * ", " / ", " % ", " ^ "):
+            left, right = self.number(left), self.number(right)
+        else:
+            left, right = self.comparable(operator, left, right)
+            if operator == " + ":
+                return self.np.add(left, right)
+        return getattr(self.np, _UFUNC_OPERATORS[operator])(left, right)
+
+    def comparable(self, operator: str, left: Any, right: Any) -> tuple[Any, Any]:
+        # Like `_comparable`, the left operand decides the type, except that
+        # booleans are only compared for equality, and dates by their time.
+        kind = self.kind(left)
+        if "boolean" in (kind, self.kind(right)):
+            kind = "boolean" if operator in (" == ", " != ") else "number"
+        elif kind == "date" and operator == " + ":
+            raise TypeError("cannot add dates")
+        left, right = self.expect(left, kind), self.expect(right, kind)
+        if kind == "date":
+            return left.time, right.time
+        return left, right
+
+    def where(self, node: Function, args: list[Any]) -> Any:
+        test, value, other = args
+        test = self.expect(test, "boolean")
+        if not isinstance(test, self.np.ndarray):
+            return value if test else other
+
+        kind = self.kind(value)
+        if kind != self.kind(other):
+            raise TypeError(f"if() of a {kind} or a {self.kind(other)} in columns")
+        if kind == "date":
+            return _Dates(
+                self.np.where(test, value.time, other.time),
+                self.np.where(test, value.offset, other.offset),
+            )
+        result = self.np.where(test, value, other)
+        return result.astype(object) if kind == "string" else result
+
+    def empty(self, node: Function, args: list[Any]) -> Any:
+        value = args[0]
+        kind = self.kind(value)
+        if kind == "boolean":
+            return self.np.logical_not(value)
+        if kind == "date":
+            return self.np.isnan(value.time)
+        if kind == "string":
+            return self.np.equal(value, "")
+        # Missing numbers are NaN.
+        return self.np.equal(value, 0) | self.np.isnan(value)
+
+    def to_number(self, node: Function, args: list[Any]) -> Any:
+        value = args[0]
+        kind = self.kind(value)
+        if kind == "date":
+            return self.np.floor(value.time)
+        if kind == "string":
+            return self.rows(_evaluate_to_number, value)
+        return self.np.multiply(value, 1.0)
+
+    def extreme(self, node: Function, args: list[Any]) -> Any:
+        function = self.np.maximum if node.name == "max" else self.np.minimum
+        result = self.number(args[0])
+        for arg in args[1:]:
+            result = function(result, self.number(arg))
+        return result
+
+    def prop(self, name: str) -> Any:
+        values = self.props.get(name)
+        if values is None:
+            values = self.props[name] = self.column(self.columns[name])
+        return values
+
+    def end(self, node: Function, args: list[Any]) -> Any:
+        # Only props have ranges, whose ends are read from the column again.
+        date = self.date(args[0])
+        prop = node.args[0]
+        if _is_call(prop, "prop") and isinstance(prop.args[0], str):
+            column = _vector(self.np, self.columns[prop.args[0]])
+            if column.dtype.kind == "O":
+                return self.column([_EVALUATIONS["end"](item) for item in column])
+        return date
+
+    def from_timestamp(self, node: Function, args: list[Any]) -> Any:
+        return _Dates(self.number(args[0]), _instant(self.now)[1])
+
+    def date_add(self, node: Function, args: list[Any]) -> Any:
+        # Like `_date_add`, months and days are added in local time.
+        value, amount, unit = args
+        if not isinstance(unit, str):
+            return self.rows(_EVALUATIONS[node.name], *map(self.plain, args))
+        np, date, amount = self.np, self.date(value), self.number(amount)
+        if node.name == "dateSubtract":
+            amount = np.negative(amount)
+
+        if unit in _MONTH_UNITS:
+            months = _round_half_away_vector(np, amount * _MONTH_UNITS[unit])
+            time = _add_months_vector(np, date.local(), months) - date.offset
+        elif unit in _DAY_UNITS:
+            days = _round_half_away_vector(np, amount * _DAY_UNITS[unit])
+            time = date.time + days * _DAY
+        elif unit in _TIME_UNITS:
+            time = date.time + amount * _TIME_UNITS[unit]
+        else:
+            raise ValueError(f"unknown date unit: {unit!r}")
+        return _Dates(time, date.offset)
+
+    def date_between(self, node: Function, args: list[Any]) -> Any:
+        value, other, unit = args
+        if not isinstance(unit, str):
+            return self.rows(_date_between, *map(self.plain, args))
+        date, other = self.date(value), self.date(other)
+        if unit in _MONTH_UNITS:
+            local = other.time + date.offset
+            months = _month_difference_vector(self.np, date.local(), local)
+            difference = months / _MONTH_UNITS[unit]
+        elif unit in _DURATIONS:
+            difference = (date.time - other.time) / (_DURATIONS[unit] / _MILLISECOND)
+        else:
+            raise ValueError(f"unknown date unit: {unit!r}")
+        return self.np.trunc(difference)
+
+    def part(self, node: Function, args: list[Any]) -> Any:
+        np, local = self.np, self.date(args[0]).local()
+        days = np.floor(local / _DAY)
+        if node.name == "day":
+            return (days + 4) % 7
+        if node.name == "hour":
+            return np.floor((local - days * _DAY) / 3_600_000)
+        if node.name == "minute":
+            return np.floor((local - days * _DAY) / 60_000) % 60
+        year, month, day = _civil_date(np, days)
+        return {"year": year, "month": month - 1, "date": day}[node.name]
+
+    def rows(self, function: Callable[..., Any], *values: Any) -> Any:
+        """Applies a function of plain values row by row."""
+        if builtins.any(isinstance(value, self.np.ndarray) for value in values):
+            ufunc = self.np.frompyfunc(function, len(values), 1)
+            return self.column(ufunc(*values))
+        result = function(*values)
+        if isinstance(result, datetime.date):
+            return _Dates(*_instant(result))
+        return result
+
+    def objects(self, node: Expr, value: Any) -> Any:
+        """Returns the values of the rows as plain values, reading columns of
+        props again, so that ranges are passed as ranges."""
+        if _is_call(node, "prop") and isinstance(node.args[0], str):
+            column = _vector(self.np, self.columns[node.args[0]])
+            if column.dtype.kind == "O":
+                return column
+        return self.plain(value)
+
+    def plain(self, value: Any) -> Any:
+        np = self.np
+        if isinstance(value, _Dates):
+            return np.frompyfunc(_datetime, 2, 1)(value.time, value.offset)
+        if isinstance(value, np.ndarray):
+            return value.astype(object)
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    def column(self, values: Any) -> Any:
+        """Returns the values of a column as an array of the kind used for
+        its type."""
+        np = self.np
+        array = _vector(np, values)
+        kind = array.dtype.kind
+        if kind == "M":
+            missing = np.isnat(array)
+            time = array.astype("datetime64[us]").astype("int64") / 1000
+            return _Dates(np.where(missing, math.nan, time), 0.0)
+        if kind in "US":
+            return array.astype(object)
+        if kind in "iuf":
+            return array.astype(float)
+        if kind == "b":
+            return array
+        if kind != "O":
+            raise TypeError(f"cannot evaluate a column of {array.dtype}")
+
+        types = set(map(type, array))
+        if types <= {bool}:
+            return array.astype(bool)
+        if types <= {str}:
+            return array
+        return self.missing_column(array, types - {type(None)})
+
+    def missing_column(self, array: Any, types: set[type]) -> Any:
+        """Returns a column of numbers or dates in which missing values are
+        None, as NaN."""
+        np = self.np
+        present = np.not_equal(array, None)
+        if builtins.all(
+            issubclass(cls, (int, float)) and not issubclass(cls, bool) for cls in types
+        ):
+            return np.where(present, array, math.nan).astype(float)
+        if builtins.all(issubclass(cls, (datetime.date, tuple)) for cls in types):
+            time, offset = np.full(len(array), math.nan), np.zeros(len(array))
+            if present.any():
+                instants = np.frompyfunc(_instant, 1, 2)(array[present])
+                time[present], offset[present] = instants
+            return _Dates(time, offset)
+        raise TypeError("cannot evaluate a column of values of different types")
+
+    def array(self, value: Any) -> Any:
+        np = self.np
+        if isinstance(value, _Dates):
+            time = np.broadcast_to(np.floor(value.time), (self.length,))
+            result = np.full(self.length, np.datetime64("NaT"), "datetime64[ms]")
+            valid = ~np.isnan(time)
+            result[valid] = time[valid].astype("int64")
+            return result
+        if isinstance(value, np.ndarray) and value.ndim:
+            return value
+        dtypes = {"boolean": bool, "number": float, "string": object}
+        return np.full(self.length, value, dtype=dtypes[self.kind(value)])
+
+    def kind(self, value: Any) -> str:
+        if isinstance(value, _Dates):
+            return "date"
+        if isinstance(value, self.np.ndarray):
+            return _DTYPE_KINDS.get(value.dtype.kind, "number")
+        if isinstance(value, (bool, self.np.bool_)):
+            return "boolean"
+        return "string" if isinstance(value, str) else "number"
+
+    def expect(self, value: Any, kind: str) -> Any:
+        actual = self.kind(value)
+        if actual != kind:
+            raise TypeError(f"expected a {kind}, got a {actual}")
+        return value
+
+    def number(self, value: Any) -> Any:
+        value = self.expect(value, "number")
+        return value if isinstance(value, self.np.ndarray) else float(value)
+
+    def date(self, value: Any) -> _Dates:
+        return cast(_Dates, self.expect(value, "date"))
+
+
+def _vector(np: Any, values: Any) -> Any:
+    """Returns a one-dimensional array of values, which may be sequences."""
+    try:
+        array = np.asarray(values)
+    except ValueError:
+        array = None
+    if array is None or array.ndim != 1:
+        array = np.empty(len(values), dtype=object)
+        for index, item in enumerate(values):
+            array[index] = item
+    return array
+
+
+def _instant(value: Any) -> tuple[float, float]:
+    """Returns a date as milliseconds since the epoch and its UTC offset."""
+    date = _date(value)
+    offset = cast(datetime.timedelta, date.utcoffset())
+    return (date - _EPOCH) / _MILLISECOND, offset / _MILLISECOND
+
+
+def _datetime(time: float, offset: float) -> datetime.datetime | None:
+    if math.isnan(time):
+        return None
+    zone = datetime.timezone(offset * _MILLISECOND) if offset else datetime.timezone.utc
+    return (_EPOCH + time * _MILLISECOND).astimezone(zone)
+
+
+def _round_half_away_vector(np: Any, value: Any) -> Any:
+    return np.copysign(np.floor(np.abs(value) + 0.5), value)
+
+
+def _civil_date(np: Any, days: Any) -> tuple[Any, Any, Any]:
+    """Returns the year, month and day of days since the epoch, with the
+    algorithm of https://howardhinnant.github.io/date_algorithms.html."""
+    days = days + 719_468
+    era = np.floor(days / 146_097)
+    day_of_era = days - era * 146_097
+    year_of_era = np.floor(
+        (
+            day_of_era
+            - np.floor(day_of_era / 1460)
+            + np.floor(day_of_era / 36524)
+            - np.floor(day_of_era / 146_096)
+        )
+        / 365
+    )
+    day_of_year = day_of_era - (
+        365 * year_of_era + np.floor(year_of_era / 4) - np.floor(year_of_era / 100)
+    )
+    shifted = np.floor((5 * day_of_year + 2) / 153)
+    day = day_of_year - np.floor((153 * shifted + 2) / 5) + 1
+    month = np.where(shifted < 10, shifted + 3, shifted - 9)
+    return year_of_era + era * 400 + (month <= 2), month, day
+
+
+def _month_start(np: Any, months: Any) -> Any:
+    """Returns the days since the epoch of the first of a month, counted in
+    months since the start of year 0."""
+    year = np.floor(months / 12)
+    shifted = months - year * 12 - 2
+    year = np.where(shifted < 0, year - 1, year)
+    shifted = np.where(shifted < 0, shifted + 12, shifted)
+    era = np.floor(year / 400)
+    year_of_era = year - era * 400
+    day_of_year = np.floor((153 * shifted + 2) / 5)
+    day_of_era = (
+        year_of_era * 365
+        + np.floor(year_of_era / 4)
+        - np.floor(year_of_era / 100)
+        + day_of_year
+    )
+    return era * 146_097 + day_of_era - 719_468
+
+
+def _add_months_vector(np: Any, local: Any, months: Any) -> Any:
+    """Adds months to local times like `_add_months`."""
+    days = np.floor(local / _DAY)
+    year, month, day = _civil_date(np, days)
+    total = year * 12 + month - 1 + months
+    first = _month_start(np, total)
+    length = _month_start(np, total + 1) - first
+    return (first + np.minimum(day, length) - 1) * _DAY + (local - days * _DAY)
+
+
+def _month_difference_vector(np: Any, date: Any, other: Any) -> Any:
+    """Returns the number of months between local times like
+    `_month_difference`."""
+    swap = _civil_date(np, np.floor(date / _DAY))[2] < (
+        _civil_date(np, np.floor(other / _DAY))[2]
+    )
+    date, other = np.where(swap, other, date), np.where(swap, date, other)
+    year, month, _ = _civil_date(np, np.floor(date / _DAY))
+    other_year, other_month, _ = _civil_date(np, np.floor(other / _DAY))
+    months = (other_year - year) * 12 + other_month - month
+    anchor = _add_months_vector(np, date, months)
+    adjacent = _add_months_vector(
+        np, date, np.where(other < anchor, months - 1, months + 1)
+    )
+    difference = -(months + (other - anchor) / np.abs(adjacent - anchor))
+    return np.where(swap, -difference, difference)
+
+
+#
+# CSV
+#
+_File = Union[str, "os.PathLike[str]", IO[str]]
+_R = TypeVar("_R")
+
+# The types functions expect of their arguments, the last one repeating.
+_ARGUMENT_TYPES: dict[str, tuple[str | None, ...]] = {
+    **dict.fromkeys(
+        ["abs", "cbrt", "ceil", "exp", "floor", "log10", "log2", "max", "min"],
+        ("number",),
+    ),
+    **dict.fromkeys(["round", "sign", "sqrt", "fromTimestamp"], ("number",)),
+    **dict.fromkeys(
+        ["concat", "join", "length", "lower", "upper", "contains", "listLength"],
+        ("string",),
+    ),
+    **dict.fromkeys(["replace", "replaceAll", "test"], (None, "string")),
+    "slice": ("string", "number"),
+    "progressbar": ("number", "string", "string", "number"),
+    **dict.fromkeys(
+        ["start", "end", "timestamp", "minute", "hour", "day", "date", "month"],
+        ("date",),
+    ),
+    "year": ("date",),
+    "dateAdd": ("date", "number", "string"),
+    "dateSubtract": ("date", "number", "string"),
+    "dateBetween": ("date", "date", "string"),
+    "formatDate": ("date", "string"),
+}
+
+
+class _PropTypes(_TypeInference):
+    """Infers types taking props to have the types found for them so far."""
+
+    def __init__(self, props: Mapping[str, str]) -> None:
+        super().__init__()
+        self.props = props
+
+    def infer(self, node: ExprImpl) -> str | None:
+        if _is_call(node, "prop") and isinstance(node.args[0], str):
+            return self.props.get(node.args[0])
+        return super().infer(node)
+
+
+def _prop_types(values: Iterable[Expr]) -> dict[str, str]:
+    """Returns the types of the props of expressions, as they are used, or
+    "string" where that doesn't tell."""
+    nodes = [
+        node
+        for value in values
+        if isinstance(value, ExprImpl)
+        for node in _postorder(value)
+    ]
+    names = {
+        node.args[0]: "string"
+        for node in nodes
+        if _is_call(node, "prop") and isinstance(node.args[0], str)
+    }
+    # The type of a prop compared with another can depend on the other's, so
+    # types are inferred again until none are found.
+    props: dict[str, str] = {}
+    while True:
+        types = _PropTypes(props)
+        found: dict[str, str] = {}
+        for node in nodes:
+            for index, child in enumerate(_children(node)):
+                if _is_call(child, "prop") and child.args[0] in names.keys() - props:
+                    kind = _expected_type(types, node, index)
+                    if kind is not None:
+                        found.setdefault(cast(str, child.args[0]), kind)
+        if not found:
+            return {**names, **props}
+        props.update(found)
+
+
+def _expected_type(types: _TypeInference, node: ExprImpl, index: int) -> str | None:
+    if isinstance(node, UnaryOperation):
+        return {"-": "number", "not ": "boolean"}.get(node.operator)
+    if isinstance(node, BinaryOperation):
+        if node.operator in _ARITHMETIC and node.operator != " + ":
+            return "number"
+        if _is_logical(node):
+            return "boolean"
+        return types.type_of(node.right if index == 0 else node.left)
+    if _is_if(node):
+        return "boolean" if index == 0 else types.type_of(node.args[3 - index])
+    if isinstance(node, Function) and node.name in _ARGUMENT_TYPES:
+        expected = _ARGUMENT_TYPES[node.name]
+        return expected[builtins.min(index, len(expected) - 1)]
+    return None
+
+
+def _open_csv(file: _File, mode: str) -> ContextManager[IO[str]]:
+    if isinstance(file, (str, os.PathLike)):
+        # Notion exports start with a byte order mark.
+        encoding = "utf-8-sig" if mode == "r" else "utf-8"
+        return open(file, mode, newline="", encoding=encoding)
+    return contextlib.nullcontext(file)
+
+
+def _chunks(rows: Iterable[_R], size: int) -> Iterator[list[_R]]:
+    if size < 1:
+        raise ValueError(f"chunk size must be positive: {size}")
+    chunk: list[_R] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _prop_columns(
+    header: list[str], props: Mapping[str, str]
+) -> list[tuple[str, int, Callable[[str, datetime.tzinfo | None], Any]]]:
+    missing = [name for name in props if name not in header]
+    if missing:
+        raise ValueError(f"no columns for props: {', '.join(map(repr, missing))}")
+    return [
+        (name, header.index(name), _CELL_READERS[kind]) for name, kind in props.items()
+    ]
+
+
+def _read_row(
+    row: list[str],
+    columns: list[tuple[str, int, Callable[[str, datetime.tzinfo | None], Any]]],
+    zone: datetime.tzinfo | None,
+    line: int,
+) -> dict[str, Any]:
+    values: dict[str, Any] = {}
+    for name, index, read in columns:
+        try:
+            values[name] = read(row[index], zone)
+        except ValueError as error:
+            raise ValueError(f"row {line}, column {name!r}: {error}") from None
+    return values
+
+
+def _evaluate_cell(function: _Formula, values: Mapping[str, Any]) -> str:
+    try:
+        result = function(values)
+    except OverflowError:
+        # Dates far enough out, which Notion can't show either.
+        return ""
+    if isinstance(result, bool):
+        return "Yes" if result else "No"
+    if isinstance(result, float) and math.isnan(result):
+        # Like missing values, which NaN stands for in numbers.
+        return ""
+    return _evaluate_format(result)
+
+
+def _read_number(text: str, zone: datetime.tzinfo | None) -> float | None:
+    # Numbers are exported as formatted, with currency symbols, separators
+    # of thousands, and percent signs.
+    text = text.strip().replace(",", "")
+    if not text:
+        return None
+    scale = 100 if text.endswith("%") else 1
+    sign = -1 if text.startswith("-") else 1
+    number = float(text.rstrip("%").lstrip("+-").lstrip(_CURRENCY_SYMBOLS))
+    return sign * number / scale
+
+
+_CURRENCY_SYMBOLS = "$€£¥₹₩₽"
+
+
+def _read_boolean(text: str, zone: datetime.tzinfo | None) -> bool:
+    text = text.strip().lower()
+    if text in ("yes", "true"):
+        return True
+    if text in ("no", "false", ""):
+        return False
+    raise ValueError(f"not a checkbox: {text!r}")
+
+
+def _read_date(
+    text: str, zone: datetime.tzinfo | None
+) -> datetime.datetime | tuple[datetime.datetime, datetime.datetime] | None:
+    if not text.strip():
+        return None
+    start, _, end = text.partition(" → ")
+    date = _read_instant(start, zone)
+    if not end:
+        return date
+    try:
+        return date, _read_instant(end, zone)
+    except ValueError:
+        # Ranges within a day are exported with the time of their end only.
+        time = datetime.datetime.strptime(end.strip(), "%I:%M %p").time()
+        return date, datetime.datetime.combine(date.date(), time, date.tzinfo)
+
+
+def _read_instant(text: str, zone: datetime.tzinfo | None) -> datetime.datetime:
+    text = text.strip()
+    for pattern in _DATE_PATTERNS:
+        try:
+            date = datetime.datetime.strptime(text, pattern)
+            break
+        except ValueError:
+            pass
+    else:
+        date = datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+    return date if date.tzinfo else date.replace(tzinfo=zone)
+
+
+_DATE_PATTERNS = ("%B %d, %Y %I:%M %p", "%B %d, %Y")
+
+_CELL_READERS: dict[str, Callable[[str, datetime.tzinfo | None], Any]] = {
+    "boolean": _read_boolean,
+    "date": _read_date,
+    "number": _read_number,
+    "string": lambda text, zone: text,
+}
+
+
+#
+# Parallel evaluation
+#
+# The formula compiled by each worker process of `evaluate_parallel`.
+_worker_formula: _Formula | None = None
+
+
+def _start_worker(
+    graph: ExprGraph, now: datetime.datetime, page_id: str | None
+) -> None:
+    global _worker_formula
+    _worker_formula = compile_expr(graph.to_expr(), now=now, page_id=page_id)
+
+
+def _evaluate_chunk(rows: list[Mapping[str, Any]]) -> list[Any]:
+    assert _worker_formula is not None
+    return [_worker_formula(row) for row in rows]
+
+
+#
+# Command line
+#
+def main(argv: Sequence[str] | None = None) -> int:
+    """Runs the `notion-formulas` command."""
+    parser = argparse.ArgumentParser(
+        prog="notion-formulas", description="Evaluate Notion formulas."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser(
+        "csv",
+        help="evaluate formulas over a CSV file",
+        description="Evaluates formulas over the rows of a CSV file, such as a "
+        "Notion database export, and writes the rows with their results.",
+    )
+    command.add_argument(
+        "formulas",
+        help="an expression, a mapping of column names to expressions, or a "
+        "function returning either, as MODULE:NAME or FILE.py:NAME",
+    )
+    command.add_argument("src", help="the file to read, or - for standard input")
+    command.add_argument("dst", help="the file to write, or - for standard output")
+    command.add_argument(
+        "--type",
+        action="append",
+        default=[],
+        metavar="PROP=TYPE",
+        help="read a prop as a boolean, date, number or string",
+    )
+    command.add_argument(
+        "--chunk-size", type=int, default=10_000, help="rows to process at a time"
+    )
+    command.add_argument(
+        "--now",
+        type=datetime.datetime.fromisoformat,
+        help="the time of now(), in ISO format",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        count = evaluate_csv(
+            _load_formulas(args.formulas),
+            sys.stdin if args.src == "-" else args.src,
+            sys.stdout if args.dst == "-" else args.dst,
+            types=dict(declaration.partition("=")[::2] for declaration in args.type),
+            chunk_size=args.chunk_size,
+            now=args.now,
+        )
+    except (ImportError, OSError, ValueError) as error:
+        parser.error(str(error))
+    print(f"{count} rows", file=sys.stderr)
+    return 0
+
+
+def _load_formulas(reference: str) -> Expr | Mapping[str, Expr]:
+    module, _, name = reference.rpartition(":")
+    if not module or not name:
+        raise ValueError(f"expected MODULE:NAME or FILE.py:NAME, got {reference!r}")
+    if module.endswith(".py"):
+        namespace = runpy.run_path(module)
+    else:
+        if "" not in sys.path and os.getcwd() not in sys.path:
+            sys.path.insert(0, os.getcwd())
+        namespace = vars(importlib.import_module(module))
+    if name not in namespace:
+        raise ValueError(f"{module} has no attribute {name!r}")
+    value = namespace[name]
+    return cast(Union[Expr, Mapping[str, Expr]], value() if callable(value) else value)
+
 
-    if other.precedence > precedence:
-        return encode(other)
+if __name__ == "__main__":
+    # Run as a module, this file is imported again by the formulas it loads,
+    # so the main function of that module is used for their types to match.
+    import notion_formulas
 
-    return f"({encode(other)})"
+    sys.exit(notion_formulas.main())
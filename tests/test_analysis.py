@@ -0,0 +1,75 @@
+from notion_formulas import (
+    Analysis,
+    Date,
+    Number,
+    String,
+    analyze,
+    contains,
+    date_between,
+    encode,
+    if_,
+    lowercase,
+    now,
+    prop,
+    select,
+)
+from notion_formulas import test as notion_test
+
+DUE: Date = prop("Due")
+NUMBER: Number = prop("number")
+STRING: String = prop("string")
+
+
+def test_analyze() -> None:
+    value = if_(notion_test(STRING, "^a"), NUMBER + 1, date_between(now(), DUE, "days"))
+    analysis = analyze(value)
+    assert analysis == Analysis(
+        nodes=8,
+        unique_nodes=8,
+        depth=3,
+        length=len(encode(value)),
+        regex_calls=1,
+        prop_refs=3,
+        date_calls=2,
+        # The test and the costlier of the two branches.
+        cost=1 + (10 + 2) + (4 + 4 + 2),
+    )
+
+
+def test_literal() -> None:
+    assert analyze("abc") == Analysis(0, 0, 0, 5, 0, 0, 0, 0)
+
+
+def test_shared() -> None:
+    days = date_between(now(), DUE, "days")
+    value = days * days
+    analysis = analyze(value)
+    assert analysis.nodes == 7
+    assert analysis.unique_nodes == 4
+    assert analysis.date_calls == 4
+    assert analysis.length == len(encode(value))
+
+
+def test_dialect() -> None:
+    value = contains(lowercase(STRING), "a")
+    assert analyze(value).regex_calls == 27
+    assert analyze(value, dialect="2.0").regex_calls == 1
+    assert analyze(value, dialect="2.0").length == len(encode(value, dialect="2.0"))
+
+
+def test_select_length() -> None:
+    value = select(*((NUMBER == index, str(index)) for index in range(100)), default="")
+    for dialect in ("legacy", "2.0"):
+        analysis = analyze(value, dialect=dialect)
+        assert analysis.length == len(encode(value, dialect=dialect))
+        assert analysis.prop_refs == 100
+
+
+def test_deep() -> None:
+    value = NUMBER
+    for _ in range(100_000):
+        value = value + 1
+
+    analysis = analyze(value)
+    assert analysis.depth == 100_001
+    assert analysis.length == len(encode(value))
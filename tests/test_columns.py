@@ -0,0 +1,207 @@
+import datetime
+import math
+from typing import Any, Dict, List
+
+import pytest
+
+from notion_formulas import (
+    Boolean,
+    Date,
+    Expr,
+    Number,
+    String,
+    abs,
+    and_,
+    date_add,
+    date_between,
+    date_subtract,
+    day,
+    empty,
+    end,
+    evaluate,
+    evaluate_columns,
+    floor,
+    format,
+    format_date,
+    hour,
+    if_,
+    lowercase,
+    max,
+    month,
+    now,
+    or_,
+    prop,
+    replace_all,
+    round,
+    select,
+    sqrt,
+    timestamp,
+    to_number,
+    year,
+)
+from notion_formulas import test as notion_test
+
+np = pytest.importorskip("numpy")
+
+BOOLEAN: Boolean = prop("boolean")
+DATE: Date = prop("date")
+NUMBER: Number = prop("number")
+STRING: String = prop("string")
+
+UTC = datetime.timezone.utc
+NOW = datetime.datetime(2024, 1, 31, 14, 30, tzinfo=UTC)
+COLUMNS: Dict[str, List[Any]] = {
+    "boolean": [True, False, True, False, True],
+    "date": [
+        datetime.datetime(2024, 1, 15, 9, 5),
+        datetime.datetime(2023, 12, 31, 23, 59),
+        datetime.datetime(2024, 2, 29, 12, 0),
+        datetime.datetime(2020, 5, 31, 0, 0),
+        datetime.datetime(2024, 1, 31, 14, 30),
+    ],
+    "number": [3, -1.5, 0, 12, 0.5],
+    "string": ["Hello", "", "a-b", "12", "hello"],
+}
+
+
+def rows() -> List[Dict[str, Any]]:
+    return [dict(zip(COLUMNS, values)) for values in zip(*COLUMNS.values())]
+
+
+def expected(value: Expr, **kwargs: Any) -> List[Any]:
+    results = []
+    for row in rows():
+        result = evaluate(value, row, now=NOW, **kwargs)
+        if isinstance(result, datetime.datetime):
+            result = np.datetime64(result.astimezone(UTC).replace(tzinfo=None), "ms")
+        results.append(result)
+    return results
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        NUMBER * 2 - 1,
+        NUMBER / 4 + NUMBER % 2,
+        abs(NUMBER) ** 0.5,
+        max(NUMBER, 1, -NUMBER),
+        floor(NUMBER / 2) + round(NUMBER),
+        STRING + "!",
+        lowercase(STRING),
+        replace_all(STRING, "l+", "L"),
+        notion_test(STRING, "^[a-z]"),
+        format(NUMBER),
+        to_number(STRING) > 0,
+        if_(BOOLEAN, NUMBER, -NUMBER),
+        select((NUMBER > 5, "big"), (NUMBER > 0, "positive"), default="other"),
+        and_(BOOLEAN, NUMBER >= 0),
+        STRING == "hello",
+        date_add(DATE, NUMBER, "days"),
+        date_add(DATE, NUMBER, "months"),
+        date_subtract(DATE, 1, "years"),
+        date_add(DATE, NUMBER, "hours"),
+        date_between(now(), DATE, "days"),
+        date_between(DATE, now(), "months"),
+        date_between(now(), DATE, "quarters"),
+        date_between(DATE, now(), "minutes"),
+        hour(DATE) + day(DATE) + month(DATE) + year(DATE),
+        timestamp(DATE),
+        format_date(DATE, "YYYY-MM-DD HH:mm"),
+        if_(DATE > now(), DATE, now()),
+    ],
+)
+def test_evaluate_columns(value: Expr) -> None:
+    result = evaluate_columns(value, COLUMNS, now=NOW)
+    assert len(result) == 5
+    assert list(result) == expected(value)
+
+
+def test_evaluate_columns_numbers() -> None:
+    # Like `evaluate`, numbers follow JavaScript semantics.
+    result = evaluate_columns(1 / NUMBER + sqrt(NUMBER), COLUMNS, now=NOW)
+    assert math.isnan(result[1])
+    assert result[2] == math.inf
+
+
+def test_evaluate_columns_arrays() -> None:
+    columns = {
+        "number": np.arange(4, dtype=float),
+        "date": np.array(["2024-01-01", "2024-03-31", "NaT", "2023-12-01"], "M8[ms]"),
+    }
+    result = evaluate_columns(date_add(DATE, NUMBER, "months"), columns, now=NOW)
+    assert result.dtype == np.dtype("M8[ms]")
+    assert list(result.astype(str)) == [
+        "2024-01-01T00:00:00.000",
+        "2024-04-30T00:00:00.000",
+        "NaT",
+        "2024-03-01T00:00:00.000",
+    ]
+    assert list(evaluate_columns(NUMBER + 1 > 2, columns)) == [False] * 2 + [True] * 2
+
+
+def test_evaluate_columns_constant() -> None:
+    assert list(evaluate_columns(lowercase("A"), COLUMNS)) == ["a"] * 5
+    assert list(evaluate_columns(year(now()), COLUMNS, now=NOW)) == [2024] * 5
+
+
+def test_evaluate_columns_time_zone() -> None:
+    local = NOW.astimezone(datetime.timezone(datetime.timedelta(hours=-5)))
+    value = date_between(now(), DATE, "days") + hour(now())
+    expected = [evaluate(value, row, now=local) for row in rows()]
+    assert list(evaluate_columns(value, COLUMNS, now=local)) == expected
+
+
+def test_evaluate_columns_ranges() -> None:
+    begin = datetime.date(2024, 3, 1)
+    columns = {"range": [(begin, datetime.date(2024, 3, 4)), begin]}
+    value: Date = prop("range")
+    result = evaluate_columns(date_between(end(value), value, "days"), columns)
+    assert list(result) == [3, 0]
+    assert evaluate_columns(format(value), columns)[0] == (
+        "March 1, 2024 12:00 AM → March 4, 2024 12:00 AM"
+    )
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        empty(DATE),
+        empty(NUMBER),
+        or_(empty(DATE), DATE >= now()),
+        DATE != now(),
+        date_between(now(), DATE, "days") >= 7,
+        year(DATE),
+        format_date(DATE, "YYYY"),
+        date_add(DATE, NUMBER, "days"),
+        end(DATE),
+    ],
+)
+def test_evaluate_columns_missing(value: Expr) -> None:
+    # Missing values are None, or NaN and NaT in arrays, as in `evaluate`.
+    columns = {
+        "date": [None, datetime.datetime(2024, 1, 15, 9, 5), None],
+        "number": [1, None, None],
+    }
+    arrays = {
+        "date": np.array(["NaT", "2024-01-15T09:05", "NaT"], "M8[ms]"),
+        "number": np.array([1, math.nan, math.nan]),
+    }
+    rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+    expected = []
+    for row in rows:
+        result = evaluate(value, row, now=NOW)
+        if isinstance(result, datetime.datetime):
+            result = np.datetime64(result.astimezone(UTC).replace(tzinfo=None), "ms")
+        expected.append(np.datetime64("NaT") if result is None else result)
+    for data in (columns, arrays):
+        result = evaluate_columns(value, data, now=NOW)
+        np.testing.assert_array_equal(result, np.array(expected, result.dtype))
+
+
+def test_evaluate_columns_errors() -> None:
+    with pytest.raises(TypeError, match="expected a number, got a string"):
+        evaluate_columns(NUMBER * 2, {"number": ["3"]})
+    with pytest.raises(ValueError, match="same length"):
+        evaluate_columns(NUMBER, {"number": [1], "string": []})
+    with pytest.raises(KeyError):
+        evaluate_columns(prop("missing") + 1, COLUMNS)
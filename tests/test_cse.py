@@ -0,0 +1,112 @@
+import pytest
+
+from notion_formulas import (
+    Date,
+    Number,
+    and_,
+    bind_common,
+    date_between,
+    encode,
+    if_,
+    now,
+    prop,
+)
+
+DUE: Date = prop("Due")
+NUMBER: Number = prop("number")
+
+
+def test_let() -> None:
+    days = date_between(now(), DUE, "days")
+    value = if_(days > 7, days, days * 2)
+
+    assert encode(bind_common(value)) == (
+        'let(v1, dateBetween(now(), prop("Due"), "days"), if(v1 > 7, v1, v1 * 2))'
+    )
+    assert encode(value, cse=True, dialect="2.0") == encode(bind_common(value))
+
+
+def test_legacy() -> None:
+    days = date_between(now(), DUE, "days")
+    with pytest.raises(ValueError, match=r"cse requires the 2\.0 dialect"):
+        encode(days * 2 + days, cse=True)
+
+
+def test_lets() -> None:
+    days = date_between(now(), DUE, "days")
+    estimate: Number = prop("Estimated Hours")
+    value = if_(days > 7, days + estimate, days * 2 + estimate)
+
+    assert encode(bind_common(value)) == (
+        'lets(v1, prop("Estimated Hours"), '
+        'v2, dateBetween(now(), prop("Due"), "days"), '
+        "if(v2 > 7, v2 + v1, v2 * 2 + v1))"
+    )
+
+
+def test_structural() -> None:
+    value = if_(
+        date_between(now(), DUE, "days") > 7,
+        date_between(now(), prop("Due"), "days"),
+        0,
+    )
+
+    assert encode(bind_common(value)) == (
+        'let(v1, dateBetween(now(), prop("Due"), "days"), if(v1 > 7, v1, 0))'
+    )
+
+
+def test_nested() -> None:
+    # Once the outer repetition is bound, the inner one is only written once.
+    overdue = if_(date_between(now(), DUE, "days") > 7, 1, 0)
+    value = overdue * 2 + overdue
+
+    assert encode(bind_common(value)) == (
+        'let(v1, if(dateBetween(now(), prop("Due"), "days") > 7, 1, 0), v1 * 2 + v1)'
+    )
+
+
+def test_branches() -> None:
+    # Only subexpressions evaluated on every path are bound.
+    days = date_between(now(), DUE, "days")
+
+    assert encode(bind_common(if_(NUMBER > 1, days * 2 + days, 0))) == (
+        'if(prop("number") > 1, dateBetween(now(), prop("Due"), "days") * 2 + '
+        'dateBetween(now(), prop("Due"), "days"), 0)'
+    )
+    assert encode(bind_common(and_(NUMBER > 1, days * 2 > days))) == (
+        'prop("number") > 1 and dateBetween(now(), prop("Due"), "days") * 2 > '
+        'dateBetween(now(), prop("Due"), "days")'
+    )
+    assert encode(bind_common(if_(NUMBER > 1, days * 2, days * 3))) == (
+        'let(v1, dateBetween(now(), prop("Due"), "days"), '
+        'if(prop("number") > 1, v1 * 2, v1 * 3))'
+    )
+    assert encode(bind_common(days + if_(NUMBER > 1, days * 2, 0))) == (
+        'let(v1, dateBetween(now(), prop("Due"), "days"), '
+        'v1 + if(prop("number") > 1, v1 * 2, 0))'
+    )
+
+    select = if_(NUMBER > 1, days, if_(NUMBER > 2, days * 2, 0))
+    assert "let" not in encode(select, cse=True, dialect="2.0")
+    select = if_(NUMBER > 1, days, if_(NUMBER > 2, days * 2, days * 3))
+    assert encode(select, cse=True, dialect="2.0") == (
+        'let(v1, dateBetween(now(), prop("Due"), "days"), '
+        'ifs(prop("number") > 1, v1, prop("number") > 2, v1 * 2, v1 * 3))'
+    )
+
+
+def test_threshold() -> None:
+    value = NUMBER + NUMBER
+
+    assert encode(bind_common(value)) == 'prop("number") + prop("number")'
+    assert encode(bind_common(value, min_length=1)) == (
+        'let(v1, prop("number"), v1 + v1)'
+    )
+    assert encode(bind_common(value, min_length=1, prefix="x")) == (
+        'let(x1, prop("number"), x1 + x1)'
+    )
+
+
+def test_scalar() -> None:
+    assert bind_common(1) == 1
@@ -0,0 +1,157 @@
+import datetime
+import io
+import pathlib
+
+import pytest
+
+from notion_formulas import (
+    Date,
+    and_,
+    date_add,
+    date_between,
+    date_prop,
+    empty,
+    end,
+    evaluate_csv,
+    format,
+    lowercase,
+    main,
+    now,
+    or_,
+    prop,
+    start,
+)
+
+NOW = datetime.datetime(2024, 1, 31, 12, 0, tzinfo=datetime.timezone.utc)
+EXPORT = (
+    "﻿Name,Status,Due,Points,Done,When\r\n"
+    'Write docs,Started,"January 15, 2024 9:05 AM","1,200",Yes,"January 1, 2024"\r\n'
+    'Fix bug,Done,,$3.50,No,"December 20, 2023 → December 22, 2023"\r\n'
+    'Ship,Todo,2024-02-01,50%,No,"January 30, 2024 9:00 AM → 10:30 AM"\r\n'
+)
+WHEN: Date = prop("When")
+
+
+def run(value: object, **kwargs: object) -> str:
+    output = io.StringIO()
+    evaluate_csv(value, io.StringIO(EXPORT), output, now=NOW, **kwargs)  # type: ignore[arg-type]
+    return output.getvalue()
+
+
+def test_evaluate_csv() -> None:
+    formulas = {
+        "Days": date_between(date_prop("Due"), now(), "days"),
+        "Score": prop("Points") * 2,
+        "Closed": and_(prop("Done"), prop("Status") == "Done"),
+        "Label": lowercase(prop("Name")) + "!",
+    }
+    assert run(formulas).splitlines() == [
+        "Name,Status,Due,Points,Done,When,Days,Score,Closed,Label",
+        'Write docs,Started,"January 15, 2024 9:05 AM","1,200",Yes,'
+        '"January 1, 2024",-16,2400,No,write docs!',
+        'Fix bug,Done,,$3.50,No,"December 20, 2023 → December 22, 2023",'
+        ",7,No,fix bug!",
+        'Ship,Todo,2024-02-01,50%,No,"January 30, 2024 9:00 AM → 10:30 AM",'
+        "0,1,No,ship!",
+    ]
+
+
+def test_evaluate_csv_ranges() -> None:
+    value = date_between(end(WHEN), start(WHEN), "minutes")
+    assert run({"When": value}).splitlines()[1:] == [
+        'Write docs,Started,"January 15, 2024 9:05 AM","1,200",Yes,0',
+        "Fix bug,Done,,$3.50,No,2880",
+        "Ship,Todo,2024-02-01,50%,No,90",
+    ]
+
+
+def test_evaluate_csv_errors() -> None:
+    # Rows where a formula overflows a date get empty cells, and other errors
+    # are raised.
+    value = date_add(date_prop("Due"), prop("Points") * 1e12, "days")
+    output = run({"Later": value}).splitlines()
+    assert [line.rsplit(",", 1)[1] for line in output] == ["Later", "", "", ""]
+    value = date_add(date_prop("Due"), prop("Points") * 1e6, "months")
+    output = run({"Later": value}).splitlines()
+    assert [line.rsplit(",", 1)[1] for line in output] == ["Later", "", "", ""]
+    with pytest.raises(TypeError, match="expected a string"):
+        run(lowercase(prop("Points")), types={"Points": "number"})
+
+
+def test_evaluate_csv_missing() -> None:
+    # Empty cells are missing values, which are empty and compare as false.
+    export = "Name,Due,Points\r\nA,,\r\nB,2024-02-01,2\r\n"
+    due = date_prop("Due")
+    formulas = {
+        "Later": or_(empty(due), due >= now()),
+        "Past": due < now(),
+        "Days": date_between(due, now(), "days"),
+        "Unscored": empty(prop("Points")),
+        "Score": prop("Points") * 2,
+    }
+    output = io.StringIO()
+    evaluate_csv(formulas, io.StringIO(export), output, now=NOW)
+    assert output.getvalue().splitlines() == [
+        "Name,Due,Points,Later,Past,Days,Unscored,Score",
+        "A,,,Yes,No,,Yes,",
+        "B,2024-02-01,2,Yes,No,0,No,4",
+    ]
+
+
+def test_evaluate_csv_types() -> None:
+    # Props are read as strings unless their use or a declaration tells.
+    assert run(format(prop("Points"))).splitlines()[0].endswith(",Formula")
+    assert [line.rsplit(",", 1)[1] for line in run(prop("Done")).splitlines()] == [
+        "Formula",
+        "Yes",
+        "No",
+        "No",
+    ]
+    output = run(prop("Points"), types={"Points": "number"}).splitlines()
+    assert [line.rsplit(",", 1)[1] for line in output[1:]] == ["1200", "3.5", "0.5"]
+    with pytest.raises(ValueError, match="unknown type"):
+        run(prop("Points"), types={"Points": "integer"})
+    with pytest.raises(ValueError, match="row 1, column 'Name'"):
+        run(prop("Name"), types={"Name": "number"})
+    with pytest.raises(ValueError, match="no columns for props: 'Missing'"):
+        run(prop("Missing"))
+
+
+def test_evaluate_csv_files(tmp_path: pathlib.Path) -> None:
+    src = tmp_path / "export.csv"
+    dst = tmp_path / "output.csv"
+    src.write_text(EXPORT, encoding="utf-8")
+    count = evaluate_csv(prop("Points") + 1, src, dst, chunk_size=2, now=NOW)
+    assert count == 3
+    assert dst.read_bytes().decode() == run(prop("Points") + 1).lstrip("\ufeff")
+
+
+def test_main(
+    tmp_path: pathlib.Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    (tmp_path / "formulas.py").write_text(
+        "from notion_formulas import prop\n"
+        "\n"
+        "def score():\n"
+        '    return {"Score": prop("Points") * 2}\n',
+        encoding="utf-8",
+    )
+    (tmp_path / "export.csv").write_text(EXPORT, encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+
+    assert (
+        main(["csv", "formulas:score", "export.csv", "-", "--now", "2024-01-31"]) == 0
+    )
+    output, errors = capsys.readouterr()
+    assert output.splitlines()[1].endswith(",2400")
+    assert errors == "3 rows\n"
+
+    assert main(["csv", "formulas.py:score", "export.csv", "output.csv"]) == 0
+    written = (tmp_path / "output.csv").read_text(encoding="utf-8")
+    assert written.splitlines() == output.splitlines()
+
+    with pytest.raises(SystemExit):
+        main(["csv", "formulas:missing", "export.csv", "-"])
+    assert "has no attribute 'missing'" in capsys.readouterr().err
@@ -0,0 +1,115 @@
+import io
+
+import pytest
+
+from notion_formulas import (
+    Date,
+    ExprGraph,
+    Number,
+    String,
+    encode,
+    encode_to,
+    end,
+    if_,
+    iter_encode,
+    list_length,
+    lowercase,
+    optimize,
+    progressbar,
+    prop,
+    select,
+    slice,
+    start,
+    uppercase,
+)
+
+DATE: Date = prop("date")
+NUMBER: Number = prop("number")
+STRING: String = prop("string")
+
+
+def test_native_functions() -> None:
+    assert encode(lowercase(STRING), dialect="2.0") == 'lower(prop("string"))'
+    assert encode(uppercase(STRING), dialect="2.0") == 'upper(prop("string"))'
+    assert encode(list_length(STRING), dialect="2.0") == 'length(prop("string"))'
+    assert encode(progressbar(NUMBER, "X", "x", 3), dialect="2.0") == (
+        'repeat("X", floor(3 * prop("number"))) + '
+        'repeat("x", 3 - floor(3 * prop("number")))'
+    )
+
+
+def test_legacy_expansion() -> None:
+    assert encode(lowercase(STRING)) == encode(lowercase(STRING), dialect="legacy")
+    assert encode(uppercase(STRING)).count("replaceAll") == 26
+    assert encode(progressbar(NUMBER, "X", "x", 3) + "!") == (
+        'slice(slice("XXXxxx", 0, 6 - max(0, min(3, floor(3 * prop("number"))))), '
+        '-3) + "!"'
+    )
+
+
+def test_renamed_functions() -> None:
+    assert (
+        encode(slice(STRING, 0, 2), dialect="2.0") == 'substring(prop("string"), 0, 2)'
+    )
+    assert encode(start(DATE), dialect="2.0") == 'dateStart(prop("date"))'
+    assert encode(end(DATE), dialect="2.0") == 'dateEnd(prop("date"))'
+    assert encode(end(DATE)) == 'end(prop("date"))'
+
+
+def test_ifs() -> None:
+    value = select(
+        (NUMBER == 1, "one"),
+        (NUMBER == 2, "two"),
+        (NUMBER == 3, "three"),
+        default="other",
+    )
+    assert encode(value, dialect="2.0") == (
+        'ifs(prop("number") == 1, "one", prop("number") == 2, "two", '
+        'prop("number") == 3, "three", "other")'
+    )
+    assert encode(if_(NUMBER > 1, "a", "b"), dialect="2.0") == (
+        'if(prop("number") > 1, "a", "b")'
+    )
+
+
+def test_ifs_deep() -> None:
+    tests = [(NUMBER == index, str(index)) for index in range(10000)]
+    value = select(*tests, default="other")
+    formula = encode(value, dialect="2.0")
+    assert formula.startswith('ifs(prop("number") == 0, "0", ')
+    assert formula.count("ifs(") == 1
+
+
+def test_nested() -> None:
+    value = lowercase(uppercase(STRING))
+    assert encode(value, dialect="2.0") == 'lower(upper(prop("string")))'
+    assert encode(value).count("replaceAll") == 52
+
+
+def test_streaming() -> None:
+    value = lowercase(STRING) + "!"
+    stream = io.StringIO()
+    encode_to(value, stream, dialect="2.0")
+    assert stream.getvalue() == 'lower(prop("string")) + "!"'
+    assert "".join(iter_encode(value, dialect="2.0")) == stream.getvalue()
+
+
+def test_graph() -> None:
+    value = select((NUMBER > 0, lowercase(STRING)), (NUMBER < 0, "a"), default="b")
+    graph = ExprGraph.from_expr(value)
+    assert graph.encode() == encode(value)
+    assert graph.encode(dialect="2.0") == encode(value, dialect="2.0")
+    assert graph.encode(dialect="2.0").startswith("ifs(")
+
+
+def test_fold() -> None:
+    assert optimize(lowercase("HeLLo")) == "hello"
+    assert optimize(uppercase("HeLLo")) == "HELLO"
+    assert encode(optimize(lowercase("ÄB"))) == encode(lowercase("ÄB"))
+
+
+def test_unknown_dialect() -> None:
+    with pytest.raises(ValueError, match="unknown dialect"):
+        encode(STRING, dialect="3.0")  # type: ignore[arg-type]
+    with pytest.raises(ValueError, match="unknown dialect"):
+        ExprGraph.from_expr(STRING).encode(dialect="3.0")  # type: ignore[arg-type]
@@ -1,9 +1,13 @@
+import io
+
 from notion_formulas import (
     BinaryOperation,
     Constant,
     Function,
     UnaryOperation,
     encode,
+    encode_to,
+    iter_encode,
     prop,
 )
 
@@ -42,3 +46,71 @@ def test_binary_operator() -> None:
 
 def test_str() -> None:
     assert str(prop("test")) == 'prop("test")'
+
+
+def test_encode_deep_left_chain() -> None:
+    value = prop("test")
+    for _ in range(100_000):
+        value = value + 1
+
+    encoded = encode(value)
+    assert encoded.startswith('prop("test") + 1 + 1')
+    assert len(encoded) == len('prop("test")') + 100_000 * len(" + 1")
+
+
+def test_encode_deep_right_chain() -> None:
+    value = prop("test")
+    for _ in range(100_000):
+        value = 1 - value
+
+    encoded = encode(value)
+    assert encoded.startswith("1 - (1 - (1 - ")
+    assert encoded.endswith('1 - prop("test")' + ")" * 99_999)
+
+
+def test_encode_deep_functions() -> None:
+    value = prop("test")
+    for _ in range(100_000):
+        value = Function("abs", value)
+
+    encoded = encode(value)
+    assert encoded == "abs(" * 100_000 + 'prop("test")' + ")" * 100_000
+
+
+def test_iter_encode() -> None:
+    assert list(iter_encode(1)) == ["1"]
+    assert "".join(iter_encode(prop("test") + 1)) == 'prop("test") + 1'
+    assert "".join(iter_encode(3 / (prop("test") * 2))) == '3 / (prop("test") * 2)'
+
+
+def test_encode_to() -> None:
+    value = prop("test")
+    for _ in range(10_000):
+        value = value + 1
+
+    stream = io.StringIO()
+    encode_to(value, stream, chunk_size=100)
+    assert stream.getvalue() == encode(value)
+
+
+def test_encode_shared_subexpression() -> None:
+    shared = Function("dateBetween", Function("now"), prop("due"), "days")
+    value = Function("if", shared > 7, shared, shared * 2)
+
+    assert encode(value) == (
+        'if(dateBetween(now(), prop("due"), "days") > 7, '
+        'dateBetween(now(), prop("due"), "days"), '
+        'dateBetween(now(), prop("due"), "days") * 2)'
+    )
+    assert shared._encoded == 'dateBetween(now(), prop("due"), "days")'
+    assert value._encoded is None
+
+
+def test_encode_shared_dag() -> None:
+    value = prop("test") + prop("test")
+    size = len('prop("test") + prop("test")')
+    for _ in range(16):
+        value = value + value
+        size = 2 * size + len(" + ()")
+
+    assert len(encode(value)) == size
@@ -0,0 +1,367 @@
+import datetime
+import math
+from typing import Any, Dict, Iterator, Mapping
+
+import pytest
+
+from notion_formulas import (
+    PI,
+    Boolean,
+    Date,
+    E,
+    Expr,
+    Number,
+    String,
+    and_,
+    cbrt,
+    compile_expr,
+    concat,
+    date_add,
+    date_between,
+    date_subtract,
+    day,
+    empty,
+    end,
+    evaluate,
+    floor,
+    format,
+    format_date,
+    from_timestamp,
+    hour,
+    id,
+    if_,
+    log10,
+    lowercase,
+    max,
+    min,
+    minute,
+    month,
+    now,
+    or_,
+    progressbar,
+    prop,
+    replace_all,
+    select,
+    sign,
+    slice,
+    sqrt,
+    start,
+    timestamp,
+    to_number,
+    year,
+)
+from notion_formulas import test as notion_test
+
+BOOLEAN: Boolean = prop("boolean")
+DATE: Date = prop("date")
+NUMBER: Number = prop("number")
+STRING: String = prop("string")
+ZERO: Number = prop("zero")
+
+UTC = datetime.timezone.utc
+NOW = datetime.datetime(2024, 1, 31, 14, 30, tzinfo=UTC)
+ROW = {
+    "boolean": True,
+    "date": datetime.datetime(2024, 1, 15, 9, 5, 7, 250000),
+    "number": 3,
+    "string": "Hello",
+    "zero": 0,
+}
+
+
+def run(value: Expr, **row: Any) -> Any:
+    return evaluate(value, {**ROW, **row}, now=NOW, page_id="page")
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (NUMBER + 1, 4),
+        (NUMBER * 2 - 1, 5),
+        (NUMBER / 2, 1.5),
+        (NUMBER % 2, 1),
+        (NUMBER**2, 9),
+        (-NUMBER, -3),
+        (PI, math.pi),
+        (E, math.e),
+        (STRING + "!", "Hello!"),
+        (concat(STRING, ", ", STRING), "Hello, Hello"),
+        (slice(STRING, 1, 3), "el"),
+        (slice(STRING, ZERO / ZERO, NUMBER - 1), "He"),
+        (slice(STRING, -NUMBER / ZERO, NUMBER / ZERO), "Hello"),
+        (lowercase(STRING), "hello"),
+        (replace_all(STRING, "l", "L"), "HeLLo"),
+        (notion_test(STRING, "^H"), True),
+        (notion_test(STRING + "\n", "^Hello$"), False),
+        (replace_all(STRING + "\n", ".$", "!"), "Hello\n"),
+        (format(NUMBER / 4), "0.75"),
+        (format(-NUMBER / ZERO), "-Infinity"),
+        (to_number("12"), 12),
+        (floor(NUMBER / 2), 1),
+        (cbrt(27), 3),
+        (progressbar(NUMBER / 10, "X", "x", 5), "Xxxxx"),
+        (progressbar(NUMBER / 2.5, "X", "x", 5), "XXXXX"),
+        (progressbar(-NUMBER / 30, "X", "x", 5), "xxxxx"),
+        (progressbar(ZERO / ZERO, "X", "x", 5), ""),
+        (NUMBER > 2, True),
+        (STRING == "Hello", True),
+        (and_(BOOLEAN, NUMBER < 0), False),
+        (if_(BOOLEAN, "yes", "no"), "yes"),
+        (id(), "page"),
+    ],
+)
+def test_evaluate(value: Expr, expected: Any) -> None:
+    assert run(value) == expected
+
+
+def test_evaluate_lazy() -> None:
+    # Only the branch taken and the operands needed are evaluated.
+    assert run(if_(BOOLEAN, 1, prop("missing"))) == 1
+    assert run(or_(BOOLEAN, prop("missing"))) is True
+    missing: String = prop("missing")
+    assert run(select((NUMBER > 2, "big"), default=missing)) == "big"
+    with pytest.raises(KeyError):
+        run(if_(BOOLEAN, prop("missing"), 1))
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (NUMBER / ZERO, math.inf),
+        (-NUMBER / ZERO, -math.inf),
+        (NUMBER % ZERO, math.nan),
+        (ZERO / ZERO, math.nan),
+        (ZERO**-NUMBER, math.inf),
+        (10 ** (NUMBER * 200), math.inf),
+        (sqrt(-NUMBER), math.nan),
+        (log10(NUMBER - 3), -math.inf),
+        (floor(NUMBER / ZERO), math.inf),
+        (to_number(STRING), math.nan),
+        (max(NUMBER, sqrt(-NUMBER)), math.nan),
+        (min(sqrt(-NUMBER), NUMBER), math.nan),
+        (sign(sqrt(-NUMBER)), math.nan),
+    ],
+)
+def test_evaluate_numbers(value: Expr, expected: float) -> None:
+    result = run(value)
+    if math.isnan(expected):
+        assert math.isnan(result)
+    else:
+        assert result == expected
+
+
+def test_evaluate_types() -> None:
+    with pytest.raises(TypeError, match="expected a number"):
+        run(NUMBER * 2, number="3")
+    with pytest.raises(ValueError, match="without a page_id"):
+        evaluate(id(), ROW)
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (now(), NOW),
+        (start(DATE), datetime.datetime(2024, 1, 15, 9, 5, 7, 250000, tzinfo=UTC)),
+        (timestamp(now()), 1706711400000),
+        (from_timestamp(1706711400000), NOW),
+        (to_number(now()), 1706711400000),
+        (minute(DATE), 5),
+        (hour(DATE), 9),
+        (day(DATE), 1),
+        (month(DATE), 0),
+        (year(DATE), 2024),
+        (
+            date_add(now(), 1, "months"),
+            datetime.datetime(2024, 2, 29, 14, 30, tzinfo=UTC),
+        ),
+        (
+            date_add(now(), 1, "quarters"),
+            datetime.datetime(2024, 4, 30, 14, 30, tzinfo=UTC),
+        ),
+        (
+            date_subtract(now(), 1.5, "days"),
+            datetime.datetime(2024, 1, 29, 14, 30, tzinfo=UTC),
+        ),
+        (
+            date_add(now(), 90, "minutes"),
+            datetime.datetime(2024, 1, 31, 16, 0, tzinfo=UTC),
+        ),
+        (date_between(now(), DATE, "days"), 16),
+        (date_between(DATE, now(), "days"), -16),
+        (date_between(now(), DATE, "weeks"), 2),
+        (date_between(now(), DATE, "hours"), 389),
+        (date_between(date_add(now(), 1, "months"), now(), "months"), 1),
+        (date_between(now(), DATE, "months"), 0),
+        (date_between(now(), date_subtract(DATE, 1, "years"), "years"), 1),
+        (now() > DATE, True),
+        (now() == from_timestamp(timestamp(now())), True),
+    ],
+)
+def test_evaluate_dates(value: Expr, expected: Any) -> None:
+    assert run(value) == expected
+
+
+def test_evaluate_date_range() -> None:
+    begin = datetime.date(2024, 3, 1)
+    finish = datetime.date(2024, 3, 4)
+    row = {"range": (begin, finish)}
+    value: Date = prop("range")
+    assert run(date_between(end(value), start(value), "days"), **row) == 3
+    assert (
+        run(format(value), **row) == "March 1, 2024 12:00 AM → March 4, 2024 12:00 AM"
+    )
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (empty(DATE), True),
+        (empty(date_add(DATE, 1, "days")), True),
+        (or_(empty(DATE), DATE >= now()), True),
+        (DATE >= now(), False),
+        (DATE < now(), False),
+        (DATE == now(), False),
+        (DATE != now(), True),
+        (date_between(now(), DATE, "days"), math.nan),
+        (date_between(now(), DATE, "days") >= 7, False),
+        (timestamp(DATE), math.nan),
+        (day(DATE), math.nan),
+        (year(DATE) + 1, math.nan),
+        (format_date(DATE, "YYYY"), ""),
+        (format(DATE), ""),
+        (end(DATE), None),
+        (from_timestamp(timestamp(DATE)), None),
+        (empty(NUMBER), True),
+        (empty(date_add(now(), NUMBER, "days")), True),
+        (NUMBER + 1, math.nan),
+        (NUMBER > 0, False),
+        (empty(ZERO / ZERO), True),
+    ],
+)
+def test_evaluate_missing(value: Expr, expected: Any) -> None:
+    # Missing dates and numbers are None, and are empty like in Notion.
+    row = {**ROW, "date": None, "number": None}
+    assert repr(evaluate(value, row, now=NOW)) == repr(expected)
+    assert repr(compile_expr(value, now=NOW)(row)) == repr(expected)
+
+
+def test_evaluate_time_zone() -> None:
+    zone = datetime.timezone(datetime.timedelta(hours=-5))
+    local = NOW.astimezone(zone)
+    assert evaluate(hour(now()), {}, now=local) == 9
+    assert evaluate(from_timestamp(0), {}, now=local).utcoffset() == zone.utcoffset(
+        None
+    )
+    assert evaluate(format_date(now(), "Z"), {}, now=local) == "-05:00"
+
+
+@pytest.mark.parametrize(
+    ("pattern", "expected"),
+    [
+        ("YYYY-MM-DD HH:mm:ss.SSS", "2024-01-15 09:05:07.250"),
+        ("MMMM Do, YY", "January 15th, 24"),
+        ("ddd, MMM D h:mm a", "Mon, Jan 15 9:05 am"),
+        ("dddd [the] Do [of] MMMM", "Monday the 15th of January"),
+        ("Q/M/d ZZ", "1/1/1 +0000"),
+        ("X", "1705309507"),
+    ],
+)
+def test_evaluate_format_date(pattern: str, expected: str) -> None:
+    assert run(format_date(DATE, pattern)) == expected
+
+
+def test_evaluate_deep() -> None:
+    value: Number = NUMBER
+    for _ in range(10000):
+        value = value + 1
+    assert run(value) == 10003
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        NUMBER * 2 - 1,
+        NUMBER / 2 - 1 / ZERO,
+        -NUMBER % 2,
+        STRING + format(NUMBER),
+        concat(STRING, ", ", lowercase(STRING)),
+        if_(NUMBER > 1, NUMBER, "small"),
+        if_(NUMBER > 1, NUMBER * 2, NUMBER - 1) + NUMBER,
+        select(*[(NUMBER == index, index * 10) for index in range(5)], default=-1),
+        select((NUMBER > 2, if_(BOOLEAN, "a", "b")), (NUMBER > 0, "c"), default="d"),
+        and_(BOOLEAN, or_(NUMBER < 0, NUMBER > 2)),
+        or_(NUMBER > 2, if_(NUMBER < 0, BOOLEAN, NUMBER == 1)),
+        date_between(now(), date_add(DATE, NUMBER, "days"), "hours"),
+        format_date(date_subtract(now(), NUMBER, "months"), "YYYY-MM-DD"),
+        id(),
+    ],
+)
+def test_compile(value: Expr) -> None:
+    formula = compile_expr(value, now=NOW, page_id="page")
+    for number in range(-2, 5):
+        row = {**ROW, "number": number, "boolean": number % 2 == 0}
+        assert formula(row) == evaluate(value, row, now=NOW, page_id="page")
+
+
+class Row(Mapping[str, Any]):
+    def __init__(self, **values: Any) -> None:
+        self.props = values
+        self.reads: Dict[str, int] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        self.reads[key] = self.reads.get(key, 0) + 1
+        return self.props[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.props)
+
+    def __len__(self) -> int:
+        return len(self.props)
+
+
+def test_compile_shared() -> None:
+    # Subexpressions occurring more than once are computed once per row.
+    twice = if_(BOOLEAN, NUMBER * 2, 0)
+    value = if_(NUMBER > 1, twice + 1, twice - 1) + twice + NUMBER
+    formula = compile_expr(value, now=NOW)
+    for number in (0, 3):
+        row = Row(**{**ROW, "number": number})
+        assert formula(row) == evaluate(value, row.props, now=NOW)
+        assert row.reads == {"number": 1, "boolean": 1}
+
+
+def test_compile_lazy() -> None:
+    missing: String = prop("missing")
+    formula = compile_expr(select((NUMBER > 2, "big"), default=missing))
+    assert formula(ROW) == "big"
+    with pytest.raises(KeyError):
+        formula({**ROW, "number": 0})
+    assert compile_expr(or_(BOOLEAN, prop("missing")))(ROW) is True
+    with pytest.raises(TypeError, match="expected a number"):
+        compile_expr(NUMBER * 2)({"number": "3"})
+
+
+def test_compile_cache() -> None:
+    first = compile_expr(NUMBER + 1, now=NOW)
+    second = compile_expr(prop("number") + 1, now=NOW)
+    assert first.__code__ is second.__code__
+    assert first(ROW) == second(ROW) == 4
+
+
+def test_compile_deep() -> None:
+    total: Number = NUMBER
+    test: Boolean = NUMBER > 0
+    for index in range(10000):
+        total = total + 1
+        test = and_(test, NUMBER > -index)
+    value = select(*[(NUMBER == index, index) for index in range(10000)], default=-1)
+    chain: Number = ZERO
+    for index in range(1000):
+        chain = if_(NUMBER > index, chain + NUMBER, chain - NUMBER)
+
+    assert compile_expr(total)(ROW) == 10003
+    assert compile_expr(test)(ROW) is True
+    assert compile_expr(value)(ROW) == 3
+    for number in (-1, 3):
+        row = {**ROW, "number": number}
+        assert compile_expr(chain)(row) == evaluate(chain, row)
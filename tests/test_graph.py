@@ -0,0 +1,79 @@
+import pickle
+
+import pytest
+
+from notion_formulas import (
+    PI,
+    ExprGraph,
+    ExprImpl,
+    Number,
+    date_between,
+    encode,
+    if_,
+    not_,
+    now,
+    or_,
+    prop,
+    same,
+    select,
+)
+
+NUMBER: Number = prop("number")
+
+EXPRESSIONS = [
+    1,
+    "test",
+    NUMBER,
+    -(NUMBER + 1) * PI,
+    3 / (NUMBER * 2),
+    2 ** (NUMBER**2),
+    or_(not_(NUMBER > 1), NUMBER == 2.5),
+    select((NUMBER == 1, "one"), (NUMBER == 2, "two"), default="other"),
+]
+
+
+@pytest.mark.parametrize("value", EXPRESSIONS)
+def test_roundtrip(value: Number) -> None:
+    graph = ExprGraph.from_expr(value)
+    assert graph.encode() == encode(value)
+    assert same(graph.to_expr(), value)
+
+
+def test_sharing() -> None:
+    days = date_between(now(), prop("due"), "days")
+    value = if_(days > 7, days, days * 2)
+    graph = ExprGraph.from_expr(value)
+
+    assert len(graph) == 10
+    assert graph.encode() == encode(value)
+
+    rebuilt = graph.to_expr()
+    assert isinstance(rebuilt, ExprImpl)
+    assert rebuilt.args[1] is rebuilt.args[0].left  # type: ignore[attr-defined]
+
+
+def test_pickle() -> None:
+    value = select((NUMBER == 1, "one"), (NUMBER == 2, "two"), default="other")
+    graph = pickle.loads(pickle.dumps(ExprGraph.from_expr(value)))
+    assert graph.encode() == encode(value)
+
+
+def test_deep() -> None:
+    value = NUMBER
+    for _ in range(100_000):
+        value = 1 - value
+
+    graph = ExprGraph.from_expr(value)
+    assert graph.encode() == encode(value)
+    assert encode(graph.to_expr()) == encode(value)
+
+
+def test_unsupported() -> None:
+    class Custom(ExprImpl):
+        precedence = 12
+
+        def encode(self) -> str:
+            return "custom"
+
+    with pytest.raises(TypeError):
+        ExprGraph.from_expr(Custom())
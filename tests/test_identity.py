@@ -0,0 +1,54 @@
+from notion_formulas import (
+    ExprKey,
+    Function,
+    Interner,
+    Number,
+    fingerprint,
+    prop,
+    same,
+)
+
+NUMBER: Number = prop("number")
+
+
+def test_fingerprint() -> None:
+    assert fingerprint(prop("number") + 1) == fingerprint(prop("number") + 1)
+    assert fingerprint(prop("number") + 1) != fingerprint(prop("number") - 1)
+    assert fingerprint(prop("number") + 1) != fingerprint(prop("other") + 1)
+    assert fingerprint(prop("number") + 1) != fingerprint(1 + prop("number"))
+
+
+def test_fingerprint_stable() -> None:
+    assert fingerprint(prop("number") * 2 + 1) == "23ea6aee3afcf4fcdc7dff47d3699a8f"
+
+
+def test_fingerprint_scalars() -> None:
+    assert fingerprint(1) == fingerprint(1)
+    assert fingerprint(1) != fingerprint(1.0)
+    assert fingerprint(1) != fingerprint(True)
+    assert fingerprint(1) != fingerprint("1")
+    assert fingerprint(Function("abs", 1)) != fingerprint(Function("abs", 1.0))
+
+
+def test_fingerprint_deep() -> None:
+    value = NUMBER
+    for _ in range(100_000):
+        value = value + 1
+
+    assert len(fingerprint(value)) == 32
+
+
+def test_same() -> None:
+    assert same(NUMBER + 1, prop("number") + 1)
+    assert not same(NUMBER + 1, NUMBER + 2)
+    assert same("test", "test")
+
+    with Interner():
+        assert same(prop("number") + 1, prop("number") + 1)
+
+
+def test_expr_key() -> None:
+    keys = {ExprKey(NUMBER + 1), ExprKey(prop("number") + 1), ExprKey(NUMBER + 2)}
+    assert len(keys) == 2
+    assert ExprKey(NUMBER + 1) in keys
+    assert ExprKey(NUMBER + 3) not in keys
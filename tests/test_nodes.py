@@ -0,0 +1,97 @@
+import copy
+import gc
+import pickle
+
+import pytest
+
+from notion_formulas import (
+    BinaryOperation,
+    Constant,
+    Function,
+    Interner,
+    UnaryOperation,
+    encode,
+    now,
+    prop,
+)
+
+NODES = [
+    Constant("e"),
+    Function("abs", prop("number")),
+    UnaryOperation(8, "-", prop("number")),
+    BinaryOperation(6, " + ", prop("number"), 1),
+]
+
+
+@pytest.mark.parametrize("node", NODES)
+def test_slots(node: object) -> None:
+    assert not hasattr(node, "__dict__")
+
+
+@pytest.mark.parametrize("node", NODES)
+def test_immutable(node: object) -> None:
+    with pytest.raises(AttributeError):
+        node.name = "test"  # type: ignore[attr-defined]
+
+    with pytest.raises(AttributeError):
+        del node.precedence  # type: ignore[attr-defined]
+
+
+def test_precedence() -> None:
+    assert UnaryOperation(8, "-", 1).precedence == 8
+    assert BinaryOperation(6, " + ", 1, 2).precedence == 6
+
+
+@pytest.mark.parametrize("node", NODES)
+def test_pickle(node: Constant) -> None:
+    assert encode(pickle.loads(pickle.dumps(node))) == encode(node)
+    assert encode(copy.deepcopy(node)) == encode(node)
+
+
+def test_interner() -> None:
+    assert prop("test") is not prop("test")
+
+    with Interner() as interner:
+        assert prop("test") is prop("test")
+        assert (prop("test") + 1) is (prop("test") + 1)
+        assert now() is now()
+
+        assert prop("test") is not prop("other")
+        assert Function("abs", 1) is not Function("abs", 1.0)
+        assert Function("abs", 1) is not Function("abs", True)
+        assert Function("abs", 0.0) is not Function("abs", -0.0)
+        assert encode(Function("abs", -0.0)) == "abs(-0.0)"
+
+    assert prop("test") is not prop("test")
+
+    gc.collect()
+    assert len(interner) == 0
+
+
+def test_interner_keywords() -> None:
+    with Interner():
+        node = BinaryOperation(6, " + ", left=prop("test"), right=1)
+        assert node is BinaryOperation(6, " + ", prop("test"), 1)
+        assert Constant(name="e") is Constant("e")
+
+
+def test_interner_reentrant() -> None:
+    interner = Interner()
+
+    with interner:
+        first = prop("test") + 1
+
+    with interner:
+        second = prop("test") + 1
+
+    assert first is second
+
+
+def test_interner_weak() -> None:
+    with Interner() as interner:
+        value = prop("test") + 1
+        assert len(interner) == 2
+
+        del value
+        gc.collect()
+        assert len(interner) == 0
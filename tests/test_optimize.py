@@ -0,0 +1,714 @@
+import datetime
+import math
+from typing import Any
+
+import pytest
+
+from notion_formulas import (
+    BinaryOperation,
+    Boolean,
+    Date,
+    Expr,
+    Function,
+    Number,
+    String,
+    UnaryOperation,
+    abs,
+    and_,
+    concat,
+    contains,
+    date_add,
+    date_between,
+    date_subtract,
+    empty,
+    encode,
+    end,
+    evaluate,
+    floor,
+    format,
+    from_timestamp,
+    hour,
+    if_,
+    join,
+    length,
+    log10,
+    lowercase,
+    max,
+    min,
+    minute,
+    month,
+    multiply,
+    not_,
+    now,
+    optimize,
+    or_,
+    profile,
+    prop,
+    reorder,
+    replace,
+    round,
+    select,
+    sign,
+    simplify,
+    simplify_dates,
+    simplify_logic,
+    simplify_ranges,
+    simplify_strings,
+    slice,
+    specialize,
+    sqrt,
+    start,
+    timestamp,
+    to_number,
+)
+from notion_formulas import test as notion_test
+
+BOOLEAN: Boolean = prop("boolean")
+DATE: Date = prop("date")
+NUMBER: Number = prop("number")
+STRING: String = prop("string")
+LENGTH = length(STRING)
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (BinaryOperation(6, " + ", 1, 2), 3),
+        (BinaryOperation(6, " + ", "a", "b"), "ab"),
+        (BinaryOperation(7, " / ", 1, 4), 0.25),
+        (BinaryOperation(7, " / ", 4, 2), 2),
+        (BinaryOperation(7, " % ", -7, 3), -1),
+        (BinaryOperation(9, " ^ ", 2, 10), 1024),
+        (BinaryOperation(7, " % ", -14, 1), -0.0),
+        (BinaryOperation(5, " < ", 1, 2), True),
+        (BinaryOperation(5, " >= ", "a", "b"), False),
+        (BinaryOperation(4, " == ", 1, 1.0), True),
+        (BinaryOperation(4, " != ", "a", "a"), False),
+        (BinaryOperation(3, " and ", True, False), False),
+        (UnaryOperation(8, "-", 2), -2),
+        (UnaryOperation(8, "+", "42"), 42),
+        (UnaryOperation(10, "not ", False), True),
+        (abs(-3), 3),
+        (floor(2.5), 2),
+        (round(-2.5), -2),
+        (sign(-4), -1),
+        (sqrt(16), 4),
+        (max(1, 5, 3), 5),
+        (length("abc"), 3),
+        (length("\U0001f600"), 2),
+        (concat("a", "b", "c"), "abc"),
+        (slice("abcdef", 1, -1), "bcde"),
+        (format(1.5), "1.5"),
+        (format(1e21), "1e+21"),
+        (format(1e-7), "1e-7"),
+        (format(True), "true"),
+        (to_number("1.5"), 1.5),
+        (contains("abc", "b"), True),
+        (empty(""), True),
+        (empty(0), True),
+        (empty("a"), False),
+        (replace("a-b-c", "-(\\w)", "[$1]"), "a[b]-c"),
+        (notion_test("abc", "^a"), True),
+        (notion_test("A\n", "^A$"), False),
+        (notion_test("a\nb", "^a.b$"), False),
+        (notion_test("a\u00a0b", "^a\\sb$"), True),
+        (notion_test("x{,2}", "^x{,2}$"), True),
+        (notion_test("\n", "[^]"), True),
+        (lowercase("HeLLo"), "hello"),
+    ],
+)
+def test_fold(value: Expr, expected: Any) -> None:
+    result: Any = optimize(value)
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        BinaryOperation(6, " + ", 1, "a"),
+        BinaryOperation(7, " / ", 1, 0),
+        BinaryOperation(5, " < ", True, False),
+        BinaryOperation(9, " ^ ", -8, 0.5),
+        to_number("abc"),
+        sqrt(-1),
+        replace("abc", "(?<!(\\.\\d*|^.{0}))b", "x"),
+        replace("abc", "(?i)B", "x"),
+        notion_test("a", "\\a"),
+        notion_test("a", "a*+"),
+    ],
+)
+def test_no_fold(value: Expr) -> None:
+    assert encode(optimize(value)) == encode(value)
+
+
+def test_fold_nested() -> None:
+    assert optimize(abs(-3) + length("abc") * 2) == 9
+    assert encode(optimize(NUMBER + abs(-3) * 2)) == 'prop("number") + 6'
+    assert encode(optimize(NUMBER * BinaryOperation(6, " - ", 2, 1))) == (
+        'prop("number")'
+    )
+
+
+def test_fold_absorbing() -> None:
+    # `0 * x` and `0 / x` are NaN when `x` is infinite, zero or NaN.
+    zero = BinaryOperation(6, " - ", 1, 1)
+    one = BinaryOperation(7, " / ", 2, 2)
+    assert encode(optimize(BinaryOperation(7, " * ", zero, NUMBER))) == (
+        '0 * prop("number")'
+    )
+    assert encode(optimize(BinaryOperation(7, " / ", zero, if_(BOOLEAN, 0, 1)))) == (
+        '0 / if(prop("boolean"), 0, 1)'
+    )
+    assert encode(optimize(BinaryOperation(9, " ^ ", one, NUMBER))) == (
+        '1 ^ prop("number")'
+    )
+    assert encode(optimize(BinaryOperation(7, " % ", NUMBER, one))) == (
+        'prop("number") % 1'
+    )
+    assert optimize(BinaryOperation(9, " ^ ", NUMBER, zero)) == 1
+
+
+def test_fold_negative_zero() -> None:
+    zero: Any = optimize(BinaryOperation(7, " % ", -14, 1))
+    assert math.copysign(1, zero) == -1
+    assert encode(optimize(BinaryOperation(7, " / ", 1, zero))) == "1 / -0.0"
+
+
+def test_fold_if() -> None:
+    assert encode(optimize(if_(True, NUMBER, 0))) == 'prop("number")'
+    assert encode(optimize(if_(1 < 2, STRING, "b"))) == 'prop("string")'
+    assert encode(optimize(if_(length("") > 0, NUMBER, NUMBER + 1))) == (
+        'prop("number") + 1'
+    )
+
+
+def test_fold_and_or() -> None:
+    assert encode(optimize(and_(True, BOOLEAN))) == 'prop("boolean")'
+    assert optimize(and_(BOOLEAN, False)) is False
+    assert encode(optimize(or_(False, BOOLEAN))) == 'prop("boolean")'
+    assert optimize(or_(BOOLEAN, 1 < 2)) is True
+    assert optimize(not_(and_(BOOLEAN, False))) is True
+
+
+def test_unchanged() -> None:
+    value = if_(NUMBER > 1, multiply(NUMBER, 2), NUMBER)
+    assert optimize(value) is value
+
+
+def test_shared() -> None:
+    shared = Function("dateBetween", Function("now"), prop("due"), "days")
+    value = optimize(if_(shared > abs(-7), shared, shared * abs(-2)))
+    assert isinstance(value, Function)
+    assert value.args[1] is shared
+    assert value.args[0].left is shared  # type: ignore[union-attr]
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (sum([NUMBER, 40, 2, NUMBER]), '2 * prop("number") + 42'),
+        (NUMBER * 2 * 3, '6 * prop("number")'),
+        (-NUMBER * 2, '-2 * prop("number")'),
+        (NUMBER - NUMBER, 'prop("number") - prop("number")'),
+        (-(NUMBER - 1) + NUMBER, 'prop("number") - prop("number") + 1'),
+        (3 * NUMBER + 1 - 3 * NUMBER, 'prop("number") - prop("number") + 1'),
+        (length(STRING) + 1 - length(STRING), "1"),
+        (2 * if_(BOOLEAN, 1, 2) - if_(BOOLEAN, 1, 2) * 2, "0"),
+        (2 * (NUMBER + 3) + NUMBER, '3 * prop("number") + 6'),
+        (2 * (NUMBER + 3), '2 * (prop("number") + 3)'),
+        (
+            NUMBER * prop("y") + 2 * NUMBER * prop("y"),
+            '3 * prop("number") * prop("y")',
+        ),
+        (
+            15.0 * if_(BOOLEAN, 1, 0) - 5.0 * if_(NUMBER > 1, 1, 0),
+            'if(prop("boolean"), 15, 0) - if(prop("number") > 1, 5, 0)',
+        ),
+        ((NUMBER + 14.0) * 0.8 / 21.0, '0.8 * (prop("number") + 14) / 21'),
+        (abs(NUMBER + 1 + 1), 'abs(prop("number") + 2)'),
+    ],
+)
+def test_simplify(value: Number, expected: str) -> None:
+    assert encode(simplify(value)) == expected
+
+
+@pytest.mark.parametrize("number", [math.inf, -math.inf, math.nan])
+def test_simplify_not_finite(number: float) -> None:
+    # Like terms only cancel out, and zero only absorbs them, when finite.
+    other: Number = prop("other")
+    zero = BinaryOperation(6, " - ", 1, 1)
+    for value in (
+        NUMBER - NUMBER + 1,
+        NUMBER + other - NUMBER,
+        BinaryOperation(7, " * ", zero, sqrt(NUMBER)),
+    ):
+        row = {"number": number, "other": 2}
+        assert math.isnan(evaluate(simplify(value), row))
+
+
+def test_simplify_unknown_types() -> None:
+    # Without a literal the props could be strings, which can't be collected.
+    assert encode(simplify(NUMBER + NUMBER)) == 'prop("number") + prop("number")'
+    assert encode(simplify(STRING + "a" + STRING)) == (
+        'prop("string") + "a" + prop("string")'
+    )
+
+
+def test_simplify_deep() -> None:
+    value = NUMBER
+    for _ in range(10_000):
+        value = value + 1
+
+    assert encode(simplify(value)) == 'prop("number") + 10000'
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (or_(STRING == "A", STRING == "B"), 'test(prop("string"), "^(A|B)$")'),
+        (
+            or_(or_(STRING == "A", "B" == STRING), STRING == "C"),
+            'test(prop("string"), "^(A|B|C)$")',
+        ),
+        (
+            or_(contains(STRING, "a.b"), contains(STRING, "(c)")),
+            'test(prop("string"), "a\\\\.b|\\\\(c\\\\)")',
+        ),
+        (
+            or_(or_(STRING == "A", contains(STRING, "b")), STRING == "C"),
+            'test(prop("string"), "^(A|C)$|b")',
+        ),
+        (
+            and_(STRING != "A", not_(contains(STRING, "b"))),
+            'not test(prop("string"), "^(A)$|b")',
+        ),
+        (
+            not_(or_(STRING == "A", STRING == "B")),
+            'not test(prop("string"), "^(A|B)$")',
+        ),
+        (
+            or_(or_(STRING == "A", BOOLEAN), prop("other") == "B"),
+            'prop("string") == "A" or prop("boolean") or prop("other") == "B"',
+        ),
+        (or_(BOOLEAN, BOOLEAN), 'prop("boolean")'),
+        (
+            and_(and_(BOOLEAN, NUMBER > 1), BOOLEAN),
+            'prop("boolean") and prop("number") > 1',
+        ),
+        (or_(BOOLEAN, not_(BOOLEAN)), "true"),
+        (and_(NUMBER == 1, NUMBER != 1), "false"),
+        (and_(BOOLEAN, True), 'prop("boolean")'),
+        (or_(BOOLEAN, False), 'prop("boolean")'),
+        (not_(not_(BOOLEAN)), 'prop("boolean")'),
+        (not_(NUMBER == 1), 'prop("number") != 1'),
+        (
+            not_(and_(BOOLEAN, NUMBER > 1)),
+            'not prop("boolean") or not (prop("number") > 1)',
+        ),
+        (
+            not_(or_(BOOLEAN, not_(NUMBER == 1))),
+            'not prop("boolean") and prop("number") == 1',
+        ),
+    ],
+)
+def test_simplify_logic(value: Boolean, expected: str) -> None:
+    assert encode(simplify_logic(value)) == expected
+
+
+def test_simplify_logic_regex() -> None:
+    formula = simplify_logic(or_(STRING == "a+b", STRING == "c"))
+    assert isinstance(formula, Function)
+    pattern = formula.args[1]
+    assert isinstance(pattern, str)
+    for text, matches in [("a+b", True), ("c", True), ("aab", False), ("cc", False)]:
+        assert optimize(notion_test(text, pattern)) is matches
+
+
+def test_simplify_logic_deep() -> None:
+    value: Boolean = STRING == "0"
+    for index in range(1, 10_000):
+        value = or_(value, STRING == str(index))
+
+    formula = encode(simplify_logic(value))
+    assert formula.startswith('test(prop("string"), "^(0|1|2|')
+    assert formula.count("test(") == 1
+
+
+NOTES: String = prop("notes")
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (
+            and_(notion_test(NOTES, "urgent"), empty(NOTES)),
+            'empty(prop("notes")) and test(prop("notes"), "urgent")',
+        ),
+        (
+            or_(or_(contains(NOTES, "a"), BOOLEAN), NUMBER > 1),
+            'prop("boolean") or prop("number") > 1 or contains(prop("notes"), "a")',
+        ),
+        (
+            and_(BOOLEAN, NUMBER > 1),
+            'prop("boolean") and prop("number") > 1',
+        ),
+        (
+            select(
+                (and_(STRING == "a", notion_test(NOTES, "x")), 1),
+                (STRING == "b", 2),
+                (STRING == "c", 3),
+                default=0,
+            ),
+            'if(prop("string") == "b", 2, if(prop("string") == "c", 3, '
+            'if(prop("string") == "a" and test(prop("notes"), "x"), 1, 0)))',
+        ),
+        (
+            # Not mutually exclusive, so the order is kept.
+            select(
+                (notion_test(NOTES, "x"), 1),
+                (STRING == "b", 2),
+                default=0,
+            ),
+            'if(test(prop("notes"), "x"), 1, if(prop("string") == "b", 2, 0))',
+        ),
+        (
+            select(
+                (NUMBER == 1, "one"),
+                (notion_test(NOTES, "x"), "x"),
+                (and_(STRING == "a", notion_test(NOTES, "y")), "a"),
+                (STRING == "b", "b"),
+                default="",
+            ),
+            'if(prop("number") == 1, "one", if(test(prop("notes"), "x"), "x", '
+            'if(prop("string") == "b", "b", '
+            'if(prop("string") == "a" and test(prop("notes"), "y"), "a", ""))))',
+        ),
+    ],
+)
+def test_reorder(value: Expr, expected: str) -> None:
+    assert encode(reorder(value)) == expected
+
+
+def test_reorder_unchanged() -> None:
+    value = select((STRING == "a", 1), (STRING == "b", 2), default=0)
+    assert reorder(value) is value
+
+
+def test_reorder_deep() -> None:
+    value = select(
+        *((STRING == str(index), index) for index in range(10_000)), default=0
+    )
+    value = if_(and_(NUMBER > 1, notion_test(NOTES, "x")), 1, value)
+    assert reorder(value) is value
+
+
+def test_profile() -> None:
+    value = select(
+        (STRING == "a", 1),
+        (STRING == "b", 2),
+        (STRING == "c", 3),
+        default=0,
+    )
+    rows = [{"string": key} for key in "cbcccbxa"]
+    result = profile(value, iter(rows))
+    assert result.rows == 8
+    assert result.hits_of(STRING == "a") == 1
+    assert result.hits_of(STRING == "b") == 2
+    assert result.hits_of(STRING == "c") == 4
+    assert encode(reorder(value, result)) == (
+        'if(prop("string") == "c", 3, if(prop("string") == "b", 2, '
+        'if(prop("string") == "a", 1, 0)))'
+    )
+
+
+def test_profile_exclusive_only() -> None:
+    value = select(
+        (BOOLEAN, 0),
+        (and_(notion_test(NOTES, "x"), STRING == "a"), 1),
+        (STRING == "b", 2),
+        default=3,
+    )
+    rows = [
+        {"boolean": False, "notes": "", "string": "b"},
+        {"boolean": True, "notes": "", "string": "b"},
+        {"boolean": False, "notes": "", "string": "b"},
+    ]
+    # The arms on "string" are exclusive, but not with the first one; the
+    # operands of `and` are still sorted by cost afterwards.
+    assert encode(reorder(value, profile(value, rows))) == (
+        'if(prop("boolean"), 0, if(prop("string") == "b", 2, '
+        'if(prop("string") == "a" and test(prop("notes"), "x"), 1, 3)))'
+    )
+
+
+def test_profile_lazy() -> None:
+    # Only the branch taken is evaluated, so the division by zero in the
+    # other one never happens.
+    value = if_(NUMBER > 0, 1 / NUMBER, 0)
+    assert profile(value, [{"number": 0}, {"number": 2}]).hits_of(NUMBER > 0) == 1
+    assert profile(and_(NUMBER > 0, 1 / NUMBER > 1), [{"number": 0}]).rows == 1
+
+
+def test_profile_shared() -> None:
+    days = if_(NUMBER > 1, NUMBER, 1)
+    result = profile(days * days, [{"number": 2}])
+    assert result.hits_of(NUMBER > 1) == 1
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (
+            select((NUMBER >= 7, 1), (NUMBER >= 10, 2), default=3),
+            'if(prop("number") >= 7, 1, 3)',
+        ),
+        (
+            select((LENGTH >= 7, 1), (LENGTH < 7, 2), default=3),
+            'if(length(prop("string")) >= 7, 1, 2)',
+        ),
+        (
+            if_(NUMBER > 7, 1, if_(NUMBER > 7, 2, 3)),
+            'if(prop("number") > 7, 1, 3)',
+        ),
+        (
+            if_(LENGTH > 365, 1, min(LENGTH / 365, max(LENGTH, 400))),
+            'if(length(prop("string")) > 365, 1, length(prop("string")) / 365)',
+        ),
+        (
+            if_(NUMBER >= 0, abs(NUMBER), 0),
+            'if(prop("number") >= 0, prop("number"), 0)',
+        ),
+        (
+            if_(NUMBER == 3, NUMBER * 2, 0),
+            'if(prop("number") == 3, 6, 0)',
+        ),
+        (
+            if_(and_(NUMBER > 0, NUMBER < 10), sign(NUMBER), -1),
+            'if(prop("number") > 0 and prop("number") < 10, 1, -1)',
+        ),
+        (
+            if_(not_(LENGTH <= 3), if_(LENGTH > 3, "a", "b"), "c"),
+            'if(not (length(prop("string")) <= 3), "a", "c")',
+        ),
+        (
+            if_(or_(LENGTH < 2, LENGTH > 10), 0, max(2, min(10, LENGTH))),
+            'if(length(prop("string")) < 2 or length(prop("string")) > 10, 0, '
+            'length(prop("string")))',
+        ),
+        (if_(NUMBER > 7, 1, if_(NUMBER >= 8, 2, 3)), 'if(prop("number") > 7, 1, 3)'),
+        (sqrt(NUMBER) < 0, "false"),
+        (hour(now()) < 24, "true"),
+        (minute(date_add(now(), 2, "days")) >= 0, "true"),
+        (month(now()) == 12, "false"),
+        (max(hour(now()), 30), "30"),
+        (length(STRING) + 1 > 0, "true"),
+        (floor(sign(LENGTH - 3) * 2) <= 2, "true"),
+        (sign(abs(LENGTH) + 1), "1"),
+        (NUMBER > 1, 'prop("number") > 1'),
+    ],
+)
+def test_simplify_ranges(value: Expr, expected: str) -> None:
+    assert encode(simplify_ranges(value)) == expected
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        if_(sqrt(NUMBER) >= 0, "a", "b"),
+        if_(NUMBER >= 7, 1, if_(NUMBER < 7, 2, 3)),
+        if_(NUMBER > 365, 1, min(NUMBER / 365, max(NUMBER, 400))),
+        if_(not_(NUMBER <= 0), if_(NUMBER > 0, "a", "b"), "c"),
+        abs(NUMBER - NUMBER) >= -3,
+        floor(sign(NUMBER) * 2) <= 2,
+        sign(abs(NUMBER) + 1),
+        if_(log10(NUMBER) < 5, "a", if_(log10(NUMBER) >= 5, "b", "c")),
+        if_(NUMBER / NUMBER > 1, "a", if_(NUMBER / NUMBER <= 1, "b", "c")),
+        if_(to_number(STRING) < 0, "a", format(max(to_number(STRING), 0))),
+        if_(abs(NUMBER * to_number(STRING)) >= 0, "a", "b"),
+    ],
+)
+def test_simplify_ranges_nan(value: Expr) -> None:
+    # Comparisons of values that may be NaN aren't decided. Props may be
+    # infinite or NaN too.
+    assert encode(simplify_ranges(value)) == encode(value)
+    for number in (-1, 0, 4, math.inf, math.nan):
+        row = {"number": number, "string": "x"}
+        result = evaluate(simplify_ranges(value), row)
+        assert repr(result) == repr(evaluate(value, row))
+
+
+def test_simplify_ranges_not_nan() -> None:
+    # A test that is true rules out NaN.
+    value = if_(sqrt(NUMBER) < 5, if_(sqrt(NUMBER) >= 0, "a", "b"), "c")
+    assert encode(simplify_ranges(value)) == ('if(sqrt(prop("number")) < 5, "a", "c")')
+
+
+def test_simplify_ranges_missing_date() -> None:
+    # The parts of a date that may be missing are empty.
+    for value in (hour(DATE) < 24, minute(date_add(DATE, 1, "days")) >= 0):
+        assert encode(simplify_ranges(value)) == encode(value)
+
+
+def test_simplify_ranges_urgency() -> None:
+    days = date_between(now(), DATE, "days")
+    value = select(
+        (days >= 7, 1),
+        (days >= -14, (days + 14.0) * 0.8 / 21.0 + 0.2),
+        default=0.2,
+    )
+    assert simplify_ranges(value) is value
+    assert encode(simplify_ranges(if_(days > 7, min(days, 7), days))) == (
+        'if(dateBetween(now(), prop("date"), "days") > 7, 7, '
+        'dateBetween(now(), prop("date"), "days"))'
+    )
+
+
+def test_simplify_ranges_deep() -> None:
+    tests = ((NUMBER > index, index) for index in range(5000, 0, -1))
+    value = select(*tests, default=-1)
+    value = if_(NUMBER > 10_000, 0, value)
+    assert encode(simplify_ranges(value)).count("if(") == 5001
+
+
+def test_specialize() -> None:
+    project: String = prop("Project")
+    weight: Number = prop("Weight")
+    value = select(
+        (project == "Infra", weight * 2),
+        (contains(project, "Web"), weight + NUMBER),
+        default=0,
+    )
+    assert encode(specialize(value, {"Project": "Infra", "Weight": 1.5})) == "3"
+    assert encode(specialize(value, {"Project": "Web app"})) == (
+        'prop("Weight") + prop("number")'
+    )
+    assert encode(specialize(value, {"Project": "Other"})) == "0"
+    assert encode(specialize(value, {"Weight": 2})) == (
+        'if(prop("Project") == "Infra", 4, if(contains(prop("Project"), "Web"), '
+        '2 + prop("number"), 0))'
+    )
+
+
+def test_specialize_expression() -> None:
+    value = if_(BOOLEAN, NUMBER, 0)
+    assert encode(specialize(value, {"boolean": NUMBER > 1})) == (
+        'if(prop("number") > 1, prop("number"), 0)'
+    )
+    assert specialize(value, {}) is value
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (
+            date_add(date_add(DATE, 3, "days"), 4, "days"),
+            'dateAdd(prop("date"), 1, "weeks")',
+        ),
+        (
+            date_add(date_add(DATE, 1, "weeks"), 2, "days"),
+            'dateAdd(prop("date"), 9, "days")',
+        ),
+        (
+            date_subtract(date_add(DATE, 2, "hours"), 30, "minutes"),
+            'dateAdd(prop("date"), 90, "minutes")',
+        ),
+        (
+            date_subtract(date_add(DATE, 2, "hours"), 3, "hours"),
+            'dateSubtract(prop("date"), 1, "hours")',
+        ),
+        (date_subtract(date_add(DATE, 2, "days"), 2, "days"), 'prop("date")'),
+        (date_add(DATE, 120, "seconds"), 'dateAdd(prop("date"), 2, "minutes")'),
+        (date_add(DATE, 0, "weeks"), 'prop("date")'),
+        (
+            date_add(date_add(DATE, NUMBER, "hours"), 1, "hours"),
+            'dateAdd(prop("date"), prop("number") + 1, "hours")',
+        ),
+        (
+            date_subtract(date_add(DATE, NUMBER, "minutes"), NUMBER, "minutes"),
+            'dateSubtract(dateAdd(prop("date"), prop("number"), "minutes"), '
+            'prop("number"), "minutes")',
+        ),
+        (
+            date_subtract(date_add(DATE, LENGTH, "minutes"), LENGTH, "minutes"),
+            'prop("date")',
+        ),
+        (
+            date_add(date_add(DATE, 1, "months"), 1, "months"),
+            'dateAdd(dateAdd(prop("date"), 1, "months"), 1, "months")',
+        ),
+        (
+            date_add(date_add(DATE, 1, "days"), 1, "hours"),
+            'dateAdd(dateAdd(prop("date"), 1, "days"), 1, "hours")',
+        ),
+        (date_between(now(), now(), "days"), "0"),
+        (
+            date_between(DATE, DATE, "days"),
+            'dateBetween(prop("date"), prop("date"), "days")',
+        ),
+        (from_timestamp(timestamp(DATE)), 'start(prop("date"))'),
+        (from_timestamp(timestamp(end(DATE))), 'end(prop("date"))'),
+        (end(start(DATE)), 'start(prop("date"))'),
+        (start(now()), "now()"),
+        (start(DATE), 'start(prop("date"))'),
+    ],
+)
+def test_simplify_dates(value: Any, expected: str) -> None:
+    assert encode(simplify_dates(value)) == expected
+
+
+def test_simplify_dates_unchanged() -> None:
+    value = date_add(DATE, NUMBER, "days")
+    assert simplify_dates(value) is value
+    value = date_add(DATE, 1.5, "days")
+    assert simplify_dates(value) is value
+    # Days are rounded on each call, so expression amounts are kept apart.
+    for value in (
+        date_add(date_add(DATE, NUMBER, "days"), NUMBER, "days"),
+        date_subtract(date_add(DATE, NUMBER, "days"), 1, "days"),
+        date_add(date_subtract(DATE, 1, "weeks"), NUMBER, "weeks"),
+    ):
+        assert encode(simplify_dates(value)) == encode(value)
+        row = {"date": datetime.datetime(2024, 1, 10), "number": 0.5}
+        assert evaluate(simplify_dates(value), row) == evaluate(value, row)
+
+
+def test_simplify_dates_range() -> None:
+    # A timestamp is that of the start of a range, so the end is lost.
+    value = end(from_timestamp(timestamp(DATE)))
+    row = {"date": (datetime.datetime(2024, 1, 1), datetime.datetime(2024, 1, 5))}
+    assert evaluate(simplify_dates(value), row) == evaluate(value, row)
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("a" + STRING + "b" + "c", '"a" + prop("string") + "bc"'),
+        (STRING + ("b" + ("c" + STRING)), 'prop("string") + "bc" + prop("string")'),
+        (concat("a", concat(STRING, "b"), "c"), '"a" + prop("string") + "bc"'),
+        (concat(STRING, "") + "", 'prop("string")'),
+        (concat("a", "") + "b", '"ab"'),
+        (join(", ", "a", "b" + "c"), '"a, bc"'),
+        (join(", ", STRING, "b"), 'join(", ", prop("string"), "b")'),
+        (prop("a") + prop("b"), 'prop("a") + prop("b")'),
+        (NUMBER + 1 + 2, 'prop("number") + 1 + 2'),
+    ],
+)
+def test_simplify_strings(value: Any, expected: str) -> None:
+    assert encode(simplify_strings(value)) == expected
+
+
+def test_simplify_strings_concat() -> None:
+    items: list[String] = [prop(str(index)) for index in range(10)]
+    value = concat(*items[:5]) + concat(*items[5:])
+    assert encode(simplify_strings(value)).startswith('concat(prop("0"), prop("1"), ')
+    value = concat(*items[:5]) + concat(*items[5:9])
+    assert encode(simplify_strings(value)).startswith('prop("0") + prop("1") + ')
+
+
+def test_simplify_strings_deep() -> None:
+    value: String = STRING
+    for _ in range(10000):
+        value = value + "x" + STRING
+    formula = encode(simplify_strings(value))
+    assert formula.startswith('concat(prop("string"), "x", prop("string"), "x", ')
@@ -0,0 +1,73 @@
+import concurrent.futures
+import datetime
+import os
+from typing import Any, Dict, List
+
+import pytest
+
+from notion_formulas import (
+    Boolean,
+    Date,
+    Number,
+    String,
+    concat,
+    date_add,
+    evaluate,
+    evaluate_parallel,
+    format,
+    id,
+    if_,
+    now,
+    prop,
+)
+
+BOOLEAN: Boolean = prop("boolean")
+DATE: Date = prop("date")
+NUMBER: Number = prop("number")
+STRING: String = prop("string")
+
+UTC = datetime.timezone.utc
+NOW = datetime.datetime(2024, 1, 31, 14, 30, tzinfo=UTC)
+ROWS: List[Dict[str, Any]] = [
+    {
+        "boolean": index % 3 == 0,
+        "date": datetime.datetime(2024, 1, 1 + index % 28, tzinfo=UTC),
+        "number": index,
+        "string": f"row {index}",
+    }
+    for index in range(100)
+]
+
+
+def test_evaluate_parallel() -> None:
+    twice = if_(BOOLEAN, NUMBER * 2, NUMBER)
+    value = concat(STRING, ": ", format(twice + twice), " ", id())
+    results = evaluate_parallel(value, ROWS, workers=2, chunk_size=7, page_id="page")
+    assert results == [evaluate(value, row, page_id="page") for row in ROWS]
+
+
+def test_evaluate_parallel_lazy() -> None:
+    # Rows can be any iterable, and `now()` is the same in every worker.
+    value = if_(NUMBER > 50, date_add(now(), NUMBER, "days"), DATE)
+    results = evaluate_parallel(value, iter(ROWS), workers=2, now=NOW)
+    assert results == [evaluate(value, row, now=NOW) for row in ROWS]
+    assert evaluate_parallel(NUMBER + 1, [], workers=2) == []
+
+
+def test_evaluate_parallel_serial(monkeypatch: pytest.MonkeyPatch) -> None:
+    # With a single CPU, rows are evaluated in this process.
+    monkeypatch.setattr(os, "cpu_count", lambda: 1)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", None)
+    value = if_(NUMBER > 50, date_add(now(), NUMBER, "days"), DATE)
+    results = evaluate_parallel(value, iter(ROWS), chunk_size=7, now=NOW)
+    assert results == [evaluate(value, row, now=NOW) for row in ROWS]
+
+
+def test_evaluate_parallel_errors() -> None:
+    rows = [*ROWS, {**ROWS[0], "number": "3"}]
+    with pytest.raises(TypeError, match="expected a number"):
+        evaluate_parallel(NUMBER * 2, rows, workers=2, chunk_size=10)
+    with pytest.raises(ValueError, match="workers must be positive"):
+        evaluate_parallel(NUMBER, ROWS, workers=0)
+    with pytest.raises(ValueError, match="chunk size must be positive"):
+        evaluate_parallel(NUMBER, ROWS, workers=1, chunk_size=0)
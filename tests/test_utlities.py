@@ -1,13 +1,19 @@
+from typing import Dict, Iterator, Tuple
+
+import pytest
 from syrupy.assertion import SnapshotAssertion
 
 from notion_formulas import (
     Number,
     String,
     encode,
+    evaluate,
     format_number,
     format_percent,
     list_length,
+    lookup,
     lowercase,
+    optimize,
     progressbar,
     prop,
     select,
@@ -74,3 +80,105 @@ def test_progressbar(snapshot: SnapshotAssertion) -> None:
     assert snapshot == encode(progressbar(NUMBER))
     assert snapshot == encode(progressbar(NUMBER, size=3))
     assert snapshot == encode(progressbar(NUMBER, full="X", empty="x"))
+
+
+SCORES = {"Low": 1, "Medium": 2.5, "High": 10, "a.b (c)": -3}
+
+
+def test_lookup_table() -> None:
+    assert encode(lookup(STRING, SCORES, 0)) == (
+        'toNumber(replace(",Low=1,Medium=2.5,High=10,a.b (c)=-3,=0,", "^(?:.*?," + '
+        'replaceAll(replaceAll(prop("string"), "[.*+?^${}()|[\\\\]\\\\\\\\]", '
+        '"\\\\$&"), "[,=]", "(?!)") + "=([^,]*),.*|.*,=([^,]*),)$", "$1$2"))'
+    )
+
+
+@pytest.mark.parametrize(
+    ("key", "expected"),
+    [("Low", 1), ("Medium", 2.5), ("High", 10), ("a.b (c)", -3), ("a_b (c)", 0)],
+)
+def test_lookup_table_values(key: str, expected: float) -> None:
+    assert optimize(lookup(key, SCORES, 0)) == expected
+
+
+def test_lookup_strings() -> None:
+    labels = (("1", "one"), ("2", "two"), ("1", "uno"))
+    assert optimize(lookup("1", labels, "?")) == "one"
+    assert optimize(lookup("2", labels, "?")) == "two"
+    assert optimize(lookup("3", labels, "?")) == "?"
+    assert optimize(lookup("3", labels, STRING)) == optimize(STRING)
+
+
+def test_lookup_generator() -> None:
+    def rows() -> Iterator[Tuple[str, str]]:
+        for index in range(1000):
+            yield f"option {index}", f"label {index}"
+
+    value = lookup(STRING, rows(), "none")
+    assert encode(value).count("replace") == 3
+    assert optimize(lookup("option 999", rows(), "none")) == "label 999"
+
+
+@pytest.mark.parametrize(
+    ("key", "expected"),
+    [("a", "x=1"), ("b", "y"), ("a=x", "?"), ("x=1,b", "?"), ("a,b", "?"), ("", "?")],
+)
+def test_lookup_table_keys(key: str, expected: str) -> None:
+    # Keys containing separators of the table don't match across entries.
+    value = lookup(STRING, {"a": "x=1", "b": "y"}, "?")
+    assert evaluate(value, {"string": key}) == expected
+    assert evaluate(lookup(STRING, {"": "empty"}, "?"), {"string": key}) == (
+        "empty" if key == "" else "?"
+    )
+
+
+def test_lookup_table_default() -> None:
+    value = lookup(STRING, {"x": "y"}, "a,b")
+    assert optimize(lookup("w", {"x": "y"}, "a,b")) == "a,b"
+    assert evaluate(value, {"string": "w"}) == "a,b"
+    value = lookup(STRING, {"x": "y"}, lowercase(STRING))
+    assert encode(value, dialect="2.0") == (
+        'if(prop("string") == "x", "y", lower(prop("string")))'
+    )
+    assert evaluate(value, {"string": "P,Q"}) == "p,q"
+    assert evaluate(value, {"string": "x"}) == "y"
+    score = lookup(STRING, SCORES, NUMBER)
+    assert evaluate(score, {"string": "High", "number": 1}) == 10
+    assert evaluate(score, {"string": "Low,", "number": 5}) == 5
+
+
+@pytest.mark.parametrize(
+    "mapping",
+    [{"a": "x\ny", "b": "z"}, {"a\r": "x", "b": "z"}, {"a": "x", "b": "z\u2028"}],
+)
+def test_lookup_table_line_breaks(mapping: Dict[str, str]) -> None:
+    value = lookup(STRING, mapping, "none")
+    assert "replace" not in encode(value)
+    for key in ("a", "b", "c"):
+        assert evaluate(value, {"string": key}) == mapping.get(key, "none")
+    assert "replace" not in encode(lookup(STRING, {"a": "x"}, "no\nne"))
+
+
+@pytest.mark.parametrize("key", [*range(-1, 12), 2.5])
+def test_lookup_tree(key: float) -> None:
+    mapping = {number: str(number * 10) for number in range(10)}
+    expected = mapping.get(key, "none")  # type: ignore[call-overload]
+    assert optimize(lookup(key, mapping, "none")) == expected
+
+
+def test_lookup_tree_depth() -> None:
+    mapping = {number: f"v{number}" for number in range(1024)}
+    formula = encode(lookup(NUMBER, mapping, "none"))
+    assert formula.count("if(") == 1024 + 511
+    assert formula.startswith('if(prop("number") < 512, if(prop("number") < 256, ')
+
+
+def test_lookup_fallback() -> None:
+    mapping = {"a,b": "x", "c": "y"}
+    assert encode(lookup(STRING, mapping, "z")) == (
+        'if(prop("string") == "a,b", "x", if(prop("string") == "c", "y", "z"))'
+    )
+    assert encode(lookup(STRING, {"a": NUMBER}, 0)) == (
+        'if(prop("string") == "a", prop("number"), 0)'
+    )
+    assert encode(lookup(STRING, {}, "z")) == '"z"'